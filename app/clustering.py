@@ -0,0 +1,143 @@
+import logging
+import math
+import os
+from app.geo import project
+
+# Grid cells are CELL_PIXELS wide on a 256 px tile, so a 1920x1080 viewport
+# never spans more than a few hundred cells whatever the zoom.
+CELL_PIXELS = 64
+TILE_PIXELS = 256
+
+
+class ClusterIndex:
+    """
+    Hierarchical grid of stored places for viewport queries.
+
+    For every zoom level up to max_zoom the index keeps one aggregate per
+    occupied grid cell (count and sums of coordinates and point indexes),
+    so a viewport query only visits the cells it covers. Beyond max_zoom the
+    individual places of the finest grid are returned. Aggregates are sums so
+    a place can be taken out of its cells again when it is updated.
+    """
+
+    def __init__(self, max_zoom=None):
+        self.max_zoom = int(os.getenv("CLUSTER_MAX_ZOOM", 16)) if max_zoom is None else max_zoom
+        self.place_ids = {}
+        self.points = []
+        # levels[zoom][(cell_x, cell_y)] = [count, sum_latitude, sum_longitude, sum_point_index];
+        # with a count of 1 the index sum is the index of the cell's only point
+        self.levels = [{} for _ in range(self.max_zoom + 1)]
+        # Point indexes per cell of the finest level, for zooms past max_zoom
+        self.leaves = {}
+
+    def __len__(self):
+        return len(self.points)
+
+    def cells_per_axis(self, zoom):
+        return (TILE_PIXELS // CELL_PIXELS) << zoom
+
+    def add(self, place_id, name, rating, latitude, longitude, replace=False):
+        """
+        Index a place; a place already indexed is left alone unless `replace`
+        is set, in which case its values and location are overwritten.
+        """
+        if latitude is None or longitude is None:
+            return False
+        index = self.place_ids.get(place_id)
+        if index is None:
+            index = self.place_ids[place_id] = len(self.points)
+            self.points.append((place_id, name, rating, latitude, longitude))
+        elif not replace:
+            return False
+        else:
+            _, _, _, old_latitude, old_longitude = self.points[index]
+            self.points[index] = (place_id, name, rating, latitude, longitude)
+            if (old_latitude, old_longitude) == (latitude, longitude):
+                return True
+            self.shift(index, old_latitude, old_longitude, -1)
+        self.shift(index, latitude, longitude, 1)
+        return True
+
+    def shift(self, index, latitude, longitude, sign):
+        """Add (sign 1) or remove (sign -1) a point at the given location in the cells of every level."""
+        x, y = project(latitude, longitude)
+        for zoom, cells in enumerate(self.levels):
+            n = self.cells_per_axis(zoom)
+            key = (min(int(x * n), n - 1), min(int(y * n), n - 1))
+            cell = cells.setdefault(key, [0, 0.0, 0.0, 0])
+            cell[0] += sign
+            cell[1] += sign * latitude
+            cell[2] += sign * longitude
+            cell[3] += sign * index
+            if cell[0] == 0:
+                del cells[key]
+        # key now holds the cell at max_zoom, the finest level
+        leaf = self.leaves.setdefault(key, [])
+        if sign > 0:
+            leaf.append(index)
+        else:
+            leaf.remove(index)
+            if not leaf:
+                del self.leaves[key]
+
+    def add_many(self, rows, replace=()):
+        """Index (place_id, name, rating, latitude, longitude) rows; known places are updated only if their id is in `replace`."""
+        added = sum(1 for row in rows if self.add(*row, replace=row[0] in replace))
+        logging.debug(f"Cluster index: added or updated {added} places, {len(self.points)} total.")
+        return added
+
+    def cell_ranges(self, zoom, north, south, east, west):
+        """Cell x and y ranges covered by a bounding box, split at the antimeridian."""
+        n = self.cells_per_axis(zoom)
+        x_west, y_north = project(north, west)
+        x_east, y_south = project(south, east)
+        y_range = (min(int(y_north * n), n - 1), min(int(y_south * n), n - 1))
+        if west <= east:
+            return [((min(int(x_west * n), n - 1), min(int(x_east * n), n - 1)), y_range)]
+        return [((min(int(x_west * n), n - 1), n - 1), y_range), ((0, min(int(x_east * n), n - 1)), y_range)]
+
+    def covered(self, cells, ranges):
+        """Occupied cells inside the ranges, visiting whichever of the two is smaller."""
+        for (x_min, x_max), (y_min, y_max) in ranges:
+            area = (x_max - x_min + 1) * (y_max - y_min + 1)
+            if area > len(cells):
+                for (x, y), cell in cells.items():
+                    if x_min <= x <= x_max and y_min <= y <= y_max:
+                        yield cell
+                continue
+            for x in range(x_min, x_max + 1):
+                for y in range(y_min, y_max + 1):
+                    cell = cells.get((x, y))
+                    if cell is not None:
+                        yield cell
+
+    def in_box(self, index, north, south, east, west):
+        """Whether a point lies inside the bounding box, which wraps when it crosses the antimeridian."""
+        latitude, longitude = self.points[index][3:]
+        if not south <= latitude <= north:
+            return False
+        if west <= east:
+            return west <= longitude <= east
+        return longitude >= west or longitude <= east
+
+    def point_dict(self, index):
+        place_id, name, rating, latitude, longitude = self.points[index]
+        return {"place_id": place_id, "name": name, "rating": rating,
+                "latitude": latitude, "longitude": longitude, "count": 1}
+
+    def query(self, north, south, east, west, zoom):
+        """Clusters and single places visible in the bounding box at the given zoom."""
+        zoom = max(0, int(math.floor(zoom)))
+        if zoom > self.max_zoom:
+            ranges = self.cell_ranges(self.max_zoom, north, south, east, west)
+            return [self.point_dict(index)
+                    for indexes in self.covered(self.leaves, ranges)
+                    for index in indexes
+                    if self.in_box(index, north, south, east, west)]
+        results = []
+        for count, sum_latitude, sum_longitude, index_sum in self.covered(self.levels[zoom], self.cell_ranges(zoom, north, south, east, west)):
+            if count == 1:
+                results.append(self.point_dict(index_sum))
+            else:
+                results.append({"latitude": sum_latitude / count, "longitude": sum_longitude / count, "count": count})
+        return results
@@ -0,0 +1,231 @@
+import asyncio
+import logging
+import os
+from app.database.queries import CELL_LOOKUP_QUERY
+from app.metrics import metrics
+
+
+class CellTopPlaces:
+    """
+    Precomputed ranking per cache cell in cell_top_places: the top CELL_TOP_N
+    place ids of each coordinate that has been ranked, so a read is one
+    primary-key lookup instead of a sort.
+
+    Stores mark the cells they touch stale in their own transaction, bumping
+    a generation; a background loop re-ranks stale cells in batches every
+    CELL_REFRESH_SECONDS or when woken. A refresh is only written if the
+    generation is unchanged, so a store that lands while a cell is being
+    ranked leaves it stale for the next round. Stale cells are never served.
+
+    Reads are recorded in memory and written to last_read_at by the same
+    loop, which deletes cells not read for CELL_TOP_IDLE_SECONDS so refresh
+    work follows the cells in use. Keep it above CACHE_TTL: a pruned cell
+    that is registered again starts over at generation 0.
+    """
+
+    def __init__(self, top_n=None, batch_size=None, refresh_interval=None, idle_seconds=None):
+        self.top_n = int(os.getenv("CELL_TOP_N", 10)) if top_n is None else top_n
+        self.batch_size = int(os.getenv("CELL_REFRESH_BATCH", 100)) if batch_size is None else batch_size
+        self.refresh_interval = float(os.getenv("CELL_REFRESH_SECONDS", 1)) if refresh_interval is None else refresh_interval
+        self.idle_seconds = float(os.getenv("CELL_TOP_IDLE_SECONDS", 86400)) if idle_seconds is None else idle_seconds
+        # (latitude, longitude) of cells read since the last write of last_read_at
+        self.reads = set()
+        self.pool = None
+        self.rank_many = None
+        self.task = None
+        self.stopping = False
+        self._wakeup = None
+
+    @property
+    def running(self):
+        return self.task is not None and not self.task.done()
+
+    def start(self, pool, rank_many):
+        """Refresh stale cells with `rank_many(coordinates, k)`, which returns one ranked list per coordinate."""
+        self.pool = pool
+        self.rank_many = rank_many
+        self._wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+
+    def wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def touch(self, latitude, longitude):
+        """Record a read of a cell, so it is not pruned; written by the refresh loop."""
+        if self.running:
+            self.reads.add((latitude, longitude))
+
+    async def run(self):
+        while not self.stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.refresh_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                # Keep going while whole batches come back, so a burst of stale cells drains quickly
+                while not self.stopping and await self.refresh() == self.batch_size:
+                    pass
+                await self.record_reads()
+                await self.prune()
+                await self.update_lag_metric()
+            except Exception as e:
+                logging.error(f"Cell ranking refresh failed: {e}")
+
+    async def refresh(self):
+        """Re-rank the oldest batch of stale cells; returns how many were looked at."""
+        async with self.pool.acquire() as conn:
+            cells = await conn.fetch('''
+                SELECT latitude, longitude, generation FROM cell_top_places
+                WHERE stale_since IS NOT NULL
+                ORDER BY stale_since
+                LIMIT $1
+            ''', self.batch_size, statement="select_stale_cells")
+        if not cells:
+            return 0
+        rankings = await self.rank_many([(cell["latitude"], cell["longitude"]) for cell in cells], self.top_n)
+        # Written in the order mark_stale locks cells in, so the two never deadlock
+        updates = sorted((cell["latitude"], cell["longitude"], [place["place_id"] for place in places], cell["generation"])
+                         for cell, places in zip(cells, rankings))
+        async with self.pool.acquire() as conn:
+            await conn.executemany('''
+                UPDATE cell_top_places
+                SET place_ids = $3, stale_since = NULL, refreshed_at = NOW()
+                WHERE latitude = $1 AND longitude = $2 AND generation = $4
+            ''', updates, statement="update_cell_rankings")
+        metrics["cell_rankings_counter"].labels(outcome="refreshed").inc(len(cells))
+        logging.debug(f"Refreshed the ranking of {len(cells)} cells.")
+        return len(cells)
+
+    async def record_reads(self):
+        """Write last_read_at of the cells read since the last call; returns how many were recorded."""
+        if not self.reads:
+            return 0
+        reads, self.reads = sorted(self.reads), set()
+        try:
+            async with self.pool.acquire() as conn:
+                # Locked in the order mark_stale locks cells in, so the two never deadlock
+                await conn.execute('''
+                    UPDATE cell_top_places SET last_read_at = NOW()
+                    WHERE (latitude, longitude) IN (
+                        SELECT latitude, longitude FROM cell_top_places
+                        WHERE (latitude, longitude) IN (SELECT * FROM unnest($1::real[], $2::real[]))
+                        ORDER BY latitude, longitude
+                        FOR UPDATE
+                    )
+                ''', [latitude for latitude, _ in reads], [longitude for _, longitude in reads], statement="record_cell_reads")
+        except Exception:
+            self.reads.update(reads)
+            raise
+        return len(reads)
+
+    async def prune(self):
+        """Delete a batch of cells not read for idle_seconds; returns how many were deleted."""
+        async with self.pool.acquire() as conn:
+            # Cells a store has locked are skipped; they are in use
+            status = await conn.execute('''
+                DELETE FROM cell_top_places
+                WHERE (latitude, longitude) IN (
+                    SELECT latitude, longitude FROM cell_top_places
+                    WHERE last_read_at < NOW() - make_interval(secs => $1)
+                    ORDER BY latitude, longitude
+                    LIMIT $2
+                    FOR UPDATE SKIP LOCKED
+                )
+            ''', self.idle_seconds, self.batch_size, statement="prune_cells")
+        pruned = int(status.split()[-1])
+        if pruned:
+            metrics["cell_rankings_counter"].labels(outcome="pruned").inc(pruned)
+            logging.debug(f"Pruned {pruned} cells not read for {self.idle_seconds:.0f} s.")
+        return pruned
+
+    async def update_lag_metric(self):
+        async with self.pool.acquire() as conn:
+            lag = await conn.fetchval('''
+                SELECT COALESCE(EXTRACT(EPOCH FROM NOW() - MIN(stale_since)), 0)::float8
+                FROM cell_top_places WHERE stale_since IS NOT NULL
+            ''', statement="cell_rankings_lag")
+        metrics["cell_rankings_lag_gauge"].set(lag)
+
+    async def lookup(self, conn, latitude, longitude):
+        """
+        The stored ranking of a cell, as rank_nearby_places_page returns it,
+        or None if the cell has not been ranked yet or is stale.
+        """
+        self.touch(latitude, longitude)
+        rows = await conn.fetch(CELL_LOOKUP_QUERY, latitude, longitude, statement="lookup_cell")
+        if not rows:
+            metrics["cell_rankings_counter"].labels(outcome="miss").inc()
+            return None
+        metrics["cell_rankings_counter"].labels(outcome="hit").inc()
+        places = []
+        for row in rows:
+            if row["place_id"] is not None:
+                place = dict(row)
+                del place["position"]
+                places.append(place)
+        return places
+
+    async def register(self, conn, latitude, longitude, tile_keys):
+        """
+        Start maintaining a cell, ranked by the next refresh; returns its
+        generation. A cell already there, even one inserted by a concurrent
+        transaction, only has its last_read_at updated.
+        """
+        generation = await conn.fetchval('''
+            INSERT INTO cell_top_places (latitude, longitude, tile_keys, place_ids, stale_since, last_read_at)
+            VALUES ($1, $2, $3, '{}', NOW(), NOW())
+            ON CONFLICT (latitude, longitude) DO UPDATE SET last_read_at = NOW()
+            RETURNING generation
+        ''', latitude, longitude, tile_keys, statement="register_cell")
+        self.wake()
+        return generation
+
+    async def mark_stale(self, conn, latitude, longitude, place_ids, tile_keys):
+        """
+        Mark stale every cell whose candidates may have changed: the cell of
+        the query point, cells at the query points of the given places and
+        cells covered by `tile_keys` or any tile linked to those places.
+        Run it in the transaction that stores the places. Returns the
+        (latitude, longitude, generation) of the cells marked.
+
+        The cells are locked in (latitude, longitude) order before they are
+        updated, so concurrent stores touching overlapping cells, such as
+        sibling tiles fetched together, wait for each other instead of
+        deadlocking.
+        """
+        cells = await conn.fetch('''
+            WITH places AS (
+                SELECT id, latitude, longitude FROM google_nearby_places WHERE place_id = ANY($3::text[])
+            ),
+            tiles AS (
+                SELECT ARRAY(
+                    SELECT tile_key FROM tile_places WHERE place_row_id IN (SELECT id FROM places)
+                    UNION
+                    SELECT unnest($4::bigint[])
+                ) AS keys
+            )
+            SELECT latitude, longitude FROM cell_top_places
+            WHERE (latitude = $1::real AND longitude = $2::real)
+                OR (latitude, longitude) IN (SELECT latitude, longitude FROM places)
+                OR tile_keys && (SELECT keys FROM tiles)
+            ORDER BY latitude, longitude
+            FOR UPDATE
+        ''', latitude, longitude, place_ids, tile_keys, statement="lock_stale_cells")
+        if not cells:
+            return []
+        return await conn.fetch('''
+            UPDATE cell_top_places cell
+            SET generation = generation + 1, stale_since = COALESCE(stale_since, NOW())
+            FROM unnest($1::real[], $2::real[]) AS locked(latitude, longitude)
+            WHERE cell.latitude = locked.latitude AND cell.longitude = locked.longitude
+            RETURNING cell.latitude, cell.longitude, cell.generation
+        ''', [cell["latitude"] for cell in cells], [cell["longitude"] for cell in cells], statement="mark_cells_stale")
+
+    async def stop(self):
+        if self.task is not None:
+            self.stopping = True
+            self._wakeup.set()
+            await self.task
+            self.task = None
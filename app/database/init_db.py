@@ -3,6 +3,7 @@ import asyncpg
 import logging
 from dotenv import load_dotenv
 import asyncio
+from app.database.migrations import migrate
 
 # Load environment variables
 load_dotenv()
@@ -20,43 +21,11 @@ async def get_db_connection():
 
 async def init_db():
     """
-    Initialize the database tables asynchronously.
+    Bring the database schema up to date by applying pending migrations.
     """
     conn = await get_db_connection()
     try:
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS user_coordinates (
-                id SERIAL PRIMARY KEY,
-                visitor_id TEXT,
-                latitude REAL,
-                longitude REAL,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(latitude, longitude)
-            )
-        ''')
-
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS google_nearby_places (
-                id SERIAL PRIMARY KEY,
-                latitude REAL,
-                longitude REAL,
-                place_id TEXT UNIQUE,
-                name TEXT,
-                business_status TEXT,
-                rating REAL,
-                user_ratings_total INTEGER,
-                vicinity TEXT,
-                types TEXT,
-                price_level INTEGER,
-                icon TEXT,
-                icon_background_color TEXT,
-                icon_mask_base_uri TEXT,
-                photo_reference TEXT,
-                photo_height INTEGER,
-                photo_width INTEGER,
-                open_now BOOLEAN
-            )
-        ''')
+        await migrate(conn)
         logging.info("Database initialized successfully.")
     except Exception as e:
         logging.error(f"Error initializing database: {e}")
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import os
+import time
+from app.metrics import metrics
+
+
+def redact(value):
+    """Placeholder for a query parameter in logs: its type, and its length for sequences."""
+    if isinstance(value, (list, tuple)):
+        return f"<{type(value).__name__}[{len(value)}]>"
+    return f"<{type(value).__name__}>"
+
+
+class InstrumentedPool:
+    """
+    Wraps an asyncpg pool to export acquire wait times, connections in use
+    and idle, and query latencies through the Prometheus metrics.
+
+    Queries are labelled with the `statement=` name passed at the call site,
+    "unnamed" without one. Queries slower than DB_SLOW_QUERY_MS are logged
+    with their parameters redacted. Like asyncpg, acquire() can be used with
+    `async with` or awaited and handed back through release().
+    """
+
+    def __init__(self, pool, name, slow_query_ms=None):
+        self.pool = pool
+        self.name = name
+        self.slow_query_seconds = (float(os.getenv("DB_SLOW_QUERY_MS", 200)) if slow_query_ms is None else slow_query_ms) / 1000
+        metrics["db_connections_gauge"].labels(pool=name, state="idle").set_function(pool.get_idle_size)
+        metrics["db_connections_gauge"].labels(pool=name, state="in_use").set_function(
+            lambda: pool.get_size() - pool.get_idle_size())
+
+    def __getattr__(self, name):
+        return getattr(self.pool, name)
+
+    def acquire(self, timeout=None):
+        return InstrumentedAcquire(self, timeout)
+
+    async def release(self, connection, **kwargs):
+        if isinstance(connection, InstrumentedConnection):
+            connection = connection.connection
+        return await self.pool.release(connection, **kwargs)
+
+    async def connect(self, timeout=None):
+        """Acquire a connection, observing the wait even when it times out or fails."""
+        start = time.perf_counter()
+        outcome = "ok"
+        try:
+            conn = await self.pool.acquire(timeout=timeout)
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            raise
+        except BaseException:
+            outcome = "error"
+            raise
+        finally:
+            metrics["db_acquire_histogram"].labels(pool=self.name, outcome=outcome).observe(time.perf_counter() - start)
+        return InstrumentedConnection(conn, self.slow_query_seconds)
+
+
+class InstrumentedAcquire:
+    """Result of InstrumentedPool.acquire(): awaitable, or an async context manager that releases on exit."""
+
+    def __init__(self, pool, timeout):
+        self.pool = pool
+        self.timeout = timeout
+        self.connection = None
+
+    def __await__(self):
+        return self.pool.connect(self.timeout).__await__()
+
+    async def __aenter__(self):
+        self.connection = await self.pool.connect(self.timeout)
+        return self.connection
+
+    async def __aexit__(self, *exc_info):
+        connection, self.connection = self.connection, None
+        await self.pool.release(connection)
+
+
+class InstrumentedConnection:
+    """A pooled connection whose queries are timed; everything else is passed through."""
+
+    def __init__(self, connection, slow_query_seconds):
+        self.connection = connection
+        self.slow_query_seconds = slow_query_seconds
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+    async def timed(self, statement, method, query, args, kwargs, params):
+        start = time.perf_counter()
+        try:
+            return await method(query, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics["db_query_histogram"].labels(statement=statement).observe(elapsed)
+            if elapsed >= self.slow_query_seconds:
+                metrics["db_slow_queries_counter"].labels(statement=statement).inc()
+                sql = " ".join(query.split())[:500]
+                logging.warning(f"Slow query {statement} took {elapsed * 1000:.0f} ms: {sql} with {params}")
+
+    async def execute(self, query, *args, statement="unnamed", **kwargs):
+        return await self.timed(statement, self.connection.execute, query, args, kwargs,
+                                [redact(arg) for arg in args])
+
+    async def executemany(self, query, args, statement="unnamed", **kwargs):
+        return await self.timed(statement, self.connection.executemany, query, (args,), kwargs,
+                                f"<{len(args)} rows>")
+
+    async def fetch(self, query, *args, statement="unnamed", **kwargs):
+        return await self.timed(statement, self.connection.fetch, query, args, kwargs,
+                                [redact(arg) for arg in args])
+
+    async def fetchrow(self, query, *args, statement="unnamed", **kwargs):
+        return await self.timed(statement, self.connection.fetchrow, query, args, kwargs,
+                                [redact(arg) for arg in args])
+
+    async def fetchval(self, query, *args, statement="unnamed", **kwargs):
+        return await self.timed(statement, self.connection.fetchval, query, args, kwargs,
+                                [redact(arg) for arg in args])
@@ -0,0 +1,180 @@
+import asyncio
+import json
+import logging
+import os
+import asyncpg
+from app.database.init_db import get_db_connection
+from app.metrics import metrics
+
+# Postgres drops NOTIFY payloads of 8000 bytes or more
+MAX_NOTIFY_BYTES = 7900
+
+
+def cell_key(latitude, longitude):
+    """Cache key of a cell, as the services build it from rounded coordinates."""
+    return f"{round(latitude, 4)}_{round(longitude, 4)}"
+
+
+class CacheInvalidator:
+    """
+    Evicts cached ranked payloads in every process when another one stores
+    places for their cells. Stores NOTIFY the affected cells with their new
+    generation on CACHE_INVALIDATION_CHANNEL, in the storing transaction so
+    the message goes out on commit; each process LISTENs on a dedicated
+    connection and pops those keys from its cache. Stores only find cells
+    listed in cell_top_places, so the services register the cell of every
+    payload they cache, whichever ranking engine produced it.
+
+    Notifications sent while the listener is disconnected are lost, so each
+    cached entry also remembers the cell generation it was ranked from. Every
+    CACHE_VERSION_CHECK_SECONDS, and right after (re)connecting, the cached
+    cells' generations are read back in one query and entries whose cell has
+    moved on are evicted.
+
+    The same keys are popped from `linked_caches`, which hold what the
+    payloads are built from. `on_change` is called on every notification
+    and version-check eviction; the services pass DatabasePools.wrote, so
+    an evicted payload is ranked again on the primary rather than from a
+    replica that has not replayed the store yet, which would cache the old
+    ranking under the old generation until the next version check.
+    """
+
+    def __init__(self, channel=None, check_interval=None):
+        self.channel = os.getenv("CACHE_INVALIDATION_CHANNEL", "places_changed") if channel is None else channel
+        self.check_interval = float(os.getenv("CACHE_VERSION_CHECK_SECONDS", 60)) if check_interval is None else check_interval
+        # cache key -> (latitude, longitude, cell generation the entry was ranked from)
+        self.versions = {}
+        self.cache = None
+        self.linked_caches = []
+        self.on_change = None
+        self.pool = None
+        self.connection = None
+        self.task = None
+        self.stopping = False
+        self._wakeup = None
+
+    @property
+    def running(self):
+        return self.task is not None and not self.task.done()
+
+    def start(self, pool, cache, linked_caches=(), on_change=None):
+        self.pool = pool
+        self.cache = cache
+        self.linked_caches = list(linked_caches)
+        self.on_change = on_change
+        self._wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while not self.stopping:
+            if self.connection is None or self.connection.is_closed():
+                try:
+                    await self.listen()
+                except Exception as e:
+                    logging.warning(f"Cache invalidation listener could not connect: {e}")
+                    self.connection = None
+            try:
+                await self.check_versions()
+            except Exception as e:
+                logging.error(f"Cache version check failed: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.check_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def listen(self):
+        self.connection = await get_db_connection()
+        # Wake the loop on a lost connection so it reconnects and runs the version check at once
+        self.connection.add_termination_listener(lambda connection: self._wakeup.set())
+        await self.connection.add_listener(self.channel, self.on_notification)
+        logging.info(f"Listening for cache invalidations on {self.channel}")
+
+    def on_notification(self, connection, pid, channel, payload):
+        try:
+            cells = json.loads(payload)
+        except ValueError:
+            logging.warning(f"Ignoring malformed cache invalidation: {payload[:100]}")
+            return
+        if self.on_change is not None:
+            self.on_change()
+        evicted = self.evict(cell_key(latitude, longitude) for latitude, longitude, _ in cells)
+        metrics["cache_invalidations_counter"].labels(source="notify").inc(evicted)
+
+    def evict(self, keys):
+        evicted = 0
+        for key in keys:
+            self.versions.pop(key, None)
+            for cache in self.linked_caches:
+                cache.pop(key, None)
+            if self.cache.pop(key, None) is not None:
+                evicted += 1
+        return evicted
+
+    async def cell_version(self, pool, latitude, longitude):
+        """
+        Generation of a cell as seen through `pool`, None if the cell is not
+        tracked in cell_top_places or cannot be read; the version check then
+        evicts the entry once the cell has a generation.
+        """
+        try:
+            async with pool.acquire() as conn:
+                return await conn.fetchval(
+                    "SELECT generation FROM cell_top_places WHERE latitude = $1::real AND longitude = $2::real",
+                    latitude, longitude, statement="cell_version")
+        except (OSError, asyncpg.PostgresError) as e:
+            logging.warning(f"Could not read the version of cell ({latitude}, {longitude}): {e}")
+            return None
+
+    def track(self, key, latitude, longitude, version):
+        self.versions[key] = (latitude, longitude, version)
+
+    async def check_versions(self):
+        """Evict cached entries whose cell generation differs from the one they were ranked from."""
+        for key in [key for key in self.versions if key not in self.cache]:
+            del self.versions[key]
+        if not self.versions:
+            return 0
+        keys = list(self.versions)
+        tracked = [self.versions[key] for key in keys]
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch('''
+                SELECT cell_top_places.generation
+                FROM unnest($1::real[], $2::real[]) WITH ORDINALITY AS keys(latitude, longitude, position)
+                LEFT JOIN cell_top_places USING (latitude, longitude)
+                ORDER BY keys.position
+            ''', [latitude for latitude, _, _ in tracked], [longitude for _, longitude, _ in tracked], statement="check_cell_versions")
+        evicted = self.evict(key for key, (_, _, version), row in zip(keys, tracked, rows) if row["generation"] != version)
+        metrics["cache_invalidations_counter"].labels(source="version_check").inc(evicted)
+        if evicted:
+            if self.on_change is not None:
+                self.on_change()
+            logging.info(f"Version check evicted {evicted} cached payloads.")
+        return evicted
+
+    async def notify(self, conn, cells):
+        """NOTIFY the (latitude, longitude, generation) of changed cells, split to fit the payload limit."""
+        chunks, chunk, size = [], [], 2
+        for latitude, longitude, generation in cells:
+            item = [round(latitude, 4), round(longitude, 4), generation]
+            item_size = len(json.dumps(item, separators=(",", ":"))) + 1
+            if chunk and size + item_size > MAX_NOTIFY_BYTES:
+                chunks.append(chunk)
+                chunk, size = [], 2
+            chunk.append(item)
+            size += item_size
+        if chunk:
+            chunks.append(chunk)
+        for chunk in chunks:
+            await conn.execute("SELECT pg_notify($1, $2)", self.channel, json.dumps(chunk, separators=(",", ":")),
+                               statement="notify_cells")
+
+    async def stop(self):
+        if self.task is not None:
+            self.stopping = True
+            self._wakeup.set()
+            await self.task
+            self.task = None
+        if self.connection is not None and not self.connection.is_closed():
+            await self.connection.close()
+        self.connection = None
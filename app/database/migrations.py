@@ -0,0 +1,254 @@
+import asyncio
+import json
+import logging
+import sys
+from app.database.queries import CHECK_COORDINATES_QUERY, CELL_LOOKUP_QUERY, rank_page_sql, type_filter_sql
+
+# Arbitrary key for pg_advisory_lock, so concurrent deploys apply migrations one at a time
+MIGRATION_LOCK_ID = 727_001
+
+# (version, name, statements), applied in order, each in its own transaction.
+# Never edit an applied migration; add a new one.
+MIGRATIONS = [
+    (1, "baseline", [
+        '''
+        CREATE TABLE IF NOT EXISTS user_coordinates (
+            id SERIAL PRIMARY KEY,
+            visitor_id TEXT,
+            latitude REAL,
+            longitude REAL,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(latitude, longitude)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS google_nearby_places (
+            id SERIAL PRIMARY KEY,
+            latitude REAL,
+            longitude REAL,
+            place_id TEXT UNIQUE,
+            name TEXT,
+            business_status TEXT,
+            rating REAL,
+            user_ratings_total INTEGER,
+            vicinity TEXT,
+            types TEXT,
+            price_level INTEGER,
+            icon TEXT,
+            icon_background_color TEXT,
+            icon_mask_base_uri TEXT,
+            photo_reference TEXT,
+            photo_height INTEGER,
+            photo_width INTEGER,
+            open_now BOOLEAN,
+            place_latitude REAL,
+            place_longitude REAL
+        )
+        ''',
+        # Location of the place itself; latitude/longitude above are the query point
+        '''
+        ALTER TABLE google_nearby_places
+            ADD COLUMN IF NOT EXISTS place_latitude REAL,
+            ADD COLUMN IF NOT EXISTS place_longitude REAL
+        ''',
+        # Tiles of the fetch grid that have been searched, shared by every worker
+        '''
+        CREATE TABLE IF NOT EXISTS fetch_tiles (
+            tile_key BIGINT PRIMARY KEY,
+            zoom INTEGER,
+            tile_x INTEGER,
+            tile_y INTEGER,
+            center_latitude REAL,
+            center_longitude REAL,
+            radius_m INTEGER,
+            result_count INTEGER,
+            state TEXT DEFAULT 'leaf',
+            fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        # 'leaf' tiles are searched as a whole, 'split' tiles through their four children
+        "ALTER TABLE fetch_tiles ADD COLUMN IF NOT EXISTS state TEXT DEFAULT 'leaf'",
+    ]),
+    (2, "query_point_indexes", [
+        # Ranking reads every place stored under a set of query points
+        '''
+        CREATE INDEX IF NOT EXISTS google_nearby_places_query_point_idx
+            ON google_nearby_places (latitude, longitude)
+        ''',
+        # check_coordinates_in_db is served by the UNIQUE constraint's index; make sure
+        # databases created without it get one too
+        '''
+        CREATE UNIQUE INDEX IF NOT EXISTS user_coordinates_latitude_longitude_key
+            ON user_coordinates (latitude, longitude)
+        ''',
+    ]),
+    (3, "place_type_ids", [
+        # Type names are stored once; places reference them by id
+        '''
+        CREATE TABLE IF NOT EXISTS place_types (
+            id SERIAL PRIMARY KEY,
+            name TEXT UNIQUE NOT NULL
+        )
+        ''',
+        "ALTER TABLE google_nearby_places ADD COLUMN IF NOT EXISTS type_ids INTEGER[]",
+        # Backfill from the comma-separated types column, which new rows leave NULL
+        '''
+        INSERT INTO place_types (name)
+        SELECT DISTINCT unnest(string_to_array(types, ',')) FROM google_nearby_places WHERE types <> ''
+        ON CONFLICT (name) DO NOTHING
+        ''',
+        '''
+        UPDATE google_nearby_places places
+        SET type_ids = ARRAY(
+            SELECT place_types.id FROM unnest(string_to_array(places.types, ',')) AS type_name
+            JOIN place_types ON place_types.name = type_name
+        )
+        WHERE type_ids IS NULL AND types <> ''
+        ''',
+        "CREATE INDEX IF NOT EXISTS google_nearby_places_type_ids_idx ON google_nearby_places USING GIN (type_ids)",
+    ]),
+    (4, "place_change_tracking", [
+        # Rows are rewritten only when their content hash changes
+        '''
+        ALTER TABLE google_nearby_places
+            ADD COLUMN IF NOT EXISTS content_hash BYTEA,
+            ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1,
+            ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ''',
+    ]),
+    (5, "tile_places", [
+        # Which places each tile search returned; a place is stored once and linked to every tile that found it
+        '''
+        CREATE TABLE IF NOT EXISTS tile_places (
+            tile_key BIGINT NOT NULL,
+            place_row_id INTEGER NOT NULL REFERENCES google_nearby_places (id) ON DELETE CASCADE,
+            PRIMARY KEY (tile_key, place_row_id)
+        )
+        ''',
+        # Rows stored under a tile centre came from that tile's search
+        '''
+        INSERT INTO tile_places (tile_key, place_row_id)
+        SELECT fetch_tiles.tile_key, places.id
+        FROM fetch_tiles
+        JOIN google_nearby_places places
+            ON places.latitude = fetch_tiles.center_latitude AND places.longitude = fetch_tiles.center_longitude
+        ON CONFLICT DO NOTHING
+        ''',
+    ]),
+    (6, "cell_top_places", [
+        # Ranked top place ids per cache cell, kept current by app.database.cell_rankings
+        '''
+        CREATE TABLE IF NOT EXISTS cell_top_places (
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            tile_keys BIGINT[] NOT NULL,
+            place_ids TEXT[] NOT NULL,
+            generation BIGINT NOT NULL DEFAULT 0,
+            stale_since TIMESTAMP,
+            refreshed_at TIMESTAMP,
+            PRIMARY KEY (latitude, longitude)
+        )
+        ''',
+        # Stores find the cells covered by the tiles they touch
+        "CREATE INDEX IF NOT EXISTS cell_top_places_tile_keys_idx ON cell_top_places USING GIN (tile_keys)",
+        "CREATE INDEX IF NOT EXISTS cell_top_places_stale_idx ON cell_top_places (stale_since) WHERE stale_since IS NOT NULL",
+    ]),
+    (7, "google_quota_usage", [
+        # Google calls per UTC day ("2026-03-10") and month ("2026-03"), counted by every process
+        '''
+        CREATE TABLE IF NOT EXISTS google_quota_usage (
+            period TEXT PRIMARY KEY,
+            calls BIGINT NOT NULL DEFAULT 0
+        )
+        ''',
+    ]),
+    (8, "cell_top_places_last_read", [
+        # Cells not read for CELL_TOP_IDLE_SECONDS are pruned by the refresher
+        "ALTER TABLE cell_top_places ADD COLUMN IF NOT EXISTS last_read_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP",
+        "CREATE INDEX IF NOT EXISTS cell_top_places_last_read_idx ON cell_top_places (last_read_at)",
+    ]),
+]
+
+# Hot queries, built from the SQL the services run, and the tables they must reach through an index, with sample arguments
+RANK_ARGS = (37.7749, -122.4194, 37.7749, -122.4194, [1, 2], 11)
+HOT_QUERIES = {
+    "check_coordinates_in_db": (CHECK_COORDINATES_QUERY, (37.7749, -122.4194), "user_coordinates"),
+    "rank_nearby_places": (rank_page_sql(), RANK_ARGS, "google_nearby_places"),
+    "filter_by_type": (rank_page_sql(f"WHERE {type_filter_sql(7)}"), (*RANK_ARGS, ["cafe"]), "google_nearby_places"),
+    "cell_top_places": (CELL_LOOKUP_QUERY, (37.7749, -122.4194), "cell_top_places"),
+}
+
+
+async def migrate(conn):
+    """Apply pending migrations in order; returns the versions applied."""
+    await conn.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK_ID)
+    try:
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        applied = {row["version"] for row in await conn.fetch("SELECT version FROM schema_migrations")}
+        newly_applied = []
+        for version, name, statements in MIGRATIONS:
+            if version in applied:
+                continue
+            async with conn.transaction():
+                for statement in statements:
+                    await conn.execute(statement)
+                await conn.execute("INSERT INTO schema_migrations (version, name) VALUES ($1, $2)", version, name)
+            logging.info(f"Applied migration {version} {name}")
+            newly_applied.append(version)
+        return newly_applied
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_ID)
+
+
+def plan_scans(plan):
+    """(node type, relation) of every scan node in an EXPLAIN (FORMAT JSON) plan."""
+    scans = []
+    if "Relation Name" in plan:
+        scans.append((plan["Node Type"], plan["Relation Name"]))
+    for child in plan.get("Plans", []):
+        scans.extend(plan_scans(child))
+    return scans
+
+
+async def check_query_plans(conn):
+    """
+    EXPLAIN every hot query and return the ones that still scan their table
+    sequentially, as {query name: scans}. Sequential scans are disabled
+    while planning so small test tables do not hide a missing index.
+    """
+    problems = {}
+    async with conn.transaction():
+        await conn.execute("SET LOCAL enable_seqscan = off")
+        for name, (query, args, table) in HOT_QUERIES.items():
+            explained = await conn.fetchval(f"EXPLAIN (FORMAT JSON) {query}", *args)
+            plan = (json.loads(explained) if isinstance(explained, str) else explained)[0]["Plan"]
+            scans = plan_scans(plan)
+            if any(node == "Seq Scan" and relation == table for node, relation in scans):
+                problems[name] = scans
+    return problems
+
+
+async def main(check=False):
+    from app.database.init_db import get_db_connection
+    conn = await get_db_connection()
+    try:
+        await migrate(conn)
+        if check:
+            problems = await check_query_plans(conn)
+            for name, scans in problems.items():
+                logging.error(f"{name} does not use an index: {scans}")
+            return 1 if problems else 0
+        return 0
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(main(check="--check" in sys.argv)))
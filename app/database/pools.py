@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import os
+import time
+import asyncpg
+from app.database.instrumentation import InstrumentedPool
+from app.metrics import metrics
+
+# Seconds a replica is behind the primary; zero when it has replayed everything it received
+REPLICA_LAG_QUERY = '''
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 0)
+    END::float8
+'''
+
+
+def pool_options(prefix):
+    """asyncpg.create_pool sizing for one pool, from <prefix>_MIN_SIZE/_MAX_SIZE and the shared settings."""
+    return {
+        "min_size": int(os.getenv(f"{prefix}_MIN_SIZE", 2)),
+        "max_size": int(os.getenv(f"{prefix}_MAX_SIZE", 10)),
+        "statement_cache_size": int(os.getenv("DB_STATEMENT_CACHE_SIZE", 100)),
+        "max_inactive_connection_lifetime": float(os.getenv("DB_POOL_MAX_IDLE_SECONDS", 300)),
+    }
+
+
+class DatabasePools:
+    """
+    A write pool on the primary (DATABASE_URL) and, if DATABASE_READ_URL is
+    set, a read pool on a replica. Reads are sent to the replica only while
+    its measured lag is under DB_REPLICA_MAX_LAG_SECONDS, and not right after
+    this process wrote: until the replica has had time to replay a write,
+    reads go to the primary so a process sees its own stores. Both pools
+    are wrapped in InstrumentedPool.
+    """
+
+    def __init__(self, write_url=None, read_url=None, max_lag=None, lag_check_interval=None):
+        self.write_url = os.getenv("DATABASE_URL") if write_url is None else write_url
+        self.read_url = os.getenv("DATABASE_READ_URL") if read_url is None else read_url
+        self.max_lag = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", 5)) if max_lag is None else max_lag
+        self.lag_check_interval = float(os.getenv("DB_REPLICA_LAG_CHECK_SECONDS", 1)) if lag_check_interval is None else lag_check_interval
+        self.write = None
+        self.read = None
+        # Unknown until the first check, so reads start on the primary
+        self.replica_lag = None
+        self.last_write = float("-inf")
+        self.task = None
+        self.stopping = False
+
+    async def connect(self):
+        self.write = InstrumentedPool(await asyncpg.create_pool(dsn=self.write_url, **pool_options("DB_WRITE_POOL")), "write")
+        if self.read_url:
+            try:
+                self.read = InstrumentedPool(await asyncpg.create_pool(dsn=self.read_url, **pool_options("DB_READ_POOL")), "read")
+            except (OSError, asyncpg.PostgresError) as e:
+                logging.warning(f"Read replica unavailable, reading from the primary: {e}")
+        logging.debug(f"Database pools ready, replica {'on' if self.read is not None else 'off'}.")
+
+    def replica_usable(self):
+        if self.read is None or self.replica_lag is None or self.replica_lag > self.max_lag:
+            return False
+        return time.monotonic() - self.last_write > self.replica_lag + self.lag_check_interval
+
+    def reader(self):
+        """Pool for a read that may be served slightly behind the primary."""
+        if self.replica_usable():
+            metrics["db_reads_routed_counter"].labels(pool="replica").inc()
+            return self.read
+        metrics["db_reads_routed_counter"].labels(pool="primary").inc()
+        return self.write
+
+    def wrote(self):
+        """Record a committed write, keeping this process's reads on the primary until the replica replays it."""
+        self.last_write = time.monotonic()
+
+    def start(self):
+        if self.read is not None:
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while not self.stopping:
+            try:
+                await self.check_lag()
+            except Exception as e:
+                # Anything else, such as an asyncpg InterfaceError, must not end the monitor
+                logging.error(f"Replica lag check failed, reading from the primary: {e}")
+                self.replica_lag = None
+            await asyncio.sleep(self.lag_check_interval)
+
+    async def check_lag(self):
+        try:
+            async with self.read.acquire() as conn:
+                self.replica_lag = await conn.fetchval(REPLICA_LAG_QUERY, statement="replica_lag")
+            metrics["db_replica_lag_gauge"].set(self.replica_lag)
+        except (OSError, asyncpg.PostgresError, asyncio.TimeoutError) as e:
+            if self.replica_lag is not None:
+                logging.warning(f"Replica lag check failed, reading from the primary: {e}")
+            self.replica_lag = None
+        return self.replica_lag
+
+    async def close(self):
+        if self.task is not None:
+            self.stopping = True
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        for pool in (self.read, self.write):
+            if pool is not None:
+                await pool.close()
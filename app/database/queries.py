@@ -0,0 +1,64 @@
+"""SQL of the hot read paths, shared by the services and the migration plan check."""
+
+CHECK_COORDINATES_QUERY = "SELECT 1 FROM user_coordinates WHERE latitude = $1 AND longitude = $2"
+
+# Stored ranking of one cell ($1, $2); a fresh cell without places yields a single all-NULL row
+CELL_LOOKUP_QUERY = '''
+    SELECT ranked.* FROM cell_top_places cell
+    LEFT JOIN LATERAL (
+        SELECT places.place_id, name, rating, user_ratings_total, price_level, open_now,
+            COALESCE(place_latitude, places.latitude) AS latitude,
+            COALESCE(place_longitude, places.longitude) AS longitude,
+            (ABS(COALESCE(place_latitude, places.latitude) - cell.latitude)
+                + ABS(COALESCE(place_longitude, places.longitude) - cell.longitude))::float8 AS proximity,
+            top.position
+        FROM unnest(cell.place_ids) WITH ORDINALITY AS top(place_id, position)
+        JOIN google_nearby_places places ON places.place_id = top.place_id
+    ) ranked ON TRUE
+    WHERE cell.latitude = $1::real AND cell.longitude = $2::real AND cell.stale_since IS NULL
+    ORDER BY ranked.position
+'''
+
+
+def candidates_sql(first):
+    """
+    CTE `candidates` of the row ids of places relevant to a point: those
+    stored under the point itself ($first, $first+1) and those linked to
+    any of the tiles in $first+2.
+    """
+    return f'''
+        WITH candidates AS (
+            SELECT id FROM google_nearby_places WHERE latitude = ${first}::real AND longitude = ${first + 1}::real
+            UNION
+            SELECT place_row_id FROM tile_places WHERE tile_key = ANY(${first + 2}::bigint[])
+        )'''
+
+
+def type_filter_sql(parameter):
+    """Condition keeping places of any of the type names in $parameter, answered from the type_ids GIN index."""
+    return f"type_ids && (SELECT array_agg(id) FROM place_types WHERE name = ANY(${parameter}::text[]))"
+
+
+def rank_page_sql(type_filter="", keyset=""):
+    """
+    One ranking page around ($1, $2) over the candidates of ($3, $4, $5),
+    at most $6 rows, with optional WHERE clauses on the places (`type_filter`)
+    and on the ranking keys (`keyset`).
+    """
+    return f'''
+        {candidates_sql(3)}
+        SELECT * FROM (
+            SELECT place_id, name, rating, user_ratings_total, price_level, open_now,
+                COALESCE(place_latitude, latitude) AS latitude,
+                COALESCE(place_longitude, longitude) AS longitude,
+                (ABS(COALESCE(place_latitude, latitude) - $1) + ABS(COALESCE(place_longitude, longitude) - $2))::float8 AS proximity,
+                CASE WHEN open_now THEN 0 WHEN NOT open_now THEN 1 ELSE 2 END AS open_rank,
+                -COALESCE(rating, 0)::float8 AS rating_key,
+                -COALESCE(user_ratings_total, 0) AS reviews_key
+            FROM google_nearby_places JOIN candidates USING (id)
+            {type_filter}
+        ) ranked
+        {keyset}
+        ORDER BY open_rank, rating_key, proximity, reviews_key, place_id
+        LIMIT $6;
+    '''
@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import os
+from app.metrics import metrics
+
+
+class VisitBuffer:
+    """
+    Write-behind buffer for user_coordinates. Visits are collected in memory,
+    deduplicated by coordinate, and written with one multi-row INSERT ... ON
+    CONFLICT DO NOTHING when VISIT_BATCH_SIZE coordinates are pending or
+    every VISIT_FLUSH_SECONDS. At most VISIT_BUFFER_MAX coordinates are held;
+    new ones beyond that are dropped and counted. stop() flushes what is left.
+    """
+
+    def __init__(self, batch_size=None, flush_interval=None, max_pending=None):
+        self.batch_size = int(os.getenv("VISIT_BATCH_SIZE", 500)) if batch_size is None else batch_size
+        self.flush_interval = float(os.getenv("VISIT_FLUSH_SECONDS", 1)) if flush_interval is None else flush_interval
+        self.max_pending = int(os.getenv("VISIT_BUFFER_MAX", 10000)) if max_pending is None else max_pending
+        self.pending = {}
+        self.pool = None
+        self.task = None
+        self.stopping = False
+        self._wakeup = None
+
+    @property
+    def running(self):
+        return self.task is not None and not self.task.done()
+
+    def add(self, latitude, longitude, visitor_id=None):
+        """Queue a visit; False if it was dropped because the buffer is full."""
+        key = (latitude, longitude)
+        if key not in self.pending and len(self.pending) >= self.max_pending:
+            metrics["visits_buffered_counter"].labels(outcome="dropped").inc()
+            return False
+        self.pending.setdefault(key, visitor_id)
+        metrics["visits_buffered_counter"].labels(outcome="queued").inc()
+        if len(self.pending) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+        return True
+
+    def start(self, pool):
+        self.pool = pool
+        self._wakeup = asyncio.Event()
+        # A batch filled before start() is written right away
+        if len(self.pending) >= self.batch_size:
+            self._wakeup.set()
+        self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while not self.stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Write every pending visit in one statement; returns the number of new rows."""
+        if not self.pending:
+            return 0
+        batch, self.pending = self.pending, {}
+        try:
+            async with self.pool.acquire() as conn:
+                status = await conn.execute('''
+                    INSERT INTO user_coordinates (latitude, longitude, visitor_id)
+                    SELECT * FROM unnest($1::real[], $2::real[], $3::text[])
+                    ON CONFLICT (latitude, longitude) DO NOTHING
+                ''', [key[0] for key in batch], [key[1] for key in batch], list(batch.values()),
+                  statement="insert_visits")
+        except Exception as e:
+            logging.error(f"Visit flush of {len(batch)} coordinates failed: {e}")
+            # Put the batch back for the next flush, within the memory bound
+            for key, visitor_id in batch.items():
+                if len(self.pending) >= self.max_pending:
+                    break
+                self.pending.setdefault(key, visitor_id)
+            return 0
+        inserted = int(status.split()[-1])
+        metrics["visits_buffered_counter"].labels(outcome="inserted").inc(inserted)
+        logging.debug(f"Flushed {len(batch)} visited coordinates, {inserted} new.")
+        return inserted
+
+    async def stop(self):
+        # Let the flush loop finish its current write instead of cancelling it mid-batch
+        if self.task is not None:
+            self.stopping = True
+            self._wakeup.set()
+            await self.task
+            self.task = None
+        if self.pool is not None:
+            await self.flush()
@@ -0,0 +1,164 @@
+import math
+import os
+from app.geo import haversine_m, project, unproject
+
+# Google Nearby Search accepts radii up to 50 km
+MAX_SEARCH_RADIUS_M = 50000
+# Margin added to a tile's half-diagonal so the search circle fully covers it
+RADIUS_MARGIN = 1.05
+
+
+class Tile:
+    """
+    A Web Mercator map tile (zoom, x, y) used as the unit of Google searches.
+
+    Searching a circle around the tile centre whose radius is the tile's
+    half-diagonal covers the whole tile, so two requests in the same tile
+    share one search.
+    """
+
+    def __init__(self, zoom, x, y):
+        self.zoom = zoom
+        self.x = x
+        self.y = y
+
+    def __eq__(self, other):
+        return (self.zoom, self.x, self.y) == (other.zoom, other.x, other.y)
+
+    def __hash__(self):
+        return hash((self.zoom, self.x, self.y))
+
+    def __repr__(self):
+        return f"Tile({self.zoom}, {self.x}, {self.y})"
+
+    @property
+    def key(self):
+        """Compact integer id used as the primary key of persisted tiles."""
+        return (self.zoom << 58) | (self.x << 29) | self.y
+
+    @classmethod
+    def from_key(cls, key):
+        return cls(key >> 58, (key >> 29) & ((1 << 29) - 1), key & ((1 << 29) - 1))
+
+    @classmethod
+    def containing(cls, latitude, longitude, zoom):
+        n = 1 << zoom
+        x, y = project(latitude, longitude)
+        return cls(zoom, min(int(x * n), n - 1), min(int(y * n), n - 1))
+
+    def parent(self):
+        return Tile(self.zoom - 1, self.x >> 1, self.y >> 1)
+
+    def children(self):
+        return [Tile(self.zoom + 1, 2 * self.x + dx, 2 * self.y + dy) for dy in (0, 1) for dx in (0, 1)]
+
+    def bounds(self):
+        """(north, south, east, west) of the tile in degrees."""
+        n = 1 << self.zoom
+        north, west = unproject(self.x / n, self.y / n)
+        south, east = unproject((self.x + 1) / n, (self.y + 1) / n)
+        return north, south, east, west
+
+    def center(self):
+        """Tile centre rounded like every other coordinate the service stores."""
+        n = 1 << self.zoom
+        latitude, longitude = unproject((self.x + 0.5) / n, (self.y + 0.5) / n)
+        return round(latitude, 4), round(longitude, 4)
+
+    def search_radius_m(self):
+        north, _, _, west = self.bounds()
+        latitude, longitude = self.center()
+        return min(int(math.ceil(haversine_m(latitude, longitude, north, west) * RADIUS_MARGIN)), MAX_SEARCH_RADIUS_M)
+
+    def distance_to_m(self, latitude, longitude):
+        """Distance from a point to the nearest point of the tile, 0 when inside."""
+        north, south, east, west = self.bounds()
+        return haversine_m(latitude, longitude, min(max(latitude, south), north), min(max(longitude, west), east))
+
+
+class FetchPlanner:
+    """
+    Maps a request point onto an adaptive quadtree of tiles.
+
+    By default a point is searched at FETCH_TILE_ZOOM. The tile tree stored
+    in fetch_tiles refines that: a tile whose search came back saturated is
+    marked "split" and its children are searched instead, and four sparse
+    siblings are merged into a coarser "leaf" parent so the next refresh of
+    that area costs one call instead of four. Only tiles within
+    FETCH_COVERAGE_RADIUS_M of the point are considered.
+    """
+
+    def __init__(self, zoom=None, coverage_radius_m=None, max_age_seconds=None, min_zoom=None, max_zoom=None,
+                 saturation=None, sparse_results=None):
+        self.zoom = int(os.getenv("FETCH_TILE_ZOOM", 13)) if zoom is None else zoom
+        self.coverage_radius_m = float(os.getenv("FETCH_COVERAGE_RADIUS_M", 1000)) if coverage_radius_m is None else coverage_radius_m
+        self.max_age_seconds = int(os.getenv("FETCH_TILE_MAX_AGE", 7 * 24 * 3600)) if max_age_seconds is None else max_age_seconds
+        self.min_zoom = int(os.getenv("FETCH_TILE_MIN_ZOOM", 10)) if min_zoom is None else min_zoom
+        self.max_zoom = int(os.getenv("FETCH_TILE_MAX_ZOOM", 16)) if max_zoom is None else max_zoom
+        # Nearby Search returns at most 20 results per page, GOOGLE_MAX_PAGES pages per search
+        self.saturation = int(os.getenv("FETCH_SATURATION", 20 * int(os.getenv("GOOGLE_MAX_PAGES", 3)))) if saturation is None else saturation
+        self.sparse_results = int(os.getenv("FETCH_SPARSE_RESULTS", 5)) if sparse_results is None else sparse_results
+
+    def covering_tiles(self, latitude, longitude, zoom=None):
+        zoom = self.zoom if zoom is None else zoom
+        home = Tile.containing(latitude, longitude, zoom)
+        dlat = math.degrees(self.coverage_radius_m / 6371008.8)
+        dlon = dlat / max(math.cos(math.radians(latitude)), 1e-6)
+        corner_a = Tile.containing(latitude + dlat, longitude - dlon, zoom)
+        corner_b = Tile.containing(latitude - dlat, longitude + dlon, zoom)
+        n = 1 << zoom
+        tiles = [home]
+        for y in range(corner_a.y, corner_b.y + 1):
+            for x in range(corner_a.x, corner_b.x + 1 if corner_a.x <= corner_b.x else corner_b.x + n + 1):
+                tile = Tile(zoom, x % n, y)
+                if tile != home and tile.distance_to_m(latitude, longitude) <= self.coverage_radius_m:
+                    tiles.append(tile)
+        return tiles
+
+    def candidate_tiles(self, latitude, longitude):
+        """Covering tiles at every level of the tree; any of them may hold searched places."""
+        return [tile for zoom in range(self.min_zoom, self.max_zoom + 1) for tile in self.covering_tiles(latitude, longitude, zoom)]
+
+    def lookup_keys(self, latitude, longitude):
+        """Keys of the tree nodes (and their siblings) needed to plan a request."""
+        keys = set()
+        for tile in self.candidate_tiles(latitude, longitude):
+            keys.add(tile.key)
+            if tile.zoom > self.min_zoom:
+                keys.update(sibling.key for sibling in tile.parent().children())
+        return list(keys)
+
+    def near(self, tile, latitude, longitude):
+        return tile.distance_to_m(latitude, longitude) <= self.coverage_radius_m
+
+    def resolve(self, tile, nodes, latitude, longitude):
+        """Leaf tiles under `tile` that cover the point's area, following split nodes."""
+        node = nodes.get(tile.key)
+        state = node["state"] if node else None
+        if tile.zoom < self.max_zoom and (state == "split" or (state is None and tile.zoom < self.zoom)):
+            return [leaf for child in tile.children() if self.near(child, latitude, longitude)
+                    for leaf in self.resolve(child, nodes, latitude, longitude)]
+        return [tile]
+
+    def plan(self, latitude, longitude, nodes):
+        """
+        Leaf tiles that must be searched for the point, given the stored
+        nodes as {tile_key: {"state", "result_count", "fresh"}}.
+        """
+        leaves = {leaf for tile in self.covering_tiles(latitude, longitude, self.min_zoom)
+                  for leaf in self.resolve(tile, nodes, latitude, longitude)}
+        return [leaf for leaf in leaves if not (nodes.get(leaf.key) or {}).get("fresh")]
+
+    def is_saturated(self, tile, result_count):
+        return result_count >= self.saturation and tile.zoom < self.max_zoom
+
+    def mergeable_parent(self, tile, nodes):
+        """The parent of a sparse tile when all four siblings are fresh, sparse leaves."""
+        if tile.zoom <= self.min_zoom:
+            return None
+        siblings = [nodes.get(sibling.key) for sibling in tile.parent().children()]
+        if not all(node and node["state"] == "leaf" and node["fresh"] for node in siblings):
+            return None
+        if sum(node["result_count"] for node in siblings) >= min(self.sparse_results * 4, self.saturation):
+            return None
+        return tile.parent()
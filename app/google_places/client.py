@@ -0,0 +1,322 @@
+import asyncio
+import logging
+import os
+import time
+import aiohttp
+from app.google_places.providers import make_provider
+from app.google_places.rate_limit import TokenBucket, QuotaBudget
+from app.google_places.resilience import CircuitBreaker, LatencyTracker, backoff_delay
+from app.metrics import metrics
+
+# Nearby Search reports most errors in the body of a 200 response
+RETRYABLE_API_STATUSES = {"UNKNOWN_ERROR"}
+SUCCESS_API_STATUSES = {"OK", "ZERO_RESULTS"}
+
+
+class PlacesError(Exception):
+    """A Google search did not produce results; callers fall back to stored data."""
+
+
+class PlacesThrottled(PlacesError):
+    """Refused locally by the rate limiter or the call budget."""
+
+
+class CircuitOpen(PlacesError):
+    """The circuit breaker is open and the call was not attempted."""
+
+
+class PlacesRequestError(PlacesError):
+    """Google rejected the request (4xx, quota, denied); retrying will not help."""
+
+    def __init__(self, message, outcome=None):
+        super().__init__(message)
+        self.outcome = outcome
+
+
+class GooglePlacesClient:
+    """
+    Nearby Search client with the protections every call needs: budget and
+    rate limiting, a per-attempt timeout, exponential backoff with jitter,
+    retries only for transient failures, and a circuit breaker that makes
+    calls fail fast while Google is unhealthy.
+
+    With GOOGLE_HEDGE_PERCENTILE set (e.g. 95), an attempt that has not
+    answered within that percentile of recent latencies is hedged with a
+    second identical request and the first answer wins. Hedges are capped at
+    GOOGLE_HEDGE_MAX_FRACTION of requests, go through the same budget and
+    take their own GOOGLE_CONCURRENCY slot; without a free one the request
+    is not hedged.
+
+    Requests are sent by a provider (GOOGLE_PROVIDER): live, record or
+    replay. Only billable providers spend rate limit tokens and budget.
+    """
+
+    def __init__(self, api_key, rate_limiter=None, quota_budget=None, breaker=None, attempts=None,
+                 attempt_timeout=None, backoff_base=None, backoff_cap=None, provider=None):
+        self.api_key = api_key
+        self.provider = provider or make_provider()
+        self.rate_limiter = rate_limiter or TokenBucket()
+        self.quota_budget = quota_budget or QuotaBudget()
+        self.breaker = breaker or CircuitBreaker()
+        self.attempts = int(os.getenv("GOOGLE_ATTEMPTS", 3)) if attempts is None else attempts
+        self.attempt_timeout = float(os.getenv("GOOGLE_ATTEMPT_TIMEOUT", 3)) if attempt_timeout is None else attempt_timeout
+        self.backoff_base = float(os.getenv("GOOGLE_BACKOFF_BASE", 0.2)) if backoff_base is None else backoff_base
+        self.backoff_cap = float(os.getenv("GOOGLE_BACKOFF_CAP", 2)) if backoff_cap is None else backoff_cap
+        self.rate_limit_wait = float(os.getenv("GOOGLE_RATE_LIMIT_WAIT", 2))
+        self.hedge_percentile = float(os.getenv("GOOGLE_HEDGE_PERCENTILE", 0))
+        self.hedge_max_fraction = float(os.getenv("GOOGLE_HEDGE_MAX_FRACTION", 0.1))
+        self.max_pages = int(os.getenv("GOOGLE_MAX_PAGES", 3))
+        # A next_page_token only becomes valid a couple of seconds after it is issued
+        self.page_token_delay = float(os.getenv("GOOGLE_PAGE_TOKEN_DELAY", 2))
+        self.place_types = [t.strip() for t in os.getenv("PLACE_TYPES", "restaurant,cafe,bar").split(",") if t.strip()]
+        self.concurrency = int(os.getenv("GOOGLE_CONCURRENCY", 4))
+        self._semaphore = None
+        self.latency = LatencyTracker()
+        self.requests_sent = 0
+        self.hedges_sent = 0
+
+    def semaphore(self):
+        # Created on first use so it binds to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    async def close(self):
+        await self.provider.close()
+
+    async def admit(self):
+        """Admit one call through the daily/monthly budget and the token bucket."""
+        if not await self.rate_limiter.acquire(self.rate_limit_wait):
+            metrics["google_throttled_counter"].labels(reason="rate").inc()
+            raise PlacesThrottled("Google API rate limit reached")
+        period = await self.quota_budget.reserve()
+        if period:
+            metrics["google_throttled_counter"].labels(reason=f"{period}_budget").inc()
+            raise PlacesThrottled(f"Google API {period} budget exhausted")
+        self.count_call()
+
+    async def admit_hedge(self):
+        """
+        Admit a hedge only if a concurrency slot is free right now and, for
+        billable providers, a token too and the budget allows it; never
+        waits. The slot is the caller's to release.
+        """
+        semaphore = self.semaphore()
+        if semaphore.locked():
+            metrics["google_hedges_counter"].labels(outcome="skipped").inc()
+            return False
+        # Returns at once: the semaphore is not locked and nothing ran since the check
+        await semaphore.acquire()
+        if self.provider.billable and (not self.rate_limiter.try_acquire() or await self.quota_budget.reserve()):
+            semaphore.release()
+            metrics["google_hedges_counter"].labels(outcome="skipped").inc()
+            return False
+        if self.provider.billable:
+            self.count_call()
+        return True
+
+    def count_call(self):
+        metrics["api_call_counter"].inc()
+
+    def export_budget_metric(self):
+        """
+        Report the remaining budget of each limited period whenever metrics
+        are scraped, so the gauge is current from startup and right after a
+        period rolls over, not only once a call is counted.
+        """
+        for period, remaining in self.quota_budget.remaining().items():
+            if remaining is not None:
+                metrics["google_budget_gauge"].labels(period=period).set_function(
+                    lambda period=period: self.quota_budget.remaining()[period])
+
+    def update_breaker_metric(self):
+        metrics["google_breaker_gauge"].set(CircuitBreaker.STATE_VALUES[self.breaker.state])
+
+    async def request(self, params):
+        """One attempt through the provider; returns (http_status, json_or_text)."""
+        return await self.provider.request(params, self.attempt_timeout)
+
+    async def timed_request(self, params):
+        started = time.monotonic()
+        try:
+            result = await self.request(params)
+        except asyncio.CancelledError:
+            # A hedge loser took at least this long; leaving it out would bias the hedge delay towards fast requests
+            self.latency.record(time.monotonic() - started)
+            raise
+        self.latency.record(time.monotonic() - started)
+        return result
+
+    def hedge_delay(self):
+        """Seconds to wait before hedging, or None when hedging is off or not yet calibrated."""
+        if not self.hedge_percentile:
+            return None
+        return self.latency.percentile(self.hedge_percentile)
+
+    def may_hedge(self):
+        return self.hedges_sent < self.hedge_max_fraction * self.requests_sent
+
+    async def hedged_request(self, params):
+        """
+        One logical attempt. If it is slower than the hedge delay a duplicate
+        is sent and whichever completes first without raising is returned.
+        """
+        self.requests_sent += 1
+        primary = asyncio.ensure_future(self.timed_request(params))
+        pending = {primary}
+        try:
+            delay = self.hedge_delay()
+            if delay is not None:
+                done, _ = await asyncio.wait(pending, timeout=delay)
+                if not done and self.may_hedge() and await self.admit_hedge():
+                    self.hedges_sent += 1
+                    metrics["google_hedges_counter"].labels(outcome="sent").inc()
+                    hedge = asyncio.ensure_future(self.timed_request(params))
+                    # A callback, not a finally, so the slot is also freed if the hedge is cancelled before it starts
+                    hedge.add_done_callback(lambda _: self.semaphore().release())
+                    pending.add(hedge)
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            metrics["google_hedges_counter"].labels(outcome="won").inc()
+                        return task.result()
+                if not pending:
+                    # Every request failed; surface the primary's error
+                    return primary.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def classify(self, status, body):
+        """(outcome, retryable) for a response."""
+        if status == 200:
+            api_status = body.get("status", "OK")
+            if api_status in SUCCESS_API_STATUSES:
+                return "ok", False
+            return api_status.lower(), api_status in RETRYABLE_API_STATUSES
+        if status == 429 or status >= 500:
+            return f"http_{status}", True
+        return f"http_{status}", False
+
+    async def nearby_search(self, latitude, longitude, radius, place_type):
+        """The first page of results."""
+        body = await self.search(self.search_params(latitude, longitude, radius, place_type))
+        return body.get("results", [])
+
+    async def nearby_search_pages(self, latitude, longitude, radius, place_type):
+        """
+        Async generator over result pages, following next_page_token up to
+        GOOGLE_MAX_PAGES. Failure of the first page raises; a later page
+        failing ends the iteration, leaving the pages already yielded.
+        """
+        body = await self.search(self.search_params(latitude, longitude, radius, place_type))
+        yield body.get("results", [])
+        pages = 1
+        token = body.get("next_page_token")
+        while token and pages < self.max_pages:
+            try:
+                body = await self.next_page(token)
+            except PlacesError as e:
+                logging.warning(f"Stopped paging results for ({latitude}, {longitude}) after {pages} pages: {e}")
+                return
+            pages += 1
+            yield body.get("results", [])
+            token = body.get("next_page_token")
+
+    async def multi_type_pages(self, latitude, longitude, radius, place_types=None):
+        """
+        Search several place types (PLACE_TYPES) concurrently, one page of
+        each per round, with at most GOOGLE_CONCURRENCY requests in flight.
+        Each round yields (places, type_counts): the places not seen in
+        earlier rounds, deduplicated by place_id, and the number of results
+        each type has returned so far, None for a type whose search failed.
+        Raises only if every type fails.
+        """
+        place_types = place_types or self.place_types
+        searches = {place_type: self.nearby_search_pages(latitude, longitude, radius, place_type) for place_type in place_types}
+        type_counts = dict.fromkeys(place_types, 0)
+        seen = set()
+        first_round = True
+        while searches:
+            pages = await asyncio.gather(*(search.__anext__() for search in searches.values()), return_exceptions=True)
+            places, errors = [], []
+            for place_type, page in zip(list(searches), pages):
+                if isinstance(page, BaseException):
+                    del searches[place_type]
+                    if isinstance(page, PlacesError):
+                        errors.append(page)
+                        type_counts[place_type] = None
+                    elif not isinstance(page, StopAsyncIteration):
+                        raise page
+                    continue
+                type_counts[place_type] += len(page)
+                for place in page:
+                    if place.get("place_id") not in seen:
+                        seen.add(place.get("place_id"))
+                        places.append(place)
+            if first_round and len(errors) == len(place_types):
+                raise errors[0]
+            first_round = False
+            if places or searches or errors:
+                yield places, type_counts
+
+    async def next_page(self, token):
+        for attempt in range(2):
+            await asyncio.sleep(self.page_token_delay)
+            try:
+                return await self.search({'pagetoken': token, 'key': self.api_key})
+            except PlacesRequestError as e:
+                # INVALID_REQUEST until the token is valid; allow one more delay
+                if attempt or e.outcome != "invalid_request":
+                    raise
+
+    def search_params(self, latitude, longitude, radius, place_type):
+        return {
+            'location': f"{latitude},{longitude}",
+            'radius': radius,
+            'type': place_type,
+            'key': self.api_key
+        }
+
+    async def search(self, params):
+        """One Nearby Search request with retries; returns the response body."""
+        for attempt in range(self.attempts):
+            if not self.breaker.allow():
+                self.update_breaker_metric()
+                raise CircuitOpen("Google API circuit breaker is open")
+            try:
+                if self.provider.billable:
+                    await self.admit()
+                logging.debug(f"Attempt {attempt + 1}/{self.attempts} fetching from Google API: {params.get('location', 'next page')}")
+                async with self.semaphore():
+                    status, body = await self.hedged_request(params)
+            except asyncio.TimeoutError:
+                outcome, retryable, body = "timeout", True, None
+            except aiohttp.ClientError as e:
+                outcome, retryable, body = "connection_error", True, str(e)
+            except BaseException:
+                # Throttled or cancelled: Google was not heard from, so a half-open probe must not stay taken
+                self.breaker.release()
+                raise
+            else:
+                outcome, retryable = self.classify(status, body)
+            metrics["google_attempts_counter"].labels(outcome=outcome).inc()
+
+            if outcome == "ok":
+                self.breaker.record_success()
+                self.update_breaker_metric()
+                return body
+            if not retryable:
+                # Google answered, so it is healthy; the request itself is wrong
+                self.breaker.record_success()
+                self.update_breaker_metric()
+                raise PlacesRequestError(f"Google API error: {outcome} {body}", outcome)
+
+            logging.error(f"Google API attempt {attempt + 1} failed: {outcome}")
+            self.breaker.record_failure()
+            self.update_breaker_metric()
+            if attempt < self.attempts - 1:
+                await asyncio.sleep(backoff_delay(attempt, self.backoff_base, self.backoff_cap))
+        raise PlacesError(f"Google API failed after {self.attempts} attempts")
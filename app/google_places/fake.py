@@ -0,0 +1,150 @@
+import asyncio
+import base64
+import json
+import math
+import os
+import random
+from cachetools import LRUCache
+from app.geo import haversine_m
+
+PAGE_SIZE = 20
+MAX_RESULTS = 60
+PLACE_TYPES = ("restaurant", "cafe", "bar", "bakery", "meal_takeaway")
+NAME_WORDS = ("Golden", "Blue", "Corner", "Little", "Old", "Green", "Royal", "Sunny", "Urban", "Harbor")
+NAME_NOUNS = {"restaurant": "Kitchen", "cafe": "Coffee", "bar": "Tavern", "bakery": "Bakery", "meal_takeaway": "Express"}
+STREETS = ("Main St", "Market St", "Oak Ave", "Pine St", "Park Rd", "River Rd", "High St", "Elm St")
+
+
+class FakePlacesProvider:
+    """
+    In-process stand-in for Nearby Search that synthesizes places instead of
+    calling Google, for capacity tests of the whole pipeline.
+
+    The world is cut into GOOGLE_FAKE_CELL_DEG cells whose places are drawn
+    from an RNG seeded by (GOOGLE_FAKE_SEED, cell), so every run sees the
+    same places. Density follows a few seeded hotspots per 1° block on top
+    of a sparse background, GOOGLE_FAKE_DENSITY places per cell at a
+    hotspot centre. Responses are shaped like Google's: up to 20 results
+    per page and 60 per search, ordered by prominence, with page tokens.
+    GOOGLE_FAKE_LATENCY_MS (+ GOOGLE_FAKE_JITTER_MS) delays every response
+    and GOOGLE_FAKE_ERROR_RATE of them fail with a 503.
+    """
+
+    billable = False
+
+    def __init__(self, seed=None, density=None, cell_deg=None, latency_ms=None, jitter_ms=None, error_rate=None):
+        self.seed = int(os.getenv("GOOGLE_FAKE_SEED", 1)) if seed is None else seed
+        self.density = float(os.getenv("GOOGLE_FAKE_DENSITY", 40)) if density is None else density
+        self.cell_deg = float(os.getenv("GOOGLE_FAKE_CELL_DEG", 0.01)) if cell_deg is None else cell_deg
+        self.latency_ms = float(os.getenv("GOOGLE_FAKE_LATENCY_MS", 0)) if latency_ms is None else latency_ms
+        self.jitter_ms = float(os.getenv("GOOGLE_FAKE_JITTER_MS", 0)) if jitter_ms is None else jitter_ms
+        self.error_rate = float(os.getenv("GOOGLE_FAKE_ERROR_RATE", 0)) if error_rate is None else error_rate
+        # Latency and errors are random per request; the places themselves are not
+        self.rng = random.Random(self.seed)
+        self.cells = LRUCache(maxsize=100_000)
+        self.searches = LRUCache(maxsize=10_000)
+
+    def hotspots(self, block_lat, block_lon):
+        rng = random.Random(f"{self.seed}:hotspots:{block_lat}:{block_lon}")
+        return [(block_lat + rng.random(), block_lon + rng.random(), rng.uniform(0.02, 0.1), rng.uniform(0.3, 1.0))
+                for _ in range(rng.randint(1, 4))]
+
+    def cell_mean(self, latitude, longitude):
+        """Expected number of places in the cell around a point."""
+        factor = 0.02
+        for center_lat, center_lon, sigma, weight in self.hotspots(math.floor(latitude), math.floor(longitude)):
+            d2 = (latitude - center_lat) ** 2 + ((longitude - center_lon) * math.cos(math.radians(latitude))) ** 2
+            factor += weight * math.exp(-d2 / (2 * sigma ** 2))
+        return self.density * factor
+
+    def cell_places(self, cell_x, cell_y):
+        key = (cell_x, cell_y)
+        places = self.cells.get(key)
+        if places is None:
+            places = self.generate_cell(cell_x, cell_y)
+            self.cells[key] = places
+        return places
+
+    def generate_cell(self, cell_x, cell_y):
+        rng = random.Random(f"{self.seed}:{cell_x}:{cell_y}")
+        south, west = cell_y * self.cell_deg, cell_x * self.cell_deg
+        mean = self.cell_mean(south + self.cell_deg / 2, west + self.cell_deg / 2)
+        count = int(rng.expovariate(1 / mean)) if mean > 0 else 0
+        places = []
+        for i in range(count):
+            place_type = rng.choice(PLACE_TYPES)
+            latitude = round(south + rng.random() * self.cell_deg, 7)
+            longitude = round(west + rng.random() * self.cell_deg, 7)
+            place_id = "ChIJ" + base64.urlsafe_b64encode(f"{self.seed}:{cell_x}:{cell_y}:{i}".encode()).decode().rstrip("=")
+            reviews = int(rng.paretovariate(1.2) * 5)
+            places.append({
+                "business_status": "OPERATIONAL",
+                "geometry": {"location": {"lat": latitude, "lng": longitude}},
+                "icon": f"https://maps.gstatic.com/mapfiles/place_api/icons/v1/png_71/{place_type}-71.png",
+                "icon_background_color": "#FF9E67",
+                "icon_mask_base_uri": f"https://maps.gstatic.com/mapfiles/place_api/icons/v2/{place_type}_pinlet",
+                "name": f"{rng.choice(NAME_WORDS)} {NAME_NOUNS[place_type]} {i}",
+                "opening_hours": {"open_now": rng.random() < 0.7},
+                "photos": [{"height": 3024, "width": 4032, "html_attributions": [], "photo_reference": f"fake-photo-{place_id}"}],
+                "place_id": place_id,
+                "price_level": rng.randint(1, 4),
+                "rating": round(rng.uniform(2.5, 5.0), 1) if reviews else 0,
+                "reference": place_id,
+                "types": [place_type, "food", "point_of_interest", "establishment"],
+                "user_ratings_total": reviews,
+                "vicinity": f"{rng.randint(1, 999)} {rng.choice(STREETS)}",
+            })
+        return places
+
+    def search(self, latitude, longitude, radius, place_type):
+        """Every matching place within the radius, most prominent first, capped at 60."""
+        key = (latitude, longitude, radius, place_type)
+        results = self.searches.get(key)
+        if results is not None:
+            return results
+        dlat = radius / 111_320
+        dlon = dlat / max(math.cos(math.radians(latitude)), 0.01)
+        results = []
+        for cell_x in range(math.floor((longitude - dlon) / self.cell_deg), math.floor((longitude + dlon) / self.cell_deg) + 1):
+            for cell_y in range(math.floor((latitude - dlat) / self.cell_deg), math.floor((latitude + dlat) / self.cell_deg) + 1):
+                for place in self.cell_places(cell_x, cell_y):
+                    if place_type and place_type not in place["types"]:
+                        continue
+                    location = place["geometry"]["location"]
+                    if haversine_m(latitude, longitude, location["lat"], location["lng"]) <= radius:
+                        results.append(place)
+        results.sort(key=lambda place: (-place["user_ratings_total"], place["place_id"]))
+        results = results[:MAX_RESULTS]
+        self.searches[key] = results
+        return results
+
+    def respond(self, params):
+        if "pagetoken" in params:
+            try:
+                query = json.loads(base64.urlsafe_b64decode(params["pagetoken"]))
+            except ValueError:
+                return {"status": "INVALID_REQUEST", "results": []}
+        else:
+            latitude, longitude = (float(value) for value in params["location"].split(","))
+            query = {"location": [latitude, longitude], "radius": float(params["radius"]), "type": params.get("type"), "page": 0}
+        results = self.search(*query["location"], query["radius"], query["type"])
+        start = query["page"] * PAGE_SIZE
+        body = {"html_attributions": [], "results": results[start:start + PAGE_SIZE]}
+        body["status"] = "OK" if body["results"] else "ZERO_RESULTS"
+        if start + PAGE_SIZE < len(results):
+            body["next_page_token"] = base64.urlsafe_b64encode(json.dumps({**query, "page": query["page"] + 1}).encode()).decode()
+        return body
+
+    async def request(self, params, timeout):
+        delay = (self.latency_ms + self.rng.uniform(0, self.jitter_ms)) / 1000
+        if delay > timeout:
+            await asyncio.sleep(timeout)
+            raise asyncio.TimeoutError()
+        if delay:
+            await asyncio.sleep(delay)
+        if self.rng.random() < self.error_rate:
+            return 503, "injected error"
+        return 200, self.respond(params)
+
+    async def close(self):
+        pass
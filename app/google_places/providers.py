@@ -0,0 +1,145 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import random
+import tempfile
+import aiohttp
+from app.google_places.fake import FakePlacesProvider
+
+NEARBY_SEARCH_URL = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
+# Google statuses worth replaying; errors such as OVER_QUERY_LIMIT or REQUEST_DENIED are transient or key-specific
+RECORDED_STATUSES = {"OK", "ZERO_RESULTS"}
+
+
+class LiveProvider:
+    """Sends requests to Google. Billable: calls go through the rate limiter and budget."""
+
+    billable = True
+
+    def __init__(self):
+        self._session = None
+
+    async def session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+        return self._session
+
+    async def request(self, params, timeout):
+        """One HTTP attempt; returns (http_status, json_or_text)."""
+        session = await self.session()
+        async with session.get(NEARBY_SEARCH_URL, params=params, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            if response.status == 200:
+                return response.status, await response.json()
+            return response.status, await response.text()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+class CassetteStore:
+    """
+    Content-addressed archive of Google responses on disk. Each response is
+    a gzipped JSON file named by the SHA-256 of its request parameters (API
+    key excluded), sharded into directories by the first two hex digits.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = os.getenv("GOOGLE_CASSETTE_DIR", "cassettes") if directory is None else directory
+
+    @staticmethod
+    def request_key(params):
+        canonical = json.dumps({name: str(value) for name, value in params.items() if name != "key"}, sort_keys=True)
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json.gz")
+
+    def read(self, params):
+        """(status, body) recorded for the request, or None."""
+        path = self.path(self.request_key(params))
+        if not os.path.exists(path):
+            return None
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            entry = json.load(f)
+        return entry["status"], entry["body"]
+
+    def write(self, params, status, body):
+        path = self.path(self.request_key(params))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = {"request": {name: value for name, value in params.items() if name != "key"}, "status": status, "body": body}
+        # Write to a unique file then rename, so readers never see a partial file and concurrent writers never share one
+        descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, "wb") as raw, gzip.open(raw, "wt", encoding="utf-8") as f:
+                json.dump(entry, f)
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+
+class RecordingProvider:
+    """Sends requests to Google and archives every successful response (OK or ZERO_RESULTS) in the cassette store."""
+
+    billable = True
+
+    def __init__(self, live, store):
+        self.live = live
+        self.store = store
+
+    async def request(self, params, timeout):
+        status, body = await self.live.request(params, timeout)
+        if status == 200 and isinstance(body, dict) and body.get("status") in RECORDED_STATUSES:
+            await asyncio.to_thread(self.store.write, params, status, body)
+        return status, body
+
+    async def close(self):
+        await self.live.close()
+
+
+class ReplayProvider:
+    """
+    Serves recorded responses without calling Google, after an injected
+    latency of GOOGLE_REPLAY_LATENCY_MS plus up to GOOGLE_REPLAY_JITTER_MS.
+    Requests that were never recorded get a 404.
+    """
+
+    billable = False
+
+    def __init__(self, store, latency_ms=None, jitter_ms=None):
+        self.store = store
+        self.latency_ms = float(os.getenv("GOOGLE_REPLAY_LATENCY_MS", 0)) if latency_ms is None else latency_ms
+        self.jitter_ms = float(os.getenv("GOOGLE_REPLAY_JITTER_MS", 0)) if jitter_ms is None else jitter_ms
+
+    async def request(self, params, timeout):
+        delay = (self.latency_ms + random.uniform(0, self.jitter_ms)) / 1000
+        if delay > timeout:
+            await asyncio.sleep(timeout)
+            raise asyncio.TimeoutError()
+        await asyncio.sleep(delay)
+        recorded = await asyncio.to_thread(self.store.read, params)
+        if recorded is None:
+            logging.debug(f"No recorded response for {params.get('location', 'next page')}")
+            return 404, "not recorded"
+        return recorded
+
+    async def close(self):
+        pass
+
+
+def make_provider(mode=None):
+    """Provider for GOOGLE_PROVIDER: live (default), record, replay or fake."""
+    mode = os.getenv("GOOGLE_PROVIDER", "live") if mode is None else mode
+    if mode == "live":
+        return LiveProvider()
+    if mode == "record":
+        return RecordingProvider(LiveProvider(), CassetteStore())
+    if mode == "replay":
+        return ReplayProvider(CassetteStore())
+    if mode == "fake":
+        return FakePlacesProvider()
+    raise ValueError(f"Unknown GOOGLE_PROVIDER: {mode}")
@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+import asyncpg
+
+# Counts one call against each period key and returns the fleet-wide totals
+SPEND_QUERY = '''
+    INSERT INTO google_quota_usage (period, calls)
+    SELECT unnest($1::text[]), 1
+    ON CONFLICT (period) DO UPDATE SET calls = google_quota_usage.calls + 1
+    RETURNING period, calls
+'''
+
+
+class TokenBucket:
+    """
+    Token bucket limiting the rate of Google calls: refills at `rate` tokens
+    per second up to `burst`, one token per call. Shared by every caller in
+    the process.
+    """
+
+    def __init__(self, rate=None, burst=None, clock=time.monotonic):
+        self.rate = float(os.getenv("GOOGLE_QPS", 10)) if rate is None else rate
+        self.burst = float(os.getenv("GOOGLE_BURST", 20)) if burst is None else burst
+        self.clock = clock
+        self.tokens = self.burst
+        self.updated = clock()
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        self.refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self):
+        """Seconds until the next token is available."""
+        self.refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    async def acquire(self, timeout):
+        """Take a token, waiting at most `timeout` seconds for one; False when throttled."""
+        deadline = self.clock() + timeout
+        while not self.try_acquire():
+            wait = self.wait_time()
+            if self.clock() + wait > deadline:
+                return False
+            await asyncio.sleep(wait)
+        return True
+
+
+class BudgetExhausted(Exception):
+    """Rolls back a shared spend that went over a limit."""
+
+    def __init__(self, period):
+        super().__init__(period)
+        self.period = period
+
+
+class QuotaBudget:
+    """
+    Daily and monthly call budgets (UTC calendar periods). A limit of 0 means
+    unlimited. Once `pool` is set the budgets are counted in Postgres
+    (google_quota_usage), so they hold for every process together; without
+    it, or while the database is unreachable, they are counted per process.
+    """
+
+    def __init__(self, daily_limit=None, monthly_limit=None, clock=time.time, pool=None):
+        self.daily_limit = int(os.getenv("GOOGLE_DAILY_BUDGET", 0)) if daily_limit is None else daily_limit
+        self.monthly_limit = int(os.getenv("GOOGLE_MONTHLY_BUDGET", 0)) if monthly_limit is None else monthly_limit
+        self.clock = clock
+        self.pool = pool
+        self.day = self.month = None
+        self.daily_calls = self.monthly_calls = 0
+
+    def roll_over(self):
+        now = datetime.fromtimestamp(self.clock(), tz=timezone.utc)
+        day, month = now.strftime("%Y-%m-%d"), now.strftime("%Y-%m")
+        if day != self.day:
+            self.day, self.daily_calls = day, 0
+        if month != self.month:
+            self.month, self.monthly_calls = month, 0
+
+    def exhausted(self):
+        """Name of the exhausted period ("daily" or "monthly"), or None."""
+        self.roll_over()
+        if self.monthly_limit and self.monthly_calls >= self.monthly_limit:
+            return "monthly"
+        if self.daily_limit and self.daily_calls >= self.daily_limit:
+            return "daily"
+        return None
+
+    def spend(self):
+        self.roll_over()
+        self.daily_calls += 1
+        self.monthly_calls += 1
+
+    async def reserve(self):
+        """Count one call if every budget allows it; returns the exhausted period, or None once counted."""
+        self.roll_over()
+        if self.pool is not None and (self.daily_limit or self.monthly_limit):
+            try:
+                return await self.reserve_shared()
+            except (OSError, asyncpg.PostgresError, asyncio.TimeoutError) as e:
+                logging.warning(f"Shared Google budget unavailable, counting in process: {e}")
+        period = self.exhausted()
+        if period is None:
+            self.spend()
+        return period
+
+    async def reserve_shared(self):
+        periods = {"monthly": (self.month, self.monthly_limit), "daily": (self.day, self.daily_limit)}
+        keys = [key for key, limit in periods.values() if limit]
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    calls = {row["period"]: row["calls"] for row in await conn.fetch(SPEND_QUERY, keys, statement="spend_google_quota")}
+                    for period, (key, limit) in periods.items():
+                        if limit and calls[key] > limit:
+                            raise BudgetExhausted(period)
+        except BudgetExhausted as e:
+            return e.period
+        # Remaining budgets reflect every process's calls
+        self.monthly_calls = calls.get(self.month, self.monthly_calls)
+        self.daily_calls = calls.get(self.day, self.daily_calls)
+        return None
+
+    def remaining(self):
+        """Calls left per period; None for unlimited periods."""
+        self.roll_over()
+        return {
+            "daily": self.daily_limit - self.daily_calls if self.daily_limit else None,
+            "monthly": self.monthly_limit - self.monthly_calls if self.monthly_limit else None,
+        }
@@ -0,0 +1,77 @@
+import os
+import random
+import time
+from collections import deque
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker for the Google client.
+
+    After `failure_threshold` failures in a row the breaker opens and calls
+    fail fast for `reset_timeout` seconds. It then lets a single probe call
+    through (half-open): success closes it again, failure re-opens it.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+    # Numeric values for the state gauge
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, failure_threshold=None, reset_timeout=None, clock=time.monotonic):
+        self.failure_threshold = int(os.getenv("GOOGLE_BREAKER_FAILURES", 5)) if failure_threshold is None else failure_threshold
+        self.reset_timeout = float(os.getenv("GOOGLE_BREAKER_RESET", 30)) if reset_timeout is None else reset_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+
+    def allow(self):
+        if self.state == self.OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self.probe_in_flight = False
+        if self.state == self.HALF_OPEN:
+            if self.probe_in_flight:
+                return False
+            self.probe_in_flight = True
+            return True
+        return self.state == self.CLOSED
+
+    def release(self):
+        """Give up a probe that ended without an outcome (throttled or cancelled) so the next call probes."""
+        self.probe_in_flight = False
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = self.clock()
+            self.probe_in_flight = False
+
+
+def backoff_delay(attempt, base, cap):
+    """Exponential backoff with full jitter: uniform in [0, min(cap, base * 2^attempt)]."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class LatencyTracker:
+    """Ring buffer of recent request latencies (seconds) for percentile estimates."""
+
+    def __init__(self, size=256, min_samples=20):
+        self.samples = deque(maxlen=size)
+        self.min_samples = min_samples
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+
+    def percentile(self, p):
+        """The p-th percentile of recent latencies, or None until enough samples are seen."""
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
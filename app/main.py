@@ -1,36 +1,40 @@
-from fastapi import FastAPI, WebSocket, Request, BackgroundTasks
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi import FastAPI, WebSocket, Request, BackgroundTasks, Query
+from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
-from prometheus_client import Counter, Histogram, generate_latest
+from prometheus_client import generate_latest
+from app.metrics import metrics
 from app.services import AppService
 from app.messaging.consumer import start_rabbitmq_consumer
+from app.messaging.hub import ResultHub
+from app.messaging.streaming import stream_to_websocket, stream_events, subscription_key
 from dotenv import load_dotenv
+import asyncio
 import logging
 import time
 import os
+from typing import List
 from fastapi.staticfiles import StaticFiles
 
 load_dotenv()
 app = FastAPI()
 app_service_instance = AppService()
+result_hub = ResultHub(history_size=int(os.getenv("EVENT_HISTORY_SIZE", 256)))
 templates = Jinja2Templates(directory="app/templates")
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
-# Prometheus metrics
-metrics = {
-    "request_counter": Counter('request_count', 'Total number of requests'),
-    "response_counter": Counter('response_count', 'Total number of responses'),
-    "coordinates_saved_counter": Counter('coordinates_saved_total', 'Total number of coordinates saved'),
-    "api_call_counter": Counter('google_api_calls_total', 'Total number of Google API calls'),
-    "response_time_histogram": Histogram('response_time_seconds', 'Response time for endpoints', ['endpoint']),
-    "errors_counter": Counter('errors_total', 'Total number of errors')
-}
-
 logging.basicConfig(level=logging.INFO)
 
 @app.on_event("startup")
 async def startup_event():
     await app_service_instance.initialize()
+    # A single consumer per process feeds the hub; clients only subscribe to it
+    app.state.consumer_task = asyncio.create_task(start_rabbitmq_consumer(app_service_instance, result_hub))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    app.state.consumer_task.cancel()
+    # Flushes buffered visits before the pool closes
+    await app_service_instance.close()
 
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
@@ -63,6 +67,8 @@ async def health_check():
     return JSONResponse({
         "status": status,
         "database": "connected" if db_connected else "disconnected",
+        "google_budget_remaining": app_service_instance.places_client.quota_budget.remaining(),
+        "google_circuit": app_service_instance.places_client.breaker.state,
     }, status_code=200 if status == "healthy" else 500)
 
 @app.post('/process-coordinates')
@@ -75,9 +81,60 @@ async def process_coordinates(data: dict, background_tasks: BackgroundTasks):
     logging.debug("Coordinates saved counter incremented.")
     return {"status": "processing"}
 
+@app.get('/places/viewport')
+async def places_in_viewport(north: float, south: float, east: float, west: float, zoom: float):
+    if south > north:
+        return JSONResponse({"error": "south must not be greater than north."}, status_code=400)
+    clusters = app_service_instance.query_viewport(north, south, east, west, zoom)
+    return {"zoom": zoom, "count": len(clusters), "clusters": clusters}
+
+def parse_types(types):
+    """Comma-separated place types from a query parameter; a place matches if it has any of them."""
+    return [name.strip() for name in types.split(",") if name.strip()] if types else None
+
+@app.get('/places/ranked')
+async def ranked_places(latitude: float, longitude: float, k: int = 10, cursor: str = None, types: str = None):
+    max_k = int(os.getenv("RANKED_PAGE_MAX", 100))
+    if not 1 <= k <= max_k:
+        return JSONResponse({"error": f"k must be between 1 and {max_k}."}, status_code=400)
+    try:
+        page = await app_service_instance.rank_nearby_places_page(round(latitude, 4), round(longitude, 4), k, cursor,
+                                                                  parse_types(types))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    return page
+
+@app.get('/places/nearest')
+async def nearest_places(latitude: float, longitude: float, k: int = 10, radius: float = None, ranked: bool = False,
+                         types: str = None):
+    max_k = int(os.getenv("RANKED_PAGE_MAX", 100))
+    if not 1 <= k <= max_k:
+        return JSONResponse({"error": f"k must be between 1 and {max_k}."}, status_code=400)
+    places = app_service_instance.nearest_places(latitude, longitude, k, radius, ranked, parse_types(types))
+    return {"count": len(places), "places": places}
+
 
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
+async def websocket_endpoint(websocket: WebSocket, latitude: float = None, longitude: float = None):
     await websocket.accept()
-    await start_rabbitmq_consumer(websocket, app_service_instance)
-    await websocket.close()
+    keys = [subscription_key(latitude, longitude)] if latitude is not None and longitude is not None else []
+    await stream_to_websocket(websocket, result_hub, keys)
+
+@app.get('/events')
+async def events_endpoint(request: Request, format: str = "sse", last_event_id: int = None,
+                          latitude: List[float] = Query([]), longitude: List[float] = Query([])):
+    """Results for the coordinates given as repeated latitude/longitude pairs, at least one."""
+    if format not in ("sse", "ndjson"):
+        return JSONResponse({"error": "format must be 'sse' or 'ndjson'."}, status_code=400)
+    if not latitude or len(latitude) != len(longitude):
+        return JSONResponse({"error": "Give at least one latitude and longitude pair."}, status_code=400)
+    header_id = request.headers.get("last-event-id")
+    if header_id and header_id.isdigit():
+        last_event_id = int(header_id)
+    keys = [subscription_key(lat, lon) for lat, lon in zip(latitude, longitude)]
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(
+        stream_events(result_hub, keys, format, last_event_id),
+        media_type=media_type,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,43 +1,44 @@
 import json
 import logging
 from app.services import AppService
+from app.messaging.hub import ResultHub
 from aio_pika import connect_robust, IncomingMessage
-from fastapi import WebSocket
 import os
 import asyncio
 
-async def process_message(message: IncomingMessage, app_service: AppService, websocket: WebSocket):
+async def process_message(message: IncomingMessage, app_service: AppService, hub: ResultHub):
     async with message.process():
         coords = json.loads(message.body.decode())
         latitude = coords['latitude']
         longitude = coords['longitude']
         logging.info(f"Processing coordinates {latitude}, {longitude}")
 
-        # Fetch places from Google Places API
-        places = await app_service.fetch_from_google_places_api(latitude, longitude)
-        if places:
-            await app_service.store_places_in_db_and_cache(latitude, longitude, places)
-            ranked_places = await app_service.rank_nearby_places(latitude, longitude)
-            logging.info(f"Ranked places found: {ranked_places}")
+        async def publish_ranked():
+            payload = await app_service.get_ranked_payload(latitude, longitude)
+            if payload.places:
+                logging.info(f"Ranked places found: {payload.places}")
 
-            # Send the ranked places to the WebSocket client
-            try:
-                await websocket.send_json({'latitude': latitude, 'longitude': longitude, 'places': ranked_places})
-                logging.info("Sent data to WebSocket client.")
-            except Exception as e:
-                logging.error(f"Error sending data to WebSocket: {e}")
-        else:
-            logging.warning("No places found from Google Places API.")
+                # Hand the result to the hub, which pushes it to every WebSocket and /events client
+                await hub.publish(latitude, longitude, payload)
+            else:
+                logging.warning("No places found from Google Places API.")
 
-async def start_rabbitmq_consumer(websocket: WebSocket, app_service: AppService):
+        # Fetch places from Google Places API for whatever part of the area is not covered yet,
+        # pushing the ranking again as each page of results is stored
+        fetched = await app_service.refresh_places(latitude, longitude, on_update=publish_ranked)
+        if not fetched:
+            await publish_ranked()
+
+async def start_rabbitmq_consumer(app_service: AppService, hub: ResultHub):
     while True:
+        connection = None
         try:
             connection = await connect_robust(os.getenv("RABBITMQ_URL"), heartbeat=30)
             channel = await connection.channel()
             queue = await channel.declare_queue("coordinates_queue", durable=True)
 
             async for message in queue:
-                await process_message(message, app_service, websocket)
+                await process_message(message, app_service, hub)
 
         except Exception as e:
             logging.error(f"RabbitMQ connection error: {e}. Reconnecting in 5 seconds...")
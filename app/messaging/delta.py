@@ -0,0 +1,78 @@
+import json
+import zlib
+
+
+class RankedPayload:
+    """
+    A ranked place list together with its pre-encoded JSON.
+
+    Each place is serialized exactly once, when the ranked result is cached;
+    every push built from it reuses the same fragments.
+    """
+
+    def __init__(self, places):
+        self.places = places
+        self.order = [place['place_id'] for place in places]
+        self.fragments = {place['place_id']: json.dumps(place, default=str) for place in places}
+        self._full_size = None
+
+    def full_size(self, latitude, longitude):
+        """Size in bytes of the complete place list, i.e. what a non-delta push would cost."""
+        if self._full_size is None:
+            self._full_size = len(encode_places_message(latitude, longitude, self).encode())
+        return self._full_size
+
+
+def encode_places_message(latitude, longitude, payload):
+    """Encode the full place list in the original `{latitude, longitude, places}` shape."""
+    places = ','.join(payload.fragments[place_id] for place_id in payload.order)
+    return f'{{"latitude": {json.dumps(latitude)}, "longitude": {json.dumps(longitude)}, "places": [{places}]}}'
+
+
+def encode_delta_message(latitude, longitude, payload, upserted, removed):
+    """Encode a delta push from the cached fragments without re-serializing any place."""
+    places = ','.join(payload.fragments[place_id] for place_id in upserted)
+    return (
+        f'{{"type": "delta", "latitude": {json.dumps(latitude)}, "longitude": {json.dumps(longitude)}, '
+        f'"upserted": [{places}], "removed": {json.dumps(removed)}, "order": {json.dumps(payload.order)}}}'
+    )
+
+
+class PlaceDeltaTracker:
+    """
+    Per-connection record of what a client has already been sent, keyed by place_id.
+    """
+
+    def __init__(self, deflate=False):
+        self.sent = {}
+        self.order = []
+        # Mirrors the permessage-deflate context of the connection so the
+        # compressed size can be reported; only used when deflate was negotiated.
+        self.compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS) if deflate else None
+
+    def diff(self, payload):
+        """
+        Compare a ranked payload with the last one pushed.
+
+        Returns (upserted, removed): place ids that are new or whose encoded
+        content changed, and place ids the client should drop. Nothing is
+        recorded until commit(), so a failed send can be retried in full.
+        """
+        upserted = [place_id for place_id in payload.order
+                    if self.sent.get(place_id) != payload.fragments[place_id]]
+        removed = [place_id for place_id in self.sent if place_id not in payload.fragments]
+        unchanged = not upserted and not removed and self.order == payload.order
+        return (None, None) if unchanged else (upserted, removed)
+
+    def commit(self, payload):
+        """Record a payload as delivered to the client."""
+        self.sent = dict(payload.fragments)
+        self.order = payload.order
+
+    def compressed_size(self, data):
+        """Bytes the frame occupies on the wire after permessage-deflate."""
+        if self.compressor is None:
+            return len(data)
+        compressed = self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        # RFC 7692 strips the trailing 0x00 0x00 0xff 0xff of the sync flush
+        return len(compressed) - 4
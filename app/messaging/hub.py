@@ -0,0 +1,109 @@
+import asyncio
+import itertools
+import logging
+from collections import deque
+from app.messaging.delta import encode_places_message
+
+
+class HubEvent:
+    """
+    One ranked result published to the hub.
+
+    The wire encodings are built lazily, once per event, and shared by every
+    subscriber that streams it.
+    """
+
+    def __init__(self, event_id, latitude, longitude, payload):
+        self.id = event_id
+        self.latitude = latitude
+        self.longitude = longitude
+        self.key = f"{latitude}_{longitude}"
+        self.payload = payload
+        self._data = None
+        self._sse = None
+        self._ndjson = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = encode_places_message(self.latitude, self.longitude, self.payload)
+        return self._data
+
+    @property
+    def sse(self):
+        if self._sse is None:
+            self._sse = f"id: {self.id}\nevent: places\ndata: {self.data}\n\n".encode()
+        return self._sse
+
+    @property
+    def ndjson(self):
+        if self._ndjson is None:
+            self._ndjson = f'{{"id": {self.id}, {self.data[1:]}\n'.encode()
+        return self._ndjson
+
+
+class ResultHub:
+    """
+    Fan-out point between the RabbitMQ consumer and every connected client.
+
+    Events carry monotonically increasing ids and the most recent ones are
+    kept in a bounded history, so a subscriber is only a cursor into that
+    history and can resume after a reconnect from its last seen id.
+    """
+
+    def __init__(self, history_size=256):
+        self.history = deque(maxlen=history_size)
+        self.last_id = 0
+        self._changed = None
+
+    @property
+    def changed(self):
+        # Created lazily so the condition binds to the running event loop
+        if self._changed is None:
+            self._changed = asyncio.Condition()
+        return self._changed
+
+    async def publish(self, latitude, longitude, payload):
+        async with self.changed:
+            self.last_id += 1
+            event = HubEvent(self.last_id, latitude, longitude, payload)
+            self.history.append(event)
+            self.changed.notify_all()
+        logging.debug(f"Published event {event.id} for ({latitude}, {longitude}) to the hub.")
+        return event
+
+    def events_after(self, event_id):
+        """Events newer than event_id that are still in the history, oldest first."""
+        missing = self.last_id - event_id
+        if missing <= 0:
+            return []
+        start = max(len(self.history) - missing, 0)
+        return list(itertools.islice(self.history, start, None))
+
+    def subscribe(self, last_event_id=None, key=None, heartbeat=None, keys=None):
+        """
+        Yield events published after last_event_id (or from now on), optionally
+        only those for one `latitude_longitude` key, or for the keys in the set
+        `keys`, which the caller may extend while subscribed. When heartbeat
+        seconds pass without an event, None is yielded so streams can keep
+        proxies alive.
+        """
+        cursor = self.last_id if last_event_id is None or last_event_id > self.last_id else last_event_id
+        return self._follow(cursor, {key} if key is not None else keys, heartbeat)
+
+    async def _follow(self, cursor, keys, heartbeat):
+        while True:
+            async with self.changed:
+                try:
+                    await asyncio.wait_for(self.changed.wait_for(lambda: self.last_id > cursor), heartbeat)
+                except asyncio.TimeoutError:
+                    pending = None
+                else:
+                    pending = self.events_after(cursor)
+                    cursor = self.last_id
+            if pending is None:
+                yield None
+                continue
+            for event in pending:
+                if keys is None or event.key in keys:
+                    yield event
@@ -0,0 +1,96 @@
+import asyncio
+import json
+import logging
+import os
+from fastapi import WebSocket
+from app.messaging.delta import PlaceDeltaTracker, encode_delta_message
+from app.messaging.hub import ResultHub
+from app.metrics import metrics
+
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", 15))
+
+def deflate_negotiated(websocket: WebSocket):
+    server_enabled = os.getenv("UVICORN_WS_PER_MESSAGE_DEFLATE", "true").lower() in ("1", "true", "yes")
+    offered = "permessage-deflate" in websocket.headers.get("sec-websocket-extensions", "")
+    return server_enabled and offered
+
+async def send_places_delta(websocket: WebSocket, tracker: PlaceDeltaTracker, latitude, longitude, payload):
+    upserted, removed = tracker.diff(payload)
+    if upserted is None:
+        metrics["ws_messages_counter"].labels(kind="skipped").inc()
+        logging.info("Ranked places unchanged since last push, nothing sent.")
+        return
+
+    message = encode_delta_message(latitude, longitude, payload, upserted, removed)
+    data = message.encode()
+    await websocket.send_text(message)
+    tracker.commit(payload)
+    metrics["ws_messages_counter"].labels(kind="delta").inc()
+    metrics["ws_payload_bytes_counter"].labels(encoding="full").inc(payload.full_size(latitude, longitude))
+    metrics["ws_payload_bytes_counter"].labels(encoding="delta").inc(len(data))
+    metrics["ws_payload_bytes_counter"].labels(encoding="wire").inc(tracker.compressed_size(data))
+    logging.info(f"Sent delta to WebSocket client: {len(upserted)} upserted, {len(removed)} removed.")
+
+def subscription_key(latitude, longitude):
+    """Hub key of the results for a coordinate, rounded as /process-coordinates rounds it."""
+    return f"{round(latitude, 4)}_{round(longitude, 4)}"
+
+def parse_subscription(text):
+    """Key of a `{"latitude": ..., "longitude": ...}` client message, None for anything else."""
+    try:
+        message = json.loads(text)
+        return subscription_key(float(message["latitude"]), float(message["longitude"]))
+    except (ValueError, TypeError, KeyError):
+        return None
+
+async def stream_to_websocket(websocket: WebSocket, hub: ResultHub, keys=None):
+    """
+    Push the results for the socket's own coordinates only: `keys` given
+    when connecting, plus any the client subscribes to by sending
+    `{"latitude": ..., "longitude": ...}`. Deltas are tracked per key.
+    """
+    keys = set(keys or ())
+    deflate = deflate_negotiated(websocket)
+    trackers = {}
+
+    async def push_events():
+        async for event in hub.subscribe(keys=keys):
+            tracker = trackers.setdefault(event.key, PlaceDeltaTracker(deflate=deflate))
+            try:
+                await send_places_delta(websocket, tracker, event.latitude, event.longitude, event.payload)
+            except Exception as e:
+                logging.error(f"Error sending data to WebSocket: {e}")
+                return
+
+    push_task = asyncio.create_task(push_events())
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            key = parse_subscription(message.get("text") or "")
+            if key is not None:
+                keys.add(key)
+    finally:
+        push_task.cancel()
+    logging.info("WebSocket client disconnected.")
+
+async def stream_events(hub: ResultHub, keys, stream_format="sse", last_event_id=None):
+    """
+    Body of the /events endpoint: the result events /ws would push for the
+    same `keys`, as Server-Sent Events or newline-delimited JSON. Each event
+    is encoded once in the hub, so a stream only holds its cursor.
+    """
+    metrics["stream_connections_gauge"].labels(format=stream_format).inc()
+    try:
+        if stream_format == "sse":
+            yield b"retry: 3000\n\n"
+        async for event in hub.subscribe(last_event_id=last_event_id, keys=set(keys), heartbeat=SSE_HEARTBEAT_SECONDS):
+            if event is None:
+                yield b": keepalive\n\n" if stream_format == "sse" else b"\n"
+                continue
+            data = event.sse if stream_format == "sse" else event.ndjson
+            metrics["stream_payload_bytes_counter"].labels(format=stream_format).inc(len(data))
+            yield data
+    finally:
+        metrics["stream_connections_gauge"].labels(format=stream_format).dec()
@@ -0,0 +1,32 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+# Prometheus metrics, shared by the web app, the services and the consumer
+metrics = {
+    "request_counter": Counter('request_count', 'Total number of requests'),
+    "response_counter": Counter('response_count', 'Total number of responses'),
+    "coordinates_saved_counter": Counter('coordinates_saved_total', 'Total number of coordinates saved'),
+    "api_call_counter": Counter('google_api_calls_total', 'Total number of Google API calls'),
+    "response_time_histogram": Histogram('response_time_seconds', 'Response time for endpoints', ['endpoint']),
+    "errors_counter": Counter('errors_total', 'Total number of errors'),
+    "ws_payload_bytes_counter": Counter('websocket_payload_bytes_total', 'Bytes of place payloads pushed over WebSockets', ['encoding']),
+    "ws_messages_counter": Counter('websocket_messages_total', 'Number of place messages pushed over WebSockets', ['kind']),
+    "stream_connections_gauge": Gauge('event_stream_connections', 'Open /events streaming connections', ['format']),
+    "stream_payload_bytes_counter": Counter('event_stream_payload_bytes_total', 'Bytes of result events sent over /events', ['format']),
+    "fetch_tiles_counter": Counter('google_fetch_tiles_total', 'Tiles handled by the fetch planner', ['outcome']),
+    "google_throttled_counter": Counter('google_api_throttled_total', 'Google calls refused by the rate limiter or budget', ['reason']),
+    "google_budget_gauge": Gauge('google_api_budget_remaining', 'Google calls left in the current budget period', ['period']),
+    "visits_buffered_counter": Counter('visits_buffered_total', 'Visited coordinates through the write-behind buffer', ['outcome']),
+    "places_upserted_counter": Counter('places_upserted_total', 'Places written by the upsert, by outcome', ['outcome']),
+    "google_attempts_counter": Counter('google_api_attempts_total', 'Google request attempts by outcome', ['outcome']),
+    "google_hedges_counter": Counter('google_api_hedged_total', 'Hedged Google requests sent, won and skipped for want of a concurrency slot, rate-limit token or budget', ['outcome']),
+    "cell_rankings_counter": Counter('cell_rankings_total', 'Precomputed cell rankings served, missed, refreshed and pruned', ['outcome']),
+    "cell_rankings_lag_gauge": Gauge('cell_rankings_refresh_lag_seconds', 'Age of the oldest stale precomputed cell ranking'),
+    "cache_invalidations_counter": Counter('cache_invalidations_total', 'Cached payloads evicted by cross-process invalidation', ['source']),
+    "db_reads_routed_counter": Counter('db_reads_routed_total', 'Database reads by the pool they were routed to', ['pool']),
+    "db_replica_lag_gauge": Gauge('db_replica_lag_seconds', 'Measured replication lag of the read replica'),
+    "db_acquire_histogram": Histogram('db_pool_acquire_seconds', 'Time spent waiting for a pooled connection, by outcome (ok, timeout, error)', ['pool', 'outcome']),
+    "db_connections_gauge": Gauge('db_pool_connections', 'Pooled connections by state (in_use, idle)', ['pool', 'state']),
+    "db_query_histogram": Histogram('db_query_seconds', 'Query latency by statement name', ['statement']),
+    "db_slow_queries_counter": Counter('db_slow_queries_total', 'Queries slower than DB_SLOW_QUERY_MS', ['statement']),
+    "google_breaker_gauge": Gauge('google_api_circuit_state', 'Google circuit breaker state (0 closed, 1 half-open, 2 open)'),
+}
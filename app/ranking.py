@@ -0,0 +1,132 @@
+import logging
+import os
+import numpy as np
+from app.geo import EARTH_RADIUS_M
+
+# Score components by name. Each takes the candidate columns, the query point
+# and the config and returns one value per candidate, roughly in [0, 1].
+COMPONENTS = {}
+
+DEFAULT_WEIGHTS = {
+    "bayesian_rating": 1.0,
+    "review_prior": 0.3,
+    "distance_decay": 0.6,
+    "open_now": 0.4,
+    "price": 0.1,
+}
+
+CANDIDATE_COLUMNS = ("latitude", "longitude", "rating", "user_ratings_total", "open_now", "price_level")
+
+
+def register_component(name):
+    def register(component):
+        COMPONENTS[name] = component
+        return component
+    return register
+
+
+class ScoringConfig:
+    """
+    Tunables of the score, read from RANKING_* environment variables by default.
+    """
+
+    def __init__(self, prior_mean=None, prior_weight=None, review_saturation=None,
+                 distance_scale_m=None, price_preference=None):
+        self.prior_mean = float(os.getenv("RANKING_PRIOR_MEAN", 4.0)) if prior_mean is None else prior_mean
+        self.prior_weight = float(os.getenv("RANKING_PRIOR_WEIGHT", 50)) if prior_weight is None else prior_weight
+        self.review_saturation = float(os.getenv("RANKING_REVIEW_SATURATION", 5000)) if review_saturation is None else review_saturation
+        self.distance_scale_m = float(os.getenv("RANKING_DISTANCE_SCALE_M", 1500)) if distance_scale_m is None else distance_scale_m
+        self.price_preference = float(os.getenv("RANKING_PRICE_PREFERENCE", 2)) if price_preference is None else price_preference
+
+
+def parse_weights(spec):
+    """Parse `name=weight,name=weight` into a dict, e.g. from RANKING_WEIGHTS."""
+    weights = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, value = item.partition("=")
+        if name not in COMPONENTS:
+            raise ValueError(f"Unknown ranking component: {name}")
+        weights[name] = float(value)
+    return weights
+
+
+def haversine_m(latitude, longitude, latitudes, longitudes):
+    """Distances in meters from one point to arrays of points."""
+    phi1 = np.radians(latitude)
+    phi2 = np.radians(latitudes)
+    dphi = phi2 - phi1
+    dlambda = np.radians(longitudes - longitude)
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def candidates_from_records(records):
+    """Columnar float64 arrays from place records; missing values become NaN."""
+    columns = {}
+    for column in CANDIDATE_COLUMNS:
+        values = [record[column] for record in records]
+        columns[column] = np.array([np.nan if value is None else float(value) for value in values], dtype=np.float64)
+    return columns
+
+
+@register_component("bayesian_rating")
+def bayesian_rating(candidates, latitude, longitude, config):
+    ratings = np.nan_to_num(candidates["rating"], nan=config.prior_mean)
+    reviews = np.nan_to_num(candidates["user_ratings_total"], nan=0.0)
+    average = (config.prior_weight * config.prior_mean + ratings * reviews) / (config.prior_weight + reviews)
+    return average / 5.0
+
+
+@register_component("review_prior")
+def review_prior(candidates, latitude, longitude, config):
+    reviews = np.nan_to_num(candidates["user_ratings_total"], nan=0.0)
+    return np.minimum(np.log1p(reviews) / np.log1p(config.review_saturation), 1.0)
+
+
+@register_component("distance_decay")
+def distance_decay(candidates, latitude, longitude, config):
+    distances = haversine_m(latitude, longitude, candidates["latitude"], candidates["longitude"])
+    return np.nan_to_num(np.exp(-distances / config.distance_scale_m), nan=0.0)
+
+
+@register_component("open_now")
+def open_now(candidates, latitude, longitude, config):
+    # Unknown opening hours sit halfway between open and closed
+    return np.nan_to_num(candidates["open_now"], nan=0.5)
+
+
+@register_component("price")
+def price(candidates, latitude, longitude, config):
+    mismatch = np.abs(candidates["price_level"] - config.price_preference) / 4.0
+    return np.nan_to_num(1.0 - mismatch, nan=0.5)
+
+
+class RankingEngine:
+    """
+    Vectorized scoring of candidate places as a weighted sum of components.
+    """
+
+    def __init__(self, config=None, weights=None):
+        self.config = config or ScoringConfig()
+        if weights is None:
+            weights = parse_weights(os.getenv("RANKING_WEIGHTS", "")) or DEFAULT_WEIGHTS
+        self.weights = {name: weight for name, weight in weights.items() if weight}
+        logging.debug(f"Ranking engine weights: {self.weights}")
+
+    def score(self, candidates, latitude, longitude):
+        count = len(candidates["latitude"])
+        scores = np.zeros(count, dtype=np.float64)
+        for name, weight in self.weights.items():
+            scores += weight * COMPONENTS[name](candidates, latitude, longitude, self.config)
+        return scores
+
+    def top_k(self, candidates, latitude, longitude, k):
+        """Indexes and scores of the k best candidates, best first."""
+        scores = self.score(candidates, latitude, longitude)
+        if k < len(scores):
+            # argpartition is O(n); only the k winners get fully sorted
+            best = np.argpartition(-scores, k - 1)[:k]
+        else:
+            best = np.arange(len(scores))
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return best, scores[best]
@@ -1,12 +1,25 @@
 import os
-import aiohttp
-import asyncpg
 import logging
-from cachetools import TTLCache
+from cachetools import LRUCache, TTLCache
 from dotenv import load_dotenv
 import aio_pika
 import asyncio
 import json
+import base64
+import hashlib
+from functools import partial
+from app.messaging.delta import RankedPayload
+from app.clustering import ClusterIndex
+from app.ranking import RankingEngine, candidates_from_records
+from app.spatial_index import SpatialIndex
+from app.fetch_planner import FetchPlanner
+from app.metrics import metrics
+from app.google_places.client import GooglePlacesClient, PlacesError
+from app.database.write_behind import VisitBuffer
+from app.database.cell_rankings import CellTopPlaces
+from app.database.invalidation import CacheInvalidator
+from app.database.pools import DatabasePools
+from app.database.queries import CHECK_COORDINATES_QUERY, candidates_sql, type_filter_sql, rank_page_sql
 
 load_dotenv()
 logging.basicConfig(level=logging.DEBUG)
@@ -14,29 +27,84 @@ logging.basicConfig(level=logging.DEBUG)
 class AppService:
     def __init__(self):
         self.google_api_key = os.getenv("GOOGLE_API_KEY")
+        # Primary pool for writes and reads that must see them; read_pool() may pick a replica
+        self.pools = DatabasePools()
         self.db_pool = None
         self.cache = TTLCache(maxsize=int(os.getenv("CACHE_SIZE", 100)), ttl=int(os.getenv("CACHE_TTL", 600)))
+        # Ranked results with their pre-encoded JSON, shared by every WebSocket push
+        self.payload_cache = TTLCache(maxsize=int(os.getenv("CACHE_SIZE", 100)), ttl=int(os.getenv("CACHE_TTL", 600)))
         self.rabbitmq_url = os.getenv("RABBITMQ_URL")
+        self.cluster_index = ClusterIndex()
+        self.spatial_index = SpatialIndex()
+        # place_types name -> id, filled as types are first stored
+        self.type_ids = {}
+        self.fetch_planner = FetchPlanner()
+        # Rate limiter, budget and circuit breaker are shared by every Google call in the process
+        self.places_client = GooglePlacesClient(self.google_api_key)
+        # Visits are written in batches once initialize() has started the buffer
+        self.visit_buffer = VisitBuffer()
+        # Precomputed top places per coordinate, served once initialize() has started its refresher
+        self.cell_top_places = CellTopPlaces()
+        # Evicts payload_cache and cache entries when any process stores places for their cells
+        self.cache_invalidator = CacheInvalidator()
+        # Last good ranking per coordinate, served when Google is throttled and the DB has nothing
+        self.stale_cache = LRUCache(maxsize=int(os.getenv("STALE_CACHE_SIZE", 1000)))
+        # RANKING_ENGINE=score ranks with the vectorized engine instead of the SQL ORDER BY
+        self.ranking_engine = RankingEngine() if os.getenv("RANKING_ENGINE", "sql") == "score" else None
 
     async def initialize(self):
         await self.connect_db()
+        await self.load_place_indexes()
+        self.pools.start()
+        # Every process spends from the same Google budget, counted on the primary
+        self.places_client.quota_budget.pool = self.db_pool
+        self.places_client.export_budget_metric()
+        self.visit_buffer.start(self.db_pool)
+        # Refreshes must see the stores that marked the cells stale, so they rank on the primary
+        self.cell_top_places.start(self.db_pool, partial(self.rank_nearby_places_many, pool=self.db_pool))
+        self.cache_invalidator.start(self.db_pool, self.payload_cache, [self.cache], self.pools.wrote)
+
+    async def close(self):
+        await self.visit_buffer.stop()
+        await self.cell_top_places.stop()
+        await self.cache_invalidator.stop()
+        await self.places_client.close()
+        await self.pools.close()
 
     async def connect_db(self):
-        logging.debug("Initializing database connection pool.")
-        self.db_pool = await asyncpg.create_pool(dsn=os.getenv("DATABASE_URL"))
-        logging.debug("Database connection pool initialized.")
+        logging.debug("Initializing database connection pools.")
+        await self.pools.connect()
+        self.db_pool = self.pools.write
+        logging.debug("Database connection pools initialized.")
+
+    def read_pool(self):
+        return self.pools.reader()
 
     async def generate_entry(self, latitude, longitude):
         latitude, longitude = round(latitude, 4), round(longitude, 4)
         logging.debug(f"Generating entry for coordinates: ({latitude}, {longitude})")
-        if not await self.check_coordinates_in_db(latitude, longitude):
-            async with self.db_pool.acquire() as conn:
-                logging.debug(f"Inserting new entry into user_coordinates for ({latitude}, {longitude})")
-                await conn.execute('''
-                    INSERT INTO user_coordinates (latitude, longitude) 
-                    VALUES ($1, $2)
-                    ON CONFLICT DO NOTHING;
-                ''', latitude, longitude)
+        if self.visit_buffer.running:
+            self.visit_buffer.add(latitude, longitude)
+            return
+        # ON CONFLICT does the existence check in the same round trip
+        async with self.db_pool.acquire() as conn:
+            await conn.execute('''
+                INSERT INTO user_coordinates (latitude, longitude) 
+                VALUES ($1, $2)
+                ON CONFLICT DO NOTHING;
+            ''', latitude, longitude, statement="insert_visit")
+        self.pools.wrote()
+
+    async def check_database_connection(self):
+        """Whether a read connection answers a trivial query within HEALTH_CHECK_TIMEOUT seconds."""
+        timeout = float(os.getenv("HEALTH_CHECK_TIMEOUT", 2))
+        try:
+            async with self.read_pool().acquire(timeout=timeout) as conn:
+                await conn.fetchval("SELECT 1", timeout=timeout, statement="health_check")
+            return True
+        except Exception as e:
+            logging.error(f"Database health check failed: {e}")
+            return False
 
     async def process_coordinates(self, latitude, longitude):
         latitude, longitude = round(latitude, 4), round(longitude, 4)
@@ -54,16 +122,15 @@ class AppService:
             self.cache[f"{latitude}_{longitude}"] = places  # Update cache
             return places
         
-        # Fetch from Google API
+        # Fetch from Google API, only for the tiles around the point that are not covered yet
         logging.debug(f"Fetching from Google API for coordinates: ({latitude}, {longitude})")
-        places = await self.fetch_from_google_places_api(latitude, longitude)
+        fetched = await self.refresh_places(latitude, longitude)
+        places = await self.rank_with_fallback(latitude, longitude)
         if places:
-            logging.debug(f"Fetched {len(places)} places from Google Places API.")
-            await self.store_places_in_db_and_cache(latitude, longitude, places)
-            return await self.rank_nearby_places(latitude, longitude)
+            logging.debug(f"Fetched {fetched} places from Google Places API.")
         else:
             logging.warning(f"No places found from Google API for coordinates: ({latitude}, {longitude})")
-        return []
+        return places
 
     async def send_coordinates_if_not_cached(self, latitude, longitude):
         latitude, longitude = round(latitude, 4), round(longitude, 4)
@@ -80,79 +147,455 @@ class AppService:
         return is_cached
 
     async def check_coordinates_in_db(self, latitude, longitude):
-        async with self.db_pool.acquire() as conn:
+        async with self.read_pool().acquire() as conn:
             logging.debug(f"Checking database for coordinates: ({latitude}, {longitude})")
-            query = "SELECT 1 FROM user_coordinates WHERE latitude = $1 AND longitude = $2"
-            result = await conn.fetchrow(query, latitude, longitude)
+            result = await conn.fetchrow(CHECK_COORDINATES_QUERY, latitude, longitude, statement="check_coordinates")
             exists = result is not None
             logging.debug(f"Database check for ({latitude}, {longitude}): {'FOUND' if exists else 'NOT FOUND'}")
             return exists
 
+    async def check_coordinates_in_db_many(self, coordinates):
+        """Existence of each (latitude, longitude) in user_coordinates, in input order, in one round trip."""
+        if not coordinates:
+            return []
+        async with self.read_pool().acquire() as conn:
+            rows = await conn.fetch('''
+                SELECT EXISTS (
+                    SELECT 1 FROM user_coordinates
+                    WHERE user_coordinates.latitude = keys.latitude AND user_coordinates.longitude = keys.longitude
+                ) AS found
+                FROM unnest($1::real[], $2::real[]) WITH ORDINALITY AS keys(latitude, longitude, position)
+                ORDER BY keys.position
+            ''', [latitude for latitude, _ in coordinates], [longitude for _, longitude in coordinates],
+                statement="check_coordinates_many")
+        return [row["found"] for row in rows]
+
     async def fetch_from_google_places_api(self, latitude, longitude, radius=5000, place_type="restaurant"):
-        retry_attempts = 3
-        for attempt in range(retry_attempts):
-            logging.debug(f"Attempt {attempt + 1}/{retry_attempts} fetching from Google API for coordinates: ({latitude}, {longitude})")
-            async with aiohttp.ClientSession() as session:
-                params = {
-                    'location': f"{latitude},{longitude}",
-                    'radius': radius,
-                    'type': place_type,
-                    'key': self.google_api_key
-                }
-                async with session.get("https://maps.googleapis.com/maps/api/place/nearbysearch/json", params=params) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        logging.debug(f"Google API returned {len(result['results'])} places for coordinates: ({latitude}, {longitude})")
-                        return result.get('results', [])
-                    else:
-                        logging.error(f"Google API error: {response.status} {await response.text()}")
-            await asyncio.sleep(1)  # Short delay before retry
-        logging.warning(f"Failed to retrieve data from Google API after {retry_attempts} attempts for coordinates: ({latitude}, {longitude})")
-        return []
-
-    async def store_places_in_db_and_cache(self, latitude, longitude, places):
+        try:
+            places = await self.places_client.nearby_search(latitude, longitude, radius, place_type)
+        except PlacesError as e:
+            logging.warning(f"{e}; serving stored results for coordinates: ({latitude}, {longitude})")
+            # None tells a failed search apart from one that found nothing ([])
+            return None
+        logging.debug(f"Google API returned {len(places)} places for coordinates: ({latitude}, {longitude})")
+        return places
+
+    def candidate_tile_keys(self, latitude, longitude):
+        """
+        Keys of the tiles whose searches are relevant to a point: those that
+        cover it at every level of the tile tree, since any may have been searched.
+        """
+        return [tile.key for tile in self.fetch_planner.candidate_tiles(latitude, longitude)]
+
+    async def load_tile_nodes(self, keys):
+        async with self.db_pool.acquire() as conn:
+            rows = await conn.fetch('''
+                SELECT tile_key, state, result_count, fetched_at > NOW() - make_interval(secs => $2) AS fresh
+                FROM fetch_tiles
+                WHERE tile_key = ANY($1::bigint[])
+            ''', keys, self.fetch_planner.max_age_seconds, statement="load_tile_nodes")
+        return {row['tile_key']: dict(row) for row in rows}
+
+    async def save_tile_node(self, tile, state, result_count):
+        latitude, longitude = tile.center()
+        async with self.db_pool.acquire() as conn:
+            await conn.execute('''
+                INSERT INTO fetch_tiles (tile_key, zoom, tile_x, tile_y, center_latitude, center_longitude, radius_m, result_count, state, fetched_at)
+                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, NOW())
+                ON CONFLICT (tile_key) DO UPDATE
+                SET result_count = EXCLUDED.result_count, state = EXCLUDED.state, fetched_at = EXCLUDED.fetched_at
+            ''', tile.key, tile.zoom, tile.x, tile.y, latitude, longitude, tile.search_radius_m(), result_count, state,
+            statement="save_tile_node")
+
+    async def merge_tile_node(self, parent):
+        """Store a parent as a leaf standing for its four sparse children, as old as the oldest of them."""
+        latitude, longitude = parent.center()
+        async with self.db_pool.acquire() as conn:
+            await conn.execute('''
+                INSERT INTO fetch_tiles (tile_key, zoom, tile_x, tile_y, center_latitude, center_longitude, radius_m, result_count, state, fetched_at)
+                SELECT $1, $2, $3, $4, $5, $6, $7, SUM(result_count), 'leaf', MIN(fetched_at)
+                FROM fetch_tiles WHERE tile_key = ANY($8::bigint[])
+                ON CONFLICT (tile_key) DO UPDATE
+                SET result_count = EXCLUDED.result_count, state = EXCLUDED.state, fetched_at = EXCLUDED.fetched_at
+            ''', parent.key, parent.zoom, parent.x, parent.y, latitude, longitude, parent.search_radius_m(),
+            [child.key for child in parent.children()], statement="merge_tile_node")
+
+    async def fetch_tile(self, tile, on_page=None):
+        """
+        Search a tile for every configured place type, storing each round of
+        pages as it arrives and awaiting `on_page` after it so callers can
+        push partial results. Returns the result count of the densest type,
+        which is what saturation is judged by, or None if the search of any
+        type failed: the places found are kept, but the tile is not fresh.
+        """
+        latitude, longitude = tile.center()
+        counts = None
+        try:
+            async for places, type_counts in self.places_client.multi_type_pages(latitude, longitude, tile.search_radius_m()):
+                if places:
+                    await self.store_places_in_db_and_cache(latitude, longitude, places, append=counts is not None, tile=tile)
+                    if on_page is not None:
+                        await on_page()
+                counts = type_counts
+        except PlacesError as e:
+            logging.warning(f"{e}; serving stored results for tile {tile}")
+            return None
+        if counts is None:
+            return None
+        failed = [place_type for place_type, count in counts.items() if count is None]
+        if failed:
+            logging.warning(f"Search for {', '.join(failed)} failed; tile {tile} will be fetched again")
+            return None
+        return max(counts.values())
+
+    async def refresh_places(self, latitude, longitude, on_update=None):
+        """
+        Make sure every leaf tile of the tile tree around the point has been
+        searched recently. Google is only called for missing or stale leaves,
+        centred on the tile centres so nearby requests share the same searches.
+        Saturated tiles are split and their children searched in the same
+        refresh; sparse sibling groups are merged for the next one.
+
+        `on_update` is awaited whenever a page of new places has been stored.
+        """
+        planner = self.fetch_planner
+        key = f"{latitude}_{longitude}"
+
+        async def page_stored():
+            self.payload_cache.pop(key, None)
+            if on_update is not None:
+                await on_update()
+
+        nodes = await self.load_tile_nodes(planner.lookup_keys(latitude, longitude))
+        pending = planner.plan(latitude, longitude, nodes)
+        logging.debug(f"Fetch plan for ({latitude}, {longitude}): {len(pending)} tiles to fetch: {pending}")
+        fetched = 0
+        while pending:
+            counts = await asyncio.gather(*(self.fetch_tile(tile, page_stored) for tile in pending))
+            next_round = []
+            for tile, count in zip(pending, counts):
+                if count is None:
+                    # Leave the tile uncovered so the next request retries it
+                    metrics["fetch_tiles_counter"].labels(outcome="failed").inc()
+                    continue
+                fetched += count
+                state = "split" if planner.is_saturated(tile, count) else "leaf"
+                nodes[tile.key] = {"state": state, "result_count": count, "fresh": True}
+                await self.save_tile_node(tile, state, count)
+                metrics["fetch_tiles_counter"].labels(outcome=state).inc()
+                if state == "split":
+                    next_round.extend(child for child in tile.children() if planner.near(child, latitude, longitude))
+            for tile in pending:
+                parent = planner.mergeable_parent(tile, nodes) if tile.key in nodes else None
+                if parent is not None and parent.key not in nodes:
+                    await self.merge_tile_node(parent)
+                    nodes[parent.key] = {"state": "leaf", "result_count": 0, "fresh": True}
+                    metrics["fetch_tiles_counter"].labels(outcome="merged").inc()
+            pending = next_round
+        return fetched
+
+    async def store_places_in_db_and_cache(self, latitude, longitude, places, append=False, tile=None):
+        """
+        Store the places found by a search at a point. For tile searches the
+        places are also linked to the tile, replacing the links of its last
+        search unless `append`ing a later page.
+        """
         logging.debug(f"Storing {len(places)} places in database for coordinates: ({latitude}, {longitude})")
         async with self.db_pool.acquire() as conn:
+            # Types are registered before the transaction, so only committed ids are kept in self.type_ids
+            type_ids = await self.place_type_ids(conn, [name for place in places for name in place.get("types", [])])
             async with conn.transaction():
-                for place in places:
-                    await self.insert_place_data(conn, latitude, longitude, place)
-        self.cache[f"{latitude}_{longitude}"] = places
-        logging.debug(f"Stored {len(places)} places in database and cache for ({latitude}, {longitude})")
+                counts, changed = await self.insert_place_data(conn, latitude, longitude, places, type_ids)
+                if tile is not None:
+                    await self.link_tile_places(conn, tile, places, replace=not append)
+                if tile is not None or counts["inserted"] or counts["updated"]:
+                    cells = await self.cell_top_places.mark_stale(
+                        conn, latitude, longitude, [place.get("place_id") for place in places], [tile.key] if tile else [])
+                    if cells:
+                        await self.cache_invalidator.notify(conn, cells)
+        self.pools.wrote()
+        self.cell_top_places.wake()
+        self.index_places(places, changed)
+        key = f"{latitude}_{longitude}"
+        # Later pages of the same search extend the cached first page
+        self.cache[key] = self.cache.get(key, []) + places if append else places
+        self.payload_cache.pop(f"{latitude}_{longitude}", None)
+        logging.debug(f"Stored {len(places)} places in database and cache for ({latitude}, {longitude}): {counts}")
+        return counts
 
-    async def insert_place_data(self, conn, latitude, longitude, place):
-        logging.debug(f"Inserting place data for {place.get('name', 'Unknown')} at ({latitude}, {longitude})")
+    async def link_tile_places(self, conn, tile, places, replace):
+        if replace:
+            await conn.execute("DELETE FROM tile_places WHERE tile_key = $1", tile.key, statement="unlink_tile_places")
         await conn.execute('''
-            INSERT INTO google_nearby_places (
-                latitude, longitude, place_id, name, business_status, rating, 
-                user_ratings_total, vicinity, types, price_level, icon, 
-                icon_background_color, icon_mask_base_uri, photo_reference, 
-                photo_height, photo_width, open_now
-            ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15, $16, $17)
-            ON CONFLICT (place_id) DO NOTHING
-        ''', latitude, longitude, place.get("place_id"), place.get("name"), place.get("business_status"),
-        place.get("rating"), place.get("user_ratings_total"), place.get("vicinity"), 
-        ','.join(place.get("types", [])), place.get("price_level"), place.get("icon"),
-        place.get("icon_background_color"), place.get("icon_mask_base_uri"), 
-        (place['photos'][0]['photo_reference'] if 'photos' in place and place['photos'] else None), 
-        (place['photos'][0]['height'] if 'photos' in place and place['photos'] else None), 
-        (place['photos'][0]['width'] if 'photos' in place and place['photos'] else None), 
-        place.get("opening_hours", {}).get("open_now"))
+            INSERT INTO tile_places (tile_key, place_row_id)
+            SELECT $1, id FROM google_nearby_places WHERE place_id = ANY($2::text[])
+            ON CONFLICT DO NOTHING
+        ''', tile.key, [place.get("place_id") for place in places], statement="link_tile_places")
+
+    async def place_type_ids(self, conn, names):
+        """Ids of the given type names, registering new names in place_types; run outside a transaction."""
+        missing = sorted(set(names) - self.type_ids.keys())
+        if missing:
+            await conn.execute(
+                "INSERT INTO place_types (name) SELECT unnest($1::text[]) ON CONFLICT (name) DO NOTHING", missing,
+                statement="insert_place_types")
+            rows = await conn.fetch("SELECT id, name FROM place_types WHERE name = ANY($1::text[])", missing,
+                                    statement="select_place_types")
+            self.type_ids.update((row["name"], row["id"]) for row in rows)
+        return self.type_ids
+
+    async def insert_place_data(self, conn, latitude, longitude, places, type_ids):
+        """
+        Upsert a batch of places, writing only rows that are new or whose
+        content hash changed; changed rows get their version bumped. The
+        query point of an existing row is kept. Returns the number of rows
+        inserted, updated and skipped, and the set of place_ids written.
+        `type_ids` maps every type name of the places to its place_types id.
+        """
+        records = {}
+        for place in places:
+            record = place_record(latitude, longitude, place, type_ids)
+            records[record[2]] = record + (content_hash(record),)
+        stored = dict(await conn.fetch(
+            "SELECT place_id, content_hash FROM google_nearby_places WHERE place_id = ANY($1::text[])", list(records),
+            statement="select_place_hashes"))
+        # Upserted in place_id order, so stores of overlapping places lock their rows in the same order
+        changed = [record for place_id, record in sorted(records.items()) if stored.get(place_id, b"") != record[-1]]
+        counts = {"inserted": sum(place_id not in stored for place_id in records), "updated": 0, "skipped": 0}
+        counts["updated"] = len(changed) - counts["inserted"]
+        counts["skipped"] = len(records) - len(changed)
+        if changed:
+            await conn.executemany('''
+                INSERT INTO google_nearby_places (
+                    latitude, longitude, place_id, name, business_status, rating, 
+                    user_ratings_total, vicinity, type_ids, price_level, icon, 
+                    icon_background_color, icon_mask_base_uri, photo_reference, 
+                    photo_height, photo_width, open_now, place_latitude, place_longitude, content_hash
+                ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15, $16, $17, $18, $19, $20)
+                ON CONFLICT (place_id) DO UPDATE SET
+                    name = EXCLUDED.name, business_status = EXCLUDED.business_status, rating = EXCLUDED.rating,
+                    user_ratings_total = EXCLUDED.user_ratings_total, vicinity = EXCLUDED.vicinity,
+                    type_ids = EXCLUDED.type_ids, price_level = EXCLUDED.price_level, icon = EXCLUDED.icon,
+                    icon_background_color = EXCLUDED.icon_background_color,
+                    icon_mask_base_uri = EXCLUDED.icon_mask_base_uri, photo_reference = EXCLUDED.photo_reference,
+                    photo_height = EXCLUDED.photo_height, photo_width = EXCLUDED.photo_width,
+                    open_now = EXCLUDED.open_now, place_latitude = EXCLUDED.place_latitude,
+                    place_longitude = EXCLUDED.place_longitude, content_hash = EXCLUDED.content_hash,
+                    version = google_nearby_places.version + 1, updated_at = NOW()
+                WHERE google_nearby_places.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+            ''', changed, statement="upsert_places")
+        for outcome, count in counts.items():
+            metrics["places_upserted_counter"].labels(outcome=outcome).inc(count)
+        return counts, {record[2] for record in changed}
 
     async def rank_nearby_places(self, latitude, longitude):
-        logging.debug(f"Ranking nearby places for coordinates: ({latitude}, {longitude})")
+        if self.ranking_engine is not None:
+            return await self.score_nearby_places(latitude, longitude, k=10)
+        if not self.cell_top_places.running or self.cell_top_places.top_n < 10:
+            page = await self.rank_nearby_places_page(latitude, longitude, k=10)
+            return page["places"]
+        async with self.read_pool().acquire() as conn:
+            places = await self.cell_top_places.lookup(conn, latitude, longitude)
+        if places is not None:
+            return places[:10]
+        page = await self.rank_nearby_places_page(latitude, longitude, k=10)
         async with self.db_pool.acquire() as conn:
-            query = '''
-                SELECT name, rating, user_ratings_total, price_level, open_now, 
-                    (ABS(latitude - $1) + ABS(longitude - $2)) AS proximity
+            await self.cell_top_places.register(conn, latitude, longitude, self.candidate_tile_keys(latitude, longitude))
+        return page["places"]
+
+    async def rank_with_fallback(self, latitude, longitude):
+        key = f"{latitude}_{longitude}"
+        places = await self.rank_nearby_places(latitude, longitude)
+        if places:
+            self.stale_cache[key] = places
+        elif key in self.stale_cache:
+            logging.info(f"Serving stale ranking for ({latitude}, {longitude}).")
+            places = self.stale_cache[key]
+        return places
+
+    async def rank_nearby_places_page(self, latitude, longitude, k=10, cursor=None, types=None):
+        """
+        One page of the ranking for a coordinate, continuing after `cursor`.
+
+        Pages are cut with a keyset condition on the ranking tuple
+        (open_now, rating, distance, user_ratings_total, place_id), each mapped
+        to an ascending key so a single row comparison selects the next page.
+        No OFFSET is used, so any page costs the same as the first.
+        `types` keeps only places of any of the given types.
+        """
+        logging.debug(f"Ranking nearby places for coordinates: ({latitude}, {longitude}), k={k}, cursor={cursor}, types={types}")
+        after = decode_cursor(cursor) if cursor else None
+        args = [latitude, longitude, latitude, longitude, self.candidate_tile_keys(latitude, longitude), k + 1]
+        type_filter = keyset = ""
+        if types:
+            args.append(list(types))
+            type_filter = f"WHERE {type_filter_sql(len(args))}"
+        if after:
+            first = len(args) + 1
+            args.extend(after)
+            keyset = "WHERE (open_rank, rating_key, proximity, reviews_key, place_id) > ({})".format(
+                ", ".join(f"${first + i}" for i in range(len(after))))
+        async with self.read_pool().acquire() as conn:
+            results = await conn.fetch(rank_page_sql(type_filter, keyset), *args, statement="rank_page")
+        places = [dict(record) for record in results[:k]]
+        next_cursor = None
+        if len(results) > k:
+            last = places[-1]
+            next_cursor = encode_cursor([last["open_rank"], last["rating_key"], last["proximity"], last["reviews_key"], last["place_id"]])
+        for place in places:
+            del place["open_rank"], place["rating_key"], place["reviews_key"]
+        logging.debug(f"Ranked places for ({latitude}, {longitude}): {places}")
+        return {"places": places, "next_cursor": next_cursor}
+
+    async def rank_nearby_places_many(self, coordinates, k=10, pool=None):
+        """
+        First ranking page for each of several coordinates in one query: a
+        LATERAL top-k per point over the same candidates and ordering as
+        rank_nearby_places_page. Returns one list of places per coordinate.
+        `pool` overrides the read pool, for callers that must read the primary.
+        """
+        if not coordinates:
+            return []
+        positions, tile_keys = [], []
+        for position, (latitude, longitude) in enumerate(coordinates, start=1):
+            keys = self.candidate_tile_keys(latitude, longitude)
+            positions.extend([position] * len(keys))
+            tile_keys.extend(keys)
+        async with (pool or self.read_pool()).acquire() as conn:
+            results = await conn.fetch('''
+                WITH point_tiles AS (
+                    SELECT * FROM unnest($3::bigint[], $4::bigint[]) AS tiles(position, tile_key)
+                )
+                SELECT points.position, ranked.*
+                FROM unnest($1::real[], $2::real[]) WITH ORDINALITY AS points(latitude, longitude, position)
+                CROSS JOIN LATERAL (
+                    SELECT * FROM (
+                        SELECT place_id, name, rating, user_ratings_total, price_level, open_now,
+                            COALESCE(place_latitude, places.latitude) AS latitude,
+                            COALESCE(place_longitude, places.longitude) AS longitude,
+                            (ABS(COALESCE(place_latitude, places.latitude) - points.latitude)
+                                + ABS(COALESCE(place_longitude, places.longitude) - points.longitude))::float8 AS proximity,
+                            CASE WHEN open_now THEN 0 WHEN NOT open_now THEN 1 ELSE 2 END AS open_rank,
+                            -COALESCE(rating, 0)::float8 AS rating_key,
+                            -COALESCE(user_ratings_total, 0) AS reviews_key
+                        FROM google_nearby_places places
+                        WHERE places.id IN (
+                            SELECT id FROM google_nearby_places
+                            WHERE latitude = points.latitude AND longitude = points.longitude
+                            UNION
+                            SELECT place_row_id FROM tile_places JOIN point_tiles USING (tile_key)
+                            WHERE point_tiles.position = points.position
+                        )
+                    ) candidates
+                    ORDER BY open_rank, rating_key, proximity, reviews_key, place_id
+                    LIMIT $5
+                ) ranked
+                ORDER BY points.position, open_rank, rating_key, proximity, reviews_key, place_id
+            ''', [latitude for latitude, _ in coordinates], [longitude for _, longitude in coordinates],
+                positions, tile_keys, k, statement="rank_many")
+        ranked = [[] for _ in coordinates]
+        for record in results:
+            place = dict(record)
+            for key in ("position", "open_rank", "rating_key", "reviews_key"):
+                del place[key]
+            ranked[record["position"] - 1].append(place)
+        return ranked
+
+    async def score_nearby_places(self, latitude, longitude, k=10, types=None):
+        logging.debug(f"Scoring nearby places for coordinates: ({latitude}, {longitude}), k={k}, types={types}")
+        args = [latitude, longitude, self.candidate_tile_keys(latitude, longitude)]
+        if types:
+            args.append(list(types))
+        async with self.read_pool().acquire() as conn:
+            records = await conn.fetch(f'''
+                {candidates_sql(1)}
+                SELECT place_id, name, rating, user_ratings_total, price_level, open_now,
+                    COALESCE(place_latitude, latitude) AS latitude,
+                    COALESCE(place_longitude, longitude) AS longitude
+                FROM google_nearby_places JOIN candidates USING (id)
+                {f"WHERE {type_filter_sql(4)}" if types else ""}
+            ''', *args, statement="score_candidates")
+        if not records:
+            return []
+        best, scores = self.ranking_engine.top_k(candidates_from_records(records), latitude, longitude, k)
+        places = []
+        for index, score in zip(best, scores):
+            place = dict(records[index])
+            place["score"] = round(float(score), 4)
+            places.append(place)
+        logging.debug(f"Scored places for ({latitude}, {longitude}): {places}")
+        return places
+
+    async def load_place_indexes(self):
+        logging.debug("Loading stored places into the in-memory indexes.")
+        async with self.read_pool().acquire() as conn:
+            self.type_ids = {row["name"]: row["id"] for row in await conn.fetch("SELECT id, name FROM place_types", statement="load_place_types")}
+            rows = await conn.fetch('''
+                SELECT place_id, name,
+                    COALESCE(place_latitude, latitude), COALESCE(place_longitude, longitude),
+                    rating, user_ratings_total, open_now, price_level, type_ids
                 FROM google_nearby_places
-                WHERE latitude = $1 AND longitude = $2
-                ORDER BY open_now DESC NULLS LAST, rating DESC, proximity ASC, user_ratings_total DESC
-                LIMIT 10;
-            '''
-            results = await conn.fetch(query, latitude, longitude)
-            places = [dict(record) for record in results]
-            logging.debug(f"Ranked places for ({latitude}, {longitude}): {places}")
-            return places
+            ''', statement="load_places")
+        type_names = {type_id: name for name, type_id in self.type_ids.items()}
+        rows = [(*row[:8], [type_names[type_id] for type_id in row[8] or ()]) for row in rows]
+        self.spatial_index.add_many(rows)
+        self.spatial_index.rebuild()
+        self.cluster_index.add_many((row[0], row[1], row[4], row[2], row[3]) for row in rows)
+        logging.info(f"Place indexes built with {len(self.spatial_index)} places.")
+
+    def index_places(self, places, changed=()):
+        """Add places to the in-memory indexes, overwriting those already there whose place_id is in `changed`."""
+        rows = [
+            (place.get("place_id"), place.get("name"), *place_location(place), place.get("rating"),
+             place.get("user_ratings_total"), place.get("opening_hours", {}).get("open_now"), place.get("price_level"),
+             place.get("types", []))
+            for place in places
+        ]
+        self.spatial_index.add_many(rows, replace=changed)
+        self.cluster_index.add_many(((row[0], row[1], row[4], row[2], row[3]) for row in rows), replace=changed)
+
+    def nearest_places(self, latitude, longitude, k=10, radius_m=None, ranked=False, types=None):
+        """
+        Places from the in-memory index, without a database round trip: the k
+        nearest, or those within radius_m, optionally ordered by the ranking
+        engine and limited to places of any of `types`.
+        """
+        if radius_m is not None:
+            indexes, distances = self.spatial_index.radius(latitude, longitude, radius_m, types)
+        else:
+            indexes, distances = self.spatial_index.nearest(latitude, longitude, k, types=types)
+        if ranked and len(indexes):
+            engine = self.ranking_engine or RankingEngine()
+            best, scores = engine.top_k(self.spatial_index.columns(indexes), latitude, longitude, k)
+            return [dict(self.spatial_index.place(indexes[i], distances[i]), score=round(float(score), 4))
+                    for i, score in zip(best, scores)]
+        return [self.spatial_index.place(index, distance) for index, distance in zip(indexes[:k], distances[:k])]
+
+    def query_viewport(self, north, south, east, west, zoom):
+        return self.cluster_index.query(north, south, east, west, zoom)
+
+    async def get_ranked_payload(self, latitude, longitude):
+        key = f"{latitude}_{longitude}"
+        # Payloads served from the cache still keep their cell from being pruned
+        self.cell_top_places.touch(latitude, longitude)
+        payload = self.payload_cache.get(key)
+        if payload is None:
+            # Read the cell version first, through the same routing as the ranking: a store the ranking
+            # sees but the version does not then only causes an extra eviction
+            version = None
+            if self.cache_invalidator.running:
+                version = await self.cache_invalidator.cell_version(self.read_pool(), latitude, longitude)
+                if version is None:
+                    # Stores only mark and notify cells listed in cell_top_places, whatever the ranking engine
+                    async with self.db_pool.acquire() as conn:
+                        version = await self.cell_top_places.register(
+                            conn, latitude, longitude, self.candidate_tile_keys(latitude, longitude))
+            payload = RankedPayload(await self.rank_with_fallback(latitude, longitude))
+            self.payload_cache[key] = payload
+            if self.cache_invalidator.running:
+                self.cache_invalidator.track(key, latitude, longitude, version)
+            logging.debug(f"Encoded and cached ranked payload for ({latitude}, {longitude})")
+        return payload
 
 
     async def send_to_rabbitmq(self, message):
@@ -165,3 +608,38 @@ class AppService:
                 routing_key="coordinates_queue"
             )
         logging.debug(f"Message sent to RabbitMQ: {message}")
+
+def place_location(place):
+    location = place.get("geometry", {}).get("location", {})
+    return location.get("lat"), location.get("lng")
+
+def place_record(latitude, longitude, place, type_ids):
+    """Column values of a Google result for google_nearby_places, in insert order."""
+    photo = place['photos'][0] if place.get('photos') else {}
+    return (
+        latitude, longitude, place.get("place_id"), place.get("name"), place.get("business_status"),
+        place.get("rating"), place.get("user_ratings_total"), place.get("vicinity"),
+        [type_ids[name] for name in place.get("types", [])], place.get("price_level"), place.get("icon"),
+        place.get("icon_background_color"), place.get("icon_mask_base_uri"),
+        photo.get('photo_reference'), photo.get('height'), photo.get('width'),
+        place.get("opening_hours", {}).get("open_now"), *place_location(place),
+    )
+
+# place_record fields that define a place's content: everything but the query point and the
+# photo/icon references, which Google reissues between calls
+HASHED_FIELDS = (2, 3, 4, 5, 6, 7, 8, 9, 16, 17, 18)
+
+def content_hash(record):
+    """16-byte digest of a place_record's content fields."""
+    content = json.dumps([record[i] for i in HASHED_FIELDS], default=str)
+    return hashlib.blake2b(content.encode(), digest_size=16).digest()
+
+def encode_cursor(keys):
+    return base64.urlsafe_b64encode(json.dumps(keys).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    try:
+        open_rank, rating_key, proximity, reviews_key, place_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return int(open_rank), float(rating_key), float(proximity), int(reviews_key), str(place_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
@@ -0,0 +1,245 @@
+import logging
+import math
+import os
+import numpy as np
+from app.ranking import haversine_m
+
+METERS_PER_DEGREE = 111320.0
+# Attribute columns kept per place, in the order rows are given to add/add_many
+ATTRIBUTE_COLUMNS = ("rating", "user_ratings_total", "open_now", "price_level")
+# Attributes stored as float32 like the rest but handed back as ints, as the database returns them
+INTEGER_COLUMNS = ("user_ratings_total", "price_level")
+# Place types get one bit each, in order of first appearance, packed into as many uint64 words as needed
+TYPE_WORD_BITS = 64
+
+
+class SpatialIndex:
+    """
+    Uniform-grid index over every stored place, held in NumPy columns.
+
+    Points are kept in insertion order in growable arrays. A CSR-style layout
+    (`order` sorted by cell key, plus the start offset of every occupied cell)
+    makes the points of a whole row of cells one contiguous slice, so a
+    radius query is a handful of searchsorted calls and one vectorized
+    distance filter. Points added after the last rebuild are scanned
+    linearly until the pending buffer is large enough to fold in.
+
+    Place types are kept as a bitmask per place, one row of uint64 words that
+    widens as new types appear, so type filters are one vectorized AND over
+    the candidates.
+    """
+
+    def __init__(self, cell_deg=None, rebuild_threshold=None, capacity=1024):
+        self.cell_deg = float(os.getenv("SPATIAL_INDEX_CELL_DEG", 0.01)) if cell_deg is None else cell_deg
+        self.rebuild_threshold = int(os.getenv("SPATIAL_INDEX_REBUILD_THRESHOLD", 4096)) if rebuild_threshold is None else rebuild_threshold
+        self.size = 0
+        self.latitude = np.empty(capacity, dtype=np.float64)
+        self.longitude = np.empty(capacity, dtype=np.float64)
+        self.attributes = {column: np.empty(capacity, dtype=np.float32) for column in ATTRIBUTE_COLUMNS}
+        self.type_masks = np.zeros((capacity, 1), dtype=np.uint64)
+        self.type_bits = {}
+        self.place_ids = []
+        self.names = []
+        self.positions = {}
+        # CSR layout over the first `indexed` points
+        self.indexed = 0
+        self.order = np.empty(0, dtype=np.int64)
+        self.cell_keys = np.empty(0, dtype=np.int64)
+        self.cell_starts = np.empty(0, dtype=np.int64)
+
+    def __len__(self):
+        return self.size
+
+    def cell_rows_cols(self, latitudes, longitudes):
+        rows = np.floor((np.asarray(latitudes) + 90.0) / self.cell_deg).astype(np.int64)
+        cols = np.floor((np.asarray(longitudes) + 180.0) / self.cell_deg).astype(np.int64)
+        return rows, cols
+
+    def grow(self, needed):
+        capacity = len(self.latitude)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2)
+        self.latitude = np.resize(self.latitude, capacity)
+        self.longitude = np.resize(self.longitude, capacity)
+        self.attributes = {column: np.resize(values, capacity) for column, values in self.attributes.items()}
+        masks = np.zeros((capacity, self.type_masks.shape[1]), dtype=np.uint64)
+        masks[:self.size] = self.type_masks[:self.size]
+        self.type_masks = masks
+
+    def type_mask(self, types, assign=False):
+        """Bitmask words of the given type names; unseen names get a bit when `assign` is set."""
+        bits = []
+        for name in types or ():
+            bit = self.type_bits.get(name)
+            if bit is None and assign:
+                bit = self.type_bits[name] = len(self.type_bits)
+                if bit // TYPE_WORD_BITS == self.type_masks.shape[1]:
+                    self.type_masks = np.pad(self.type_masks, ((0, 0), (0, 1)))
+            if bit is not None:
+                bits.append(bit)
+        mask = np.zeros(self.type_masks.shape[1], dtype=np.uint64)
+        for bit in bits:
+            mask[bit // TYPE_WORD_BITS] |= np.uint64(1 << (bit % TYPE_WORD_BITS))
+        return mask
+
+    def add_many(self, rows, replace=()):
+        """
+        Append places given as (place_id, name, latitude, longitude, rating,
+        user_ratings_total, open_now, price_level[, types]) rows; rows without
+        a location are skipped, and so are known place_ids unless they are in
+        `replace`, in which case the stored place is overwritten.
+        """
+        fresh, updated = [], []
+        for row in rows:
+            place_id, latitude, longitude = row[0], row[2], row[3]
+            if latitude is None or longitude is None:
+                continue
+            if place_id in self.positions:
+                if place_id in replace:
+                    updated.append(row)
+                continue
+            self.positions[place_id] = self.size + len(fresh)
+            fresh.append(row)
+        if updated:
+            self.update_many(updated)
+        if not fresh:
+            return 0
+        start, end = self.size, self.size + len(fresh)
+        self.grow(end)
+        columns = list(zip(*fresh))
+        self.place_ids.extend(columns[0])
+        self.names.extend(columns[1])
+        self.latitude[start:end] = columns[2]
+        self.longitude[start:end] = columns[3]
+        for offset, column in enumerate(ATTRIBUTE_COLUMNS, start=4):
+            self.attributes[column][start:end] = [np.nan if value is None else float(value) for value in columns[offset]]
+        for position, row in enumerate(fresh, start=start):
+            if len(row) > 8:
+                # Assigning a bit may widen type_masks, so each row is written as it is computed
+                self.type_masks[position] = self.type_mask(row[8], assign=True)
+        self.size = end
+        if self.size - self.indexed >= self.rebuild_threshold:
+            self.rebuild()
+        logging.debug(f"Spatial index: added {len(fresh)} places, {self.size} total.")
+        return len(fresh)
+
+    def update_many(self, rows):
+        """Overwrite the name, location, attributes and types of places already indexed."""
+        moved = False
+        for row in rows:
+            position = self.positions[row[0]]
+            if position < self.indexed:
+                old_cell = self.cell_rows_cols(self.latitude[position], self.longitude[position])
+                moved = moved or old_cell != self.cell_rows_cols(row[2], row[3])
+            self.names[position] = row[1]
+            self.latitude[position], self.longitude[position] = row[2], row[3]
+            for offset, column in enumerate(ATTRIBUTE_COLUMNS, start=4):
+                self.attributes[column][position] = np.nan if row[offset] is None else float(row[offset])
+            self.type_masks[position] = 0
+            if len(row) > 8:
+                self.type_masks[position] = self.type_mask(row[8], assign=True)
+        if moved:
+            # The grid layout is sorted by cell, so a place that changed cell needs it rebuilt
+            self.rebuild()
+        logging.debug(f"Spatial index: updated {len(rows)} places.")
+
+    def rebuild(self):
+        rows, cols = self.cell_rows_cols(self.latitude[:self.size], self.longitude[:self.size])
+        keys = (rows << 32) | cols
+        self.order = np.argsort(keys, kind="stable")
+        self.cell_keys, self.cell_starts = np.unique(keys[self.order], return_index=True)
+        self.indexed = self.size
+
+    def candidates_in_box(self, latitude, longitude, radius_m):
+        """Indexes of points in the grid cells overlapping the radius' bounding box."""
+        dlat = radius_m / METERS_PER_DEGREE
+        dlon = min(radius_m / (METERS_PER_DEGREE * max(math.cos(math.radians(latitude)), 1e-6)), 180.0)
+        (row_min, row_max), (col_min, col_max) = self.cell_rows_cols(
+            [latitude - dlat, latitude + dlat], [longitude - dlon, longitude + dlon])
+        if row_max - row_min + 1 > len(self.cell_keys):
+            # Very wide searches visit fewer points scanning everything than walking rows
+            return np.arange(self.size)
+        col_ranges = [(col_min, col_max)]
+        max_col = int(360.0 / self.cell_deg)
+        if col_max - col_min + 1 >= max_col:
+            # The box spans every longitude; a wrapped second range would visit cells twice
+            col_ranges = [(0, max_col - 1)]
+        elif col_min < 0:
+            col_ranges = [(0, col_max), (col_min + max_col, max_col - 1)]
+        elif col_max >= max_col:
+            col_ranges = [(col_min, max_col - 1), (0, col_max - max_col)]
+        slices = []
+        for row in range(row_min, row_max + 1):
+            for low, high in col_ranges:
+                first, last = np.searchsorted(self.cell_keys, [(row << 32) | low, ((row << 32) | high) + 1])
+                if first == last:
+                    continue
+                end = self.cell_starts[last] if last < len(self.cell_starts) else self.indexed
+                slices.append(self.order[self.cell_starts[first]:end])
+        if self.indexed < self.size:
+            slices.append(np.arange(self.indexed, self.size))
+        return np.concatenate(slices) if slices else np.empty(0, dtype=np.int64)
+
+    def within(self, latitude, longitude, radius_m, types=None):
+        """Indexes and distances of every place within radius_m, unordered, of any of `types` if given."""
+        candidates = self.candidates_in_box(latitude, longitude, radius_m)
+        if types:
+            mask = self.type_mask(types)
+            candidates = candidates[(self.type_masks[candidates] & mask).any(axis=1)]
+        distances = haversine_m(latitude, longitude, self.latitude[candidates], self.longitude[candidates])
+        inside = distances <= radius_m
+        return candidates[inside], distances[inside]
+
+    def radius(self, latitude, longitude, radius_m, types=None):
+        """Indexes and distances of every place within radius_m, nearest first."""
+        indexes, distances = self.within(latitude, longitude, radius_m, types)
+        nearest_first = np.argsort(distances, kind="stable")
+        return indexes[nearest_first], distances[nearest_first]
+
+    def nearest(self, latitude, longitude, k, max_radius_m=None, types=None):
+        """
+        The k nearest places, nearest first. The search radius starts below one
+        cell and doubles until it holds k places, which are then the true k
+        nearest since everything inside the radius has been seen.
+        """
+        radius_m = self.cell_deg * METERS_PER_DEGREE / 8
+        max_radius_m = max_radius_m or math.pi * 6371008.8
+        if types and not self.type_mask(types).any():
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        while True:
+            indexes, distances = self.within(latitude, longitude, radius_m, types)
+            if len(indexes) >= k or radius_m >= max_radius_m or len(indexes) == self.size:
+                break
+            radius_m = min(radius_m * 2, max_radius_m)
+        if len(indexes) > k:
+            best = np.argpartition(distances, k - 1)[:k]
+            indexes, distances = indexes[best], distances[best]
+        nearest_first = np.argsort(distances, kind="stable")
+        return indexes[nearest_first], distances[nearest_first]
+
+    def columns(self, indexes):
+        """Candidate columns for the ranking engine."""
+        candidates = {"latitude": self.latitude[indexes], "longitude": self.longitude[indexes]}
+        for column, values in self.attributes.items():
+            candidates[column] = values[indexes].astype(np.float64)
+        return candidates
+
+    def place(self, index, distance=None):
+        place = {"place_id": self.place_ids[index], "name": self.names[index],
+                 "latitude": float(self.latitude[index]), "longitude": float(self.longitude[index])}
+        for column, values in self.attributes.items():
+            value = values[index]
+            place[column] = None if np.isnan(value) else value.item()
+        place["open_now"] = None if place["open_now"] is None else bool(place["open_now"])
+        for column in INTEGER_COLUMNS:
+            if place[column] is not None:
+                place[column] = int(place[column])
+        if distance is not None:
+            place["distance_m"] = round(float(distance), 1)
+        return place
+
+    def memory_bytes(self):
+        """Bytes held by the numeric columns and the grid (strings excluded)."""
+        arrays = [self.latitude, self.longitude, self.type_masks, self.order, self.cell_keys, self.cell_starts, *self.attributes.values()]
+        return sum(array.nbytes for array in arrays)
@@ -1,4 +1,11 @@
 let map, userMarker;
+// Coordinates whose results this client wants pushed, sent to /ws once it is open
+let socket;
+const subscriptions = [];
+// /events stream used when the WebSocket cannot be opened, reopened as subscriptions are added
+let eventSource;
+let lastEventId;
+let useEventStream = false;
 const placesList = document.getElementById('places-list');
 
 function loadGoogleMapsApi(apiKey) {
@@ -34,6 +41,8 @@ function initMap() {
 
             console.log("Google Map and user marker initialized.");
 
+            map.addListener('idle', fetchViewportClusters);
+
             fetchNearbyPlaces(userLocation.lat, userLocation.lng);
         }, error => {
             console.error("Geolocation error:", error);
@@ -44,8 +53,18 @@ function initMap() {
     }
 }
 
+function subscribeToPlaces(latitude, longitude) {
+    subscriptions.push({ latitude, longitude });
+    if (socket && socket.readyState === WebSocket.OPEN) {
+        socket.send(JSON.stringify({ latitude, longitude }));
+    } else if (useEventStream) {
+        subscribeToEventStream();
+    }
+}
+
 function fetchNearbyPlaces(latitude, longitude) {
     console.log(`Fetching nearby places for coordinates: (${latitude}, ${longitude})`);
+    subscribeToPlaces(latitude, longitude);
 
     fetch('/process-coordinates', {
         method: 'POST',
@@ -65,14 +84,21 @@ function fetchNearbyPlaces(latitude, longitude) {
 }
 
 document.addEventListener('DOMContentLoaded', () => {
-    const socket = new WebSocket(`wss://${window.location.host}/ws`);
+    socket = new WebSocket(`wss://${window.location.host}/ws`);
+    let socketOpened = false;
 
     socket.onopen = () => {
+        socketOpened = true;
         console.log("WebSocket connection established.");
+        subscriptions.forEach((coordinates) => socket.send(JSON.stringify(coordinates)));
     };
 
     socket.onerror = (error) => {
         console.error("WebSocket connection error:", error);
+        if (!socketOpened) {
+            // Proxies that refuse the upgrade still let a plain HTTP stream through
+            subscribeToEventStream();
+        }
     };
 
     socket.onmessage = (event) => {
@@ -80,7 +106,9 @@ document.addEventListener('DOMContentLoaded', () => {
             const data = JSON.parse(event.data);
             console.log("Received data from WebSocket:", data);
 
-            if (data && data.latitude && data.longitude && Array.isArray(data.places)) {
+            if (data && data.type === "delta" && Array.isArray(data.order)) {
+                applyPlacesDelta(data);
+            } else if (data && data.latitude && data.longitude && Array.isArray(data.places)) {
                 const { latitude, longitude, places } = data;
                 console.log(`Coordinates received: (${latitude}, ${longitude}) with ${places.length} places`);
 
@@ -104,6 +132,57 @@ document.addEventListener('DOMContentLoaded', () => {
     console.log("WebSocket setup complete.");
 });
 
+function subscribeToEventStream() {
+    console.log("Falling back to the /events stream.");
+    useEventStream = true;
+    // The stream carries every coordinate subscribed so far and needs at least one;
+    // subscribeToPlaces opens it again when more are added
+    if (subscriptions.length === 0) {
+        return;
+    }
+    if (eventSource) {
+        eventSource.close();
+    }
+    const pairs = subscriptions.map(({ latitude, longitude }) => `latitude=${latitude}&longitude=${longitude}`);
+    // A reopened stream resumes after the last event seen; EventSource reconnects on its own with the Last-Event-ID header
+    const resume = lastEventId ? `&last_event_id=${lastEventId}` : '';
+    const source = eventSource = new EventSource(`/events?${pairs.join('&')}${resume}`);
+    source.addEventListener('places', (event) => {
+        lastEventId = event.lastEventId;
+        const data = JSON.parse(event.data);
+        console.log(`Event ${event.lastEventId}: ${data.places.length} places for (${data.latitude}, ${data.longitude})`);
+        const order = data.places.map((place) => place.place_id);
+        const removed = [...placesById.keys()].filter((placeId) => !order.includes(placeId));
+        applyPlacesDelta({ upserted: data.places, removed, order });
+    });
+    source.onerror = (error) => console.error("Event stream error:", error);
+}
+
+// Places the client currently shows, keyed by place_id, with their map markers
+const placesById = new Map();
+const markersById = new Map();
+
+function applyPlacesDelta(delta) {
+    console.log(`Applying delta: ${delta.upserted.length} upserted, ${delta.removed.length} removed`);
+    delta.removed.forEach((placeId) => {
+        placesById.delete(placeId);
+        const marker = markersById.get(placeId);
+        if (marker) {
+            marker.setMap(null);
+            markersById.delete(placeId);
+        }
+    });
+    delta.upserted.forEach((place) => {
+        placesById.set(place.place_id, place);
+        const marker = markersById.get(place.place_id);
+        if (marker) {
+            marker.setMap(null);
+            markersById.delete(place.place_id);
+        }
+    });
+    displayNearbyPlaces(delta.order.map((placeId) => placesById.get(placeId)).filter(Boolean));
+}
+
 function displayNearbyPlaces(places) {
     console.log("Displaying nearby places:", places);
     placesList.innerHTML = '';
@@ -120,6 +199,9 @@ function displayNearbyPlaces(places) {
         listItem.onclick = () => highlightPlace(place);
         placesList.appendChild(listItem);
 
+        if (markersById.has(place.place_id)) {
+            return;
+        }
         console.log("Adding place marker on map:", place.name);
         const marker = new google.maps.Marker({
             position: { lat: place.latitude, lng: place.longitude },
@@ -128,9 +210,48 @@ function displayNearbyPlaces(places) {
         });
 
         marker.addListener('click', () => highlightPlace(place));
+        if (place.place_id) {
+            markersById.set(place.place_id, marker);
+        }
     });
 }
 
+// Server-side clusters of every stored place in the current viewport
+let clusterMarkers = [];
+
+function fetchViewportClusters() {
+    const bounds = map.getBounds();
+    if (!bounds) {
+        return;
+    }
+    const northEast = bounds.getNorthEast();
+    const southWest = bounds.getSouthWest();
+    const params = new URLSearchParams({
+        north: northEast.lat(),
+        south: southWest.lat(),
+        east: northEast.lng(),
+        west: southWest.lng(),
+        zoom: map.getZoom(),
+    });
+
+    fetch(`/places/viewport?${params}`)
+        .then(response => response.json())
+        .then(data => {
+            console.log(`Viewport returned ${data.count} clusters at zoom ${data.zoom}`);
+            clusterMarkers.forEach((marker) => marker.setMap(null));
+            clusterMarkers = data.clusters
+                .filter((cluster) => !markersById.has(cluster.place_id))
+                .map((cluster) => new google.maps.Marker({
+                    position: { lat: cluster.latitude, lng: cluster.longitude },
+                    map,
+                    title: cluster.count > 1 ? `${cluster.count} places` : cluster.name,
+                    label: cluster.count > 1 ? String(cluster.count) : undefined,
+                    opacity: 0.7,
+                }));
+        })
+        .catch(error => console.error("Error fetching viewport clusters:", error));
+}
+
 function highlightPlace(place) {
     console.log("Highlighting place on map:", place.name);
     map.panTo({ lat: place.latitude, lng: place.longitude });
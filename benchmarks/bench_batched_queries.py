@@ -0,0 +1,73 @@
+"""
+Benchmark the set-based existence check and LATERAL ranking against one query per coordinate.
+Needs DATABASE_URL pointing at a scratch database: places from the fake provider and visits are written to it.
+
+Usage: python -m benchmarks.bench_batched_queries [batch sizes...]
+"""
+import asyncio
+import sys
+import time
+import numpy as np
+from dotenv import load_dotenv
+from app.database.init_db import init_db
+from app.fetch_planner import Tile
+from app.google_places.fake import FakePlacesProvider
+from app.services import AppService
+
+CENTER = (37.7749, -122.4194)
+REPEATS = 5
+
+
+async def best_of(function):
+    timings = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        await function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+async def seed(service, coordinates):
+    provider = FakePlacesProvider(seed=42)
+    for tile in {Tile.containing(latitude, longitude, service.fetch_planner.zoom) for latitude, longitude in coordinates}:
+        latitude, longitude = tile.center()
+        _, body = await provider.request({"location": f"{latitude},{longitude}", "radius": tile.search_radius_m()}, timeout=1)
+        await service.store_places_in_db_and_cache(latitude, longitude, body["results"], tile=tile)
+    for latitude, longitude in coordinates[::2]:
+        await service.generate_entry(latitude, longitude)
+
+
+async def run(sizes):
+    load_dotenv()
+    await init_db()
+    service = AppService()
+    await service.connect_db()
+    rng = np.random.default_rng(7)
+    coordinates = [(float(np.float32(CENTER[0] + dlat)), float(np.float32(CENTER[1] + dlon)))
+                   for dlat, dlon in zip(rng.normal(0, 0.02, max(sizes)), rng.normal(0, 0.02, max(sizes)))]
+    try:
+        await seed(service, coordinates)
+        print(f"{'batch':>6} {'exists x N':>11} {'exists set':>11} {'rank x N':>10} {'rank lateral':>13}")
+        for size in sizes:
+            batch = coordinates[:size]
+
+            async def exists_sequential():
+                return [await service.check_coordinates_in_db(latitude, longitude) for latitude, longitude in batch]
+
+            async def rank_sequential():
+                return [await service.rank_nearby_places_page(latitude, longitude) for latitude, longitude in batch]
+
+            timings = [
+                await best_of(exists_sequential),
+                await best_of(lambda: service.check_coordinates_in_db_many(batch)),
+                await best_of(rank_sequential),
+                await best_of(lambda: service.rank_nearby_places_many(batch)),
+            ]
+            print(f"{size:>6} {timings[0] * 1000:>9.1f}ms {timings[1] * 1000:>9.1f}ms "
+                  f"{timings[2] * 1000:>8.1f}ms {timings[3] * 1000:>11.1f}ms")
+    finally:
+        await service.db_pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(run([int(size) for size in sys.argv[1:]] or [1, 10, 50, 200]))
@@ -0,0 +1,50 @@
+"""
+Benchmark the Google fetch path end to end against the fake provider:
+multi-type searches with pagination, retries and hedging, no quota spent.
+
+Usage: python -m benchmarks.bench_fetch_path [searches] [concurrency]
+"""
+import asyncio
+import sys
+import time
+import numpy as np
+from app.fetch_planner import Tile
+from app.google_places.client import GooglePlacesClient, PlacesError
+from app.google_places.fake import FakePlacesProvider
+from app.google_places.rate_limit import TokenBucket, QuotaBudget
+
+CENTER = (37.7749, -122.4194)
+
+
+async def run(searches, concurrency):
+    provider = FakePlacesProvider(seed=42, latency_ms=5, jitter_ms=20, error_rate=0.01)
+    client = GooglePlacesClient("fake", rate_limiter=TokenBucket(rate=1e9, burst=1e9), quota_budget=QuotaBudget(0, 0),
+                                provider=provider, backoff_base=0.01, backoff_cap=0.05)
+    client.page_token_delay = 0
+    client.concurrency = concurrency
+    rng = np.random.default_rng(7)
+    tiles = [Tile.containing(CENTER[0] + dlat, CENTER[1] + dlon, 13)
+             for dlat, dlon in zip(rng.normal(0, 0.1, searches), rng.normal(0, 0.1, searches))]
+    latencies, places, failures = [], 0, 0
+
+    async def search(tile):
+        nonlocal places, failures
+        start = time.perf_counter()
+        try:
+            async for found, _ in client.multi_type_pages(*tile.center(), tile.search_radius_m()):
+                places += len(found)
+        except PlacesError:
+            failures += 1
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(search(tile) for tile in tiles))
+    elapsed = time.perf_counter() - start
+    print(f"searches: {searches} ({len(set(tiles))} distinct tiles), concurrency {concurrency}, elapsed {elapsed:.2f}s")
+    print(f"throughput: {searches / elapsed:.0f} searches/s, {client.requests_sent / elapsed:.0f} requests/s")
+    print(f"latency: p50 {np.percentile(latencies, 50) * 1000:.1f} ms, p99 {np.percentile(latencies, 99) * 1000:.1f} ms")
+    print(f"places per search: {places / searches:.1f}, failed searches: {failures}, hedges: {client.hedges_sent}")
+
+
+if __name__ == "__main__":
+    asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 2000, int(sys.argv[2]) if len(sys.argv) > 2 else 64))
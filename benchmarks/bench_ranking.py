@@ -0,0 +1,51 @@
+"""
+Benchmark the vectorized ranking engine: scoring, argpartition top-k and a full argsort for comparison.
+
+Usage: python -m benchmarks.bench_ranking [sizes...]
+"""
+import sys
+import time
+import numpy as np
+from app.ranking import RankingEngine, ScoringConfig, DEFAULT_WEIGHTS
+
+ORIGIN = (37.7749, -122.4194)
+K = 10
+REPEATS = 5
+
+
+def synthetic_candidates(count, seed=42):
+    rng = np.random.default_rng(seed)
+    return {
+        "latitude": ORIGIN[0] + rng.normal(0, 0.03, count),
+        "longitude": ORIGIN[1] + rng.normal(0, 0.03, count),
+        "rating": np.where(rng.random(count) < 0.05, np.nan, np.round(rng.uniform(1, 5, count), 1)),
+        "user_ratings_total": np.floor(rng.pareto(1.2, count) * 20),
+        "open_now": np.where(rng.random(count) < 0.1, np.nan, rng.integers(0, 2, count).astype(np.float64)),
+        "price_level": np.where(rng.random(count) < 0.3, np.nan, rng.integers(0, 5, count).astype(np.float64)),
+    }
+
+
+def best_of(function):
+    timings = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run(sizes):
+    engine = RankingEngine(ScoringConfig(), DEFAULT_WEIGHTS)
+    print(f"{'candidates':>10} {'score':>10} {'top-k':>10} {'full sort':>10} {'per place':>10}")
+    for count in sizes:
+        candidates = synthetic_candidates(count)
+        score_time = best_of(lambda: engine.score(candidates, *ORIGIN))
+        top_k_time = best_of(lambda: engine.top_k(candidates, *ORIGIN, K))
+        scores = engine.score(candidates, *ORIGIN)
+        sort_time = best_of(lambda: np.argsort(-scores)[:K])
+        print(f"{count:>10} {score_time * 1e3:>8.2f}ms {top_k_time * 1e3:>8.2f}ms "
+              f"{(score_time + sort_time) * 1e3:>8.2f}ms {top_k_time / count * 1e9:>8.1f}ns")
+
+
+if __name__ == "__main__":
+    run([int(size) for size in sys.argv[1:]] or [10_000, 100_000, 1_000_000])
@@ -0,0 +1,60 @@
+"""
+Benchmark the in-memory spatial index: build time, memory per place and
+radius / k-NN query latency.
+
+Usage: python -m benchmarks.bench_spatial_index [places]
+"""
+import sys
+import time
+import numpy as np
+from app.spatial_index import SpatialIndex
+
+CENTER = (37.7749, -122.4194)
+QUERIES = 2000
+
+
+def synthetic_rows(count, seed=42):
+    rng = np.random.default_rng(seed)
+    # A dense core with a long tail, roughly the shape of a metro area
+    latitudes = CENTER[0] + rng.standard_t(3, count) * 0.05
+    longitudes = CENTER[1] + rng.standard_t(3, count) * 0.05
+    ratings = np.round(rng.uniform(1, 5, count), 1)
+    reviews = rng.integers(0, 5000, count)
+    return [(f"ChIJ{i:023d}", f"Place {i}", float(latitudes[i]), float(longitudes[i]),
+             float(ratings[i]), int(reviews[i]), bool(i % 2), int(i % 5)) for i in range(count)]
+
+
+def per_query_us(function, points):
+    start = time.perf_counter()
+    for latitude, longitude in points:
+        function(latitude, longitude)
+    return (time.perf_counter() - start) / len(points) * 1e6
+
+
+def run(count):
+    rows = synthetic_rows(count)
+    index = SpatialIndex()
+    start = time.perf_counter()
+    index.add_many(rows)
+    index.rebuild()
+    build_time = time.perf_counter() - start
+
+    strings = sum(sys.getsizeof(place_id) + sys.getsizeof(name) for place_id, name in zip(index.place_ids, index.names))
+    lookup = sys.getsizeof(index.positions)
+    print(f"places: {count}, build: {build_time:.2f}s")
+    print(f"memory per place: {index.memory_bytes() / count:.1f} B numeric columns, "
+          f"{strings / count:.1f} B id/name strings, {lookup / count:.1f} B place_id lookup")
+
+    rng = np.random.default_rng(7)
+    points = list(zip(CENTER[0] + rng.normal(0, 0.05, QUERIES), CENTER[1] + rng.normal(0, 0.05, QUERIES)))
+    for radius_m in (250, 1000):
+        found = np.mean([len(index.radius(latitude, longitude, radius_m)[0]) for latitude, longitude in points[:100]])
+        latency = per_query_us(lambda latitude, longitude: index.radius(latitude, longitude, radius_m), points)
+        print(f"radius {radius_m:>5} m: {latency:8.1f} us/query, {found:.0f} places on average")
+    for k in (10, 100):
+        latency = per_query_us(lambda latitude, longitude: index.nearest(latitude, longitude, k), points)
+        print(f"k-NN k={k:<4}: {latency:8.1f} us/query")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,79 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+
+class FakePool:
+    """
+    Stands in for an asyncpg pool and the connections it hands out.
+
+    Every query is kept in `calls` as (method, query, args) and answered by
+    `handler(method, query, args)`, or None without one; a handler may raise
+    to simulate a failing statement. Queries take `delay` seconds, and with
+    `fail` set acquire() raises it, like a pool whose server is gone.
+    acquire() is awaited or used with `async with`, as with asyncpg.
+    """
+
+    def __init__(self, handler=None, delay=0, fail=None, size=1, idle=1):
+        self.handler = handler
+        self.delay = delay
+        self.fail = fail
+        self.size = size
+        self.idle = idle
+        self.calls = []
+        self.released = 0
+
+    def acquire(self, timeout=None):
+        return FakeAcquire(self)
+
+    async def connect(self):
+        if self.fail is not None:
+            raise self.fail
+        return self
+
+    async def release(self, connection):
+        self.released += 1
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield
+
+    def get_size(self):
+        return self.size
+
+    def get_idle_size(self):
+        return self.idle
+
+    async def query(self, method, query, args):
+        self.calls.append((method, query, args))
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return self.handler(method, query, args) if self.handler else None
+
+    async def execute(self, query, *args, **kwargs):
+        return await self.query("execute", query, args)
+
+    async def executemany(self, query, args, **kwargs):
+        return await self.query("executemany", query, args)
+
+    async def fetch(self, query, *args, **kwargs):
+        return await self.query("fetch", query, args)
+
+    async def fetchrow(self, query, *args, **kwargs):
+        return await self.query("fetchrow", query, args)
+
+    async def fetchval(self, query, *args, **kwargs):
+        return await self.query("fetchval", query, args)
+
+
+class FakeAcquire:
+    def __init__(self, pool):
+        self.pool = pool
+
+    def __await__(self):
+        return self.pool.connect().__await__()
+
+    async def __aenter__(self):
+        return await self.pool.connect()
+
+    async def __aexit__(self, *exc_info):
+        await self.pool.release(self.pool)
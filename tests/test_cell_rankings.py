@@ -0,0 +1,113 @@
+import asyncio
+import unittest
+from app.database.cell_rankings import CellTopPlaces
+from tests.fakes import FakePool
+
+def scripted_pool(*fetches):
+    """Pool answering successive fetches with the given rows."""
+    results = list(fetches)
+    return FakePool(handler=lambda method, query, args: results.pop(0) if method == "fetch" else None)
+
+def updates(pool):
+    return [row for method, _, rows in pool.calls if method == "executemany" for row in rows]
+
+class TestCellTopPlaces(unittest.IsolatedAsyncioTestCase):
+
+    async def test_refresh_writes_rankings_for_the_generation_read(self):
+        """Stale cells are ranked top_n deep and written back only for the generation they were read at."""
+        pool = scripted_pool([
+            {"latitude": 1.0, "longitude": 2.0, "generation": 3},
+            {"latitude": 4.0, "longitude": 5.0, "generation": 7},
+        ])
+        requested = []
+
+        async def rank_many(coordinates, k):
+            requested.append((coordinates, k))
+            return [[{"place_id": "a"}, {"place_id": "b"}], []]
+
+        cells = CellTopPlaces(top_n=5, batch_size=10, refresh_interval=60)
+        cells.pool, cells.rank_many = pool, rank_many
+
+        self.assertEqual(await cells.refresh(), 2)
+        self.assertEqual(requested, [([(1.0, 2.0), (4.0, 5.0)], 5)])
+        self.assertEqual(updates(pool), [(1.0, 2.0, ["a", "b"], 3), (4.0, 5.0, [], 7)])
+
+    async def test_refresh_without_stale_cells(self):
+        """Nothing is ranked when no cell is stale."""
+        cells = CellTopPlaces(top_n=5, batch_size=10, refresh_interval=60)
+        cells.pool = scripted_pool([])
+
+        self.assertEqual(await cells.refresh(), 0)
+
+    async def test_lookup_tells_missing_from_empty(self):
+        """A missing or stale cell is None, a fresh cell without places is an empty ranking."""
+        cells = CellTopPlaces(top_n=5, batch_size=10, refresh_interval=60)
+        pool = scripted_pool(
+            [],
+            [{"place_id": None, "position": None}],
+            [{"place_id": "a", "name": "A", "position": 1}, {"place_id": "b", "name": "B", "position": 2}],
+        )
+
+        self.assertIsNone(await cells.lookup(pool, 1.0, 2.0))
+        self.assertEqual(await cells.lookup(pool, 1.0, 2.0), [])
+        self.assertEqual(await cells.lookup(pool, 1.0, 2.0), [{"place_id": "a", "name": "A"}, {"place_id": "b", "name": "B"}])
+
+    async def test_mark_stale_locks_cells_in_order_first(self):
+        """Cells are locked in coordinate order before the update, which only touches the locked cells."""
+        cells = CellTopPlaces(top_n=5, batch_size=10, refresh_interval=60)
+        pool = scripted_pool([{"latitude": 1.0, "longitude": 2.0}, {"latitude": 1.0, "longitude": 3.0}],
+                             [{"latitude": 1.0, "longitude": 2.0, "generation": 4}, {"latitude": 1.0, "longitude": 3.0, "generation": 2}])
+
+        marked = await cells.mark_stale(pool, 1.0, 2.0, ["a"], [7])
+
+        (_, lock, _), (_, update, args) = pool.calls
+        self.assertIn("ORDER BY latitude, longitude", lock)
+        self.assertIn("FOR UPDATE", lock)
+        self.assertEqual(args, ([1.0, 1.0], [2.0, 3.0]))
+        self.assertEqual(len(marked), 2)
+        self.assertEqual(await cells.mark_stale(scripted_pool([]), 1.0, 2.0, [], []), [])
+
+    async def test_reads_are_recorded_in_lock_order(self):
+        """Cells read while the loop runs get their last_read_at written in coordinate order, once."""
+        cells = CellTopPlaces(top_n=5, batch_size=10, refresh_interval=60)
+        cells.task = asyncio.get_running_loop().create_future()
+        cells.pool = FakePool()
+        cells.touch(3.0, 1.0)
+        cells.touch(1.0, 2.0)
+        await cells.lookup(scripted_pool([]), 1.0, 2.0)
+
+        self.assertEqual(await cells.record_reads(), 2)
+        self.assertEqual(cells.pool.calls[0][2], ([1.0, 3.0], [2.0, 1.0]))
+        self.assertEqual(await cells.record_reads(), 0)
+        cells.task.cancel()
+
+    async def test_failed_read_recording_is_retried(self):
+        """Reads whose write failed are kept for the next round."""
+        cells = CellTopPlaces(top_n=5, batch_size=10, refresh_interval=60)
+        cells.pool = FakePool(fail=OSError("gone"))
+        cells.reads = {(1.0, 2.0)}
+
+        with self.assertRaises(OSError):
+            await cells.record_reads()
+        self.assertEqual(cells.reads, {(1.0, 2.0)})
+
+    async def test_prune_deletes_idle_cells_in_batches(self):
+        """Cells idle past idle_seconds are deleted a batch at a time, skipping locked ones."""
+        cells = CellTopPlaces(top_n=5, batch_size=10, refresh_interval=60, idle_seconds=3600)
+        cells.pool = FakePool(handler=lambda method, query, args: "DELETE 4")
+
+        self.assertEqual(await cells.prune(), 4)
+        (_, query, args), = cells.pool.calls
+        self.assertIn("SKIP LOCKED", query)
+        self.assertEqual(args, (3600, 10))
+
+    async def test_register_returns_the_generation_of_an_existing_cell(self):
+        """Registering upserts, so the generation comes back even if another transaction inserted the cell."""
+        cells = CellTopPlaces(top_n=5, batch_size=10, refresh_interval=60)
+        pool = FakePool(handler=lambda method, query, args: 6)
+
+        self.assertEqual(await cells.register(pool, 1.0, 2.0, [7]), 6)
+        self.assertIn("DO UPDATE SET last_read_at", pool.calls[0][1])
+
+if __name__ == "__main__":
+    unittest.main()
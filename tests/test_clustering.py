@@ -0,0 +1,78 @@
+import unittest
+import random
+from app.clustering import ClusterIndex
+
+def dense_city(count, seed=7):
+    rng = random.Random(seed)
+    return [(str(i), f"Place {i}", 4.0, 37.7749 + rng.gauss(0, 0.02), -122.4194 + rng.gauss(0, 0.02))
+            for i in range(count)]
+
+class TestClusterIndex(unittest.TestCase):
+
+    def test_clusters_account_for_every_place(self):
+        """At low zoom a dense city collapses into a few clusters covering all places."""
+        index = ClusterIndex(max_zoom=16)
+        index.add_many(dense_city(5000))
+
+        clusters = index.query(north=38.5, south=37.0, east=-121.5, west=-123.5, zoom=8)
+
+        self.assertLess(len(clusters), 20)
+        self.assertEqual(sum(cluster["count"] for cluster in clusters), 5000)
+
+    def test_viewport_returns_a_bounded_number_of_clusters(self):
+        """A city-sized viewport returns hundreds of clusters, not thousands of points."""
+        index = ClusterIndex(max_zoom=16)
+        index.add_many(dense_city(20000))
+
+        clusters = index.query(north=37.82, south=37.73, east=-122.36, west=-122.48, zoom=13)
+
+        self.assertLess(len(clusters), 500)
+
+    def test_single_places_and_points_past_max_zoom(self):
+        """Isolated places come back as themselves, and past max_zoom no clustering happens."""
+        index = ClusterIndex(max_zoom=10)
+        index.add_many([("a", "A", 4.5, 10.0, 10.0), ("b", "B", 3.0, 10.0001, 10.0001), ("c", "C", 5.0, -30.0, 50.0)])
+
+        far = index.query(north=-29.0, south=-31.0, east=51.0, west=49.0, zoom=5)
+        near = index.query(north=10.1, south=9.9, east=10.1, west=9.9, zoom=18)
+
+        self.assertEqual(far, [{"place_id": "c", "name": "C", "rating": 5.0, "latitude": -30.0, "longitude": 50.0, "count": 1}])
+        self.assertEqual(sorted(place["place_id"] for place in near), ["a", "b"])
+
+    def test_antimeridian_and_duplicates(self):
+        """Viewports crossing 180 degrees find places on both sides; a replaced place is updated, not duplicated."""
+        index = ClusterIndex(max_zoom=10)
+        index.add_many([("east", "E", 4.0, 0.0, 179.9), ("west", "W", 4.0, 0.0, -179.9)])
+        index.add_many([("east", "E", 4.8, 0.0, 179.8), ("west", "W", 1.0, 0.0, -179.9)], replace={"east"})
+
+        clusters = index.query(north=1.0, south=-1.0, east=-179.0, west=179.0, zoom=10)
+
+        self.assertEqual(len(index), 2)
+        self.assertEqual(sorted((cluster["place_id"], cluster["rating"], cluster["longitude"]) for cluster in clusters),
+                         [("east", 4.8, 179.8), ("west", 4.0, -179.9)])
+
+    def test_points_past_max_zoom_are_clipped_to_the_box(self):
+        """Places in an edge cell but outside the box's longitude are left out, on either side of the antimeridian."""
+        index = ClusterIndex(max_zoom=10)
+        index.add_many([("in", "I", 4.0, 10.0, 10.0), ("east of box", "O", 4.0, 10.0, 10.01),
+                        ("wrapped", "W", 4.0, 0.0, -179.0), ("past wrap", "P", 4.0, 0.0, -178.99)])
+
+        plain = index.query(north=10.1, south=9.9, east=10.005, west=9.9, zoom=18)
+        wrapped = index.query(north=1.0, south=-1.0, east=-178.995, west=179.0, zoom=18)
+
+        self.assertEqual([place["place_id"] for place in plain], ["in"])
+        self.assertEqual([place["place_id"] for place in wrapped], ["wrapped"])
+
+    def test_moved_place_leaves_its_old_cells(self):
+        """A place updated to a new location is counted only where it now is, at every zoom."""
+        index = ClusterIndex(max_zoom=10)
+        index.add_many([("a", "A", 4.0, 10.0, 10.0), ("b", "B", 3.0, 10.0, 10.0001)])
+        index.add("a", "A", 4.5, -30.0, 50.0, replace=True)
+
+        self.assertEqual(index.query(north=11.0, south=9.0, east=11.0, west=9.0, zoom=3),
+                         [{"place_id": "b", "name": "B", "rating": 3.0, "latitude": 10.0, "longitude": 10.0001, "count": 1}])
+        self.assertEqual([place["place_id"] for place in index.query(north=-29.0, south=-31.0, east=51.0, west=49.0, zoom=12)], ["a"])
+        self.assertEqual(sum(cell[0] for cell in index.levels[0].values()), 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+import json
+from app.messaging.streaming import send_places_delta
+from app.messaging.delta import RankedPayload, PlaceDeltaTracker, encode_delta_message, encode_places_message
+
+def make_place(place_id, rating=4.0, open_now=True):
+    return {"place_id": place_id, "name": f"Place {place_id}", "rating": rating,
+            "user_ratings_total": 10, "price_level": 2, "open_now": open_now}
+
+class TestPlaceDelta(unittest.TestCase):
+
+    def test_first_push_sends_every_place(self):
+        """A fresh connection receives the whole ranked list as upserts."""
+        tracker = PlaceDeltaTracker()
+        payload = RankedPayload([make_place("a"), make_place("b")])
+
+        upserted, removed = tracker.diff(payload)
+
+        self.assertEqual(upserted, ["a", "b"])
+        self.assertEqual(removed, [])
+
+    def test_only_changes_are_sent(self):
+        """Added, changed and removed places are detected by place_id."""
+        tracker = PlaceDeltaTracker()
+        tracker.commit(RankedPayload([make_place("a"), make_place("b"), make_place("c")]))
+
+        upserted, removed = tracker.diff(RankedPayload([make_place("b", open_now=False), make_place("a"), make_place("d")]))
+
+        self.assertEqual(upserted, ["b", "d"])
+        self.assertEqual(removed, ["c"])
+
+    def test_identical_push_is_skipped(self):
+        """Pushing the same ranking twice produces no message."""
+        tracker = PlaceDeltaTracker()
+        tracker.commit(RankedPayload([make_place("a"), make_place("b")]))
+
+        self.assertEqual(tracker.diff(RankedPayload([make_place("a"), make_place("b")])), (None, None))
+
+    def test_reorder_without_changes_still_pushes_order(self):
+        """A pure re-ranking is sent as an empty delta carrying the new order."""
+        tracker = PlaceDeltaTracker()
+        tracker.commit(RankedPayload([make_place("a"), make_place("b")]))
+        payload = RankedPayload([make_place("b"), make_place("a")])
+
+        upserted, removed = tracker.diff(payload)
+        message = json.loads(encode_delta_message(1.0, 2.0, payload, upserted, removed))
+
+        self.assertEqual(message["upserted"], [])
+        self.assertEqual(message["order"], ["b", "a"])
+
+    def test_encoded_messages_are_valid_json(self):
+        """Messages assembled from cached fragments decode to the original places."""
+        places = [make_place("a", rating=4.5), make_place("b")]
+        payload = RankedPayload(places)
+
+        full = json.loads(encode_places_message(37.7749, -122.4194, payload))
+        delta = json.loads(encode_delta_message(37.7749, -122.4194, payload, ["b"], ["z"]))
+
+        self.assertEqual(full["places"], places)
+        self.assertEqual(delta["upserted"], [places[1]])
+        self.assertEqual(delta["removed"], ["z"])
+        self.assertEqual(payload.full_size(37.7749, -122.4194), len(encode_places_message(37.7749, -122.4194, payload).encode()))
+
+    def test_compressed_size_uses_deflate_context(self):
+        """Repeated frames get cheaper on a connection with permessage-deflate."""
+        tracker = PlaceDeltaTracker(deflate=True)
+        data = encode_places_message(1.0, 2.0, RankedPayload([make_place(str(i)) for i in range(10)])).encode()
+
+        first = tracker.compressed_size(data)
+        second = tracker.compressed_size(data)
+
+        self.assertLess(first, len(data))
+        self.assertLess(second, first)
+
+class FlakySocket:
+    """WebSocket whose sends fail until `fail` is cleared."""
+
+    def __init__(self):
+        self.fail = True
+        self.sent = []
+
+    async def send_text(self, message):
+        if self.fail:
+            raise ConnectionError("socket closed")
+        self.sent.append(json.loads(message))
+
+class TestSendPlacesDelta(unittest.IsolatedAsyncioTestCase):
+
+    async def test_failed_send_is_not_recorded(self):
+        """After a failed send the next push still carries every place the client has not received."""
+        tracker = PlaceDeltaTracker()
+        socket = FlakySocket()
+        payload = RankedPayload([make_place("a"), make_place("b")])
+
+        with self.assertRaises(ConnectionError):
+            await send_places_delta(socket, tracker, 1.0, 2.0, payload)
+        socket.fail = False
+        await send_places_delta(socket, tracker, 1.0, 2.0, payload)
+
+        self.assertEqual([place["place_id"] for place in socket.sent[0]["upserted"]], ["a", "b"])
+        self.assertEqual(tracker.diff(payload), (None, None))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+from app.fetch_planner import FetchPlanner, Tile
+from app.geo import haversine_m
+
+class TestFetchPlanner(unittest.TestCase):
+
+    def setUp(self):
+        self.planner = FetchPlanner(zoom=13, coverage_radius_m=1000, max_age_seconds=3600)
+
+    def test_nearby_requests_share_tiles(self):
+        """Two users 50 m apart map to the same canonical searches."""
+        first = self.planner.covering_tiles(37.7749, -122.4194)
+        second = self.planner.covering_tiles(37.7753, -122.4194)
+
+        self.assertEqual(set(first), set(second))
+        self.assertLessEqual(len(first), 4)
+
+    def test_search_circle_covers_the_tile(self):
+        """Every corner of a tile lies inside the search centred on the tile centre."""
+        for latitude in (0.0, 37.7749, 60.0):
+            tile = Tile.containing(latitude, 10.0, 13)
+            center = tile.center()
+            north, south, east, west = tile.bounds()
+            for corner in ((north, west), (north, east), (south, west), (south, east)):
+                self.assertLessEqual(haversine_m(*center, *corner), tile.search_radius_m())
+
+    def test_covering_tiles_reach_the_coverage_radius(self):
+        """Points within the coverage radius all fall in one of the planned tiles."""
+        latitude, longitude = 37.7749, -122.4194
+        tiles = set(self.planner.covering_tiles(latitude, longitude))
+        for dlat, dlon in ((0.008, 0), (-0.008, 0), (0, 0.01), (0, -0.01), (0.006, 0.007)):
+            point = (latitude + dlat, longitude + dlon)
+            if haversine_m(latitude, longitude, *point) <= 1000:
+                self.assertIn(Tile.containing(*point, 13), tiles)
+
+    def test_plan_follows_the_tile_tree(self):
+        """Unknown areas are searched at the default zoom, split tiles through their children."""
+        planner = FetchPlanner(zoom=13, coverage_radius_m=10, min_zoom=11, max_zoom=15)
+        latitude, longitude = 37.7749, -122.4194
+        home = Tile.containing(latitude, longitude, 13)
+
+        self.assertEqual(planner.plan(latitude, longitude, {}), [home])
+
+        nodes = {home.key: {"state": "split", "result_count": 20, "fresh": True}}
+        self.assertEqual(planner.plan(latitude, longitude, nodes), [Tile.containing(latitude, longitude, 14)])
+
+        nodes[home.key]["state"] = "leaf"
+        self.assertEqual(planner.plan(latitude, longitude, nodes), [])
+
+    def test_merged_parent_replaces_sparse_children(self):
+        """Four fresh sparse siblings merge into their parent, which is then searched instead."""
+        planner = FetchPlanner(zoom=13, coverage_radius_m=10, min_zoom=11, max_zoom=15, sparse_results=5)
+        latitude, longitude = 44.0, -110.0
+        home = Tile.containing(latitude, longitude, 13)
+        nodes = {child.key: {"state": "leaf", "result_count": 1, "fresh": True} for child in home.parent().children()}
+
+        parent = planner.mergeable_parent(home, nodes)
+        self.assertEqual(parent, home.parent())
+
+        nodes[parent.key] = {"state": "leaf", "result_count": 4, "fresh": False}
+        self.assertEqual(planner.plan(latitude, longitude, nodes), [parent])
+
+    def test_saturation_and_dense_siblings(self):
+        """Saturated tiles split unless at max zoom, and busy sibling groups never merge."""
+        planner = FetchPlanner(zoom=13, min_zoom=11, max_zoom=15, saturation=20, sparse_results=5)
+        tile = Tile.containing(37.7749, -122.4194, 13)
+        nodes = {child.key: {"state": "leaf", "result_count": 12, "fresh": True} for child in tile.parent().children()}
+
+        self.assertTrue(planner.is_saturated(tile, 20))
+        self.assertFalse(planner.is_saturated(Tile.containing(37.7749, -122.4194, 15), 20))
+        self.assertIsNone(planner.mergeable_parent(tile, nodes))
+
+    def test_tile_key_round_trip(self):
+        """Tile keys are unique integers that decode back to the tile."""
+        tile = Tile.containing(-33.8688, 151.2093, 15)
+
+        self.assertEqual(Tile.from_key(tile.key), tile)
+        self.assertNotEqual(Tile(15, tile.x + 1, tile.y).key, tile.key)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+import unittest
+import asyncio
+import json
+from app.messaging.delta import RankedPayload
+from app.messaging.hub import ResultHub
+from app.messaging.streaming import stream_events, stream_to_websocket
+
+def make_payload(*place_ids):
+    return RankedPayload([{"place_id": place_id, "name": place_id} for place_id in place_ids])
+
+class TestResultHub(unittest.IsolatedAsyncioTestCase):
+
+    async def collect(self, subscription, count):
+        events = []
+        async for event in subscription:
+            events.append(event)
+            if len(events) == count:
+                break
+        return events
+
+    async def test_subscribers_receive_published_events(self):
+        """Every subscriber sees each event published after it subscribed."""
+        hub = ResultHub()
+        first = asyncio.create_task(self.collect(hub.subscribe(), 2))
+        second = asyncio.create_task(self.collect(hub.subscribe(), 2))
+        await asyncio.sleep(0)
+
+        await hub.publish(1.0, 2.0, make_payload("a"))
+        await hub.publish(3.0, 4.0, make_payload("b"))
+
+        for task in (first, second):
+            events = await asyncio.wait_for(task, 1)
+            self.assertEqual([event.id for event in events], [1, 2])
+
+    async def test_resume_from_last_event_id(self):
+        """A reconnecting client replays the events it missed from the history."""
+        hub = ResultHub()
+        for place_id in "abc":
+            await hub.publish(1.0, 2.0, make_payload(place_id))
+
+        events = await asyncio.wait_for(self.collect(hub.subscribe(last_event_id=1), 2), 1)
+
+        self.assertEqual([event.id for event in events], [2, 3])
+
+    async def test_history_is_bounded(self):
+        """Only the most recent events are kept for resuming."""
+        hub = ResultHub(history_size=2)
+        for place_id in "abcd":
+            await hub.publish(1.0, 2.0, make_payload(place_id))
+
+        self.assertEqual([event.id for event in hub.events_after(0)], [3, 4])
+
+    async def test_key_filter_and_heartbeat(self):
+        """Subscriptions filtered by coordinates skip other events and emit heartbeats while idle."""
+        hub = ResultHub()
+        subscription = hub.subscribe(key="1.0_2.0", heartbeat=0.01)
+        await hub.publish(3.0, 4.0, make_payload("x"))
+        await hub.publish(1.0, 2.0, make_payload("y"))
+
+        self.assertEqual((await anext_event(subscription)).payload.order, ["y"])
+        self.assertIsNone(await anext_event(subscription))
+
+    async def test_websocket_only_receives_its_own_keys(self):
+        """A socket gets results for the coordinates it connected or subscribed with, and nothing else."""
+        hub = ResultHub()
+        socket = FakeSocket()
+        streaming = asyncio.create_task(stream_to_websocket(socket, hub, ["1.0_2.0"]))
+        await socket.incoming.put({"type": "websocket.receive", "text": json.dumps({"latitude": 5.00001, "longitude": 6.0})})
+        await asyncio.sleep(0.01)
+
+        await hub.publish(1.0, 2.0, make_payload("mine"))
+        await hub.publish(3.0, 4.0, make_payload("someone else"))
+        await hub.publish(5.0, 6.0, make_payload("subscribed"))
+        await asyncio.sleep(0.01)
+        await socket.incoming.put({"type": "websocket.disconnect"})
+        await asyncio.wait_for(streaming, 1)
+
+        self.assertEqual([(message["latitude"], message["order"]) for message in socket.sent],
+                         [(1.0, ["mine"]), (5.0, ["subscribed"])])
+
+    async def test_event_stream_only_carries_its_keys(self):
+        """An /events stream carries the results of each of its coordinates and no one else's."""
+        hub = ResultHub()
+        stream = stream_events(hub, ["1.0_2.0", "5.0_6.0"], "ndjson")
+        received = asyncio.create_task(stream.__anext__())
+        await asyncio.sleep(0.01)
+
+        await hub.publish(3.0, 4.0, make_payload("someone else"))
+        await hub.publish(5.0, 6.0, make_payload("second"))
+        await hub.publish(1.0, 2.0, make_payload("first"))
+        lines = [await asyncio.wait_for(received, 1), await asyncio.wait_for(stream.__anext__(), 1)]
+        await stream.aclose()
+
+        self.assertEqual([json.loads(line)["places"][0]["place_id"] for line in lines], ["second", "first"])
+
+    async def test_event_encodings(self):
+        """SSE and NDJSON frames carry the event id and the full place list."""
+        hub = ResultHub()
+        event = await hub.publish(1.0, 2.0, make_payload("a"))
+
+        self.assertTrue(event.sse.startswith(b"id: 1\nevent: places\ndata: "))
+        line = json.loads(event.ndjson)
+        self.assertEqual(line["id"], 1)
+        self.assertEqual(line["places"], [{"place_id": "a", "name": "a"}])
+
+class FakeSocket:
+    """WebSocket fed from a queue of ASGI messages, keeping what is sent to it."""
+
+    def __init__(self):
+        self.headers = {}
+        self.incoming = asyncio.Queue()
+        self.sent = []
+
+    async def receive(self):
+        return await self.incoming.get()
+
+    async def send_text(self, message):
+        self.sent.append(json.loads(message))
+
+async def anext_event(subscription):
+    return await asyncio.wait_for(subscription.__anext__(), 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import asyncio
+import unittest
+from prometheus_client import REGISTRY
+from app.database.instrumentation import InstrumentedPool, redact
+from tests.fakes import FakePool
+
+def sleepy_pool(delay):
+    """Pool of three connections, one idle, whose fetchval takes `delay` seconds and returns the argument count."""
+    return FakePool(handler=lambda method, query, args: len(args), delay=delay, size=3, idle=1)
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+class TestInstrumentedPool(unittest.IsolatedAsyncioTestCase):
+
+    async def test_queries_are_timed_by_statement_name(self):
+        """Each query is observed under the statement name given at its call site."""
+        pool = InstrumentedPool(sleepy_pool(0), "test", slow_query_ms=1000)
+        before = sample("db_query_seconds_count", statement="count_rows")
+        unnamed = sample("db_query_seconds_count", statement="unnamed")
+        acquired = sample("db_pool_acquire_seconds_count", pool="test", outcome="ok")
+
+        async with pool.acquire() as conn:
+            self.assertEqual(await conn.fetchval("SELECT $1, $2", 1, "a", statement="count_rows"), 2)
+            await conn.execute("SELECT 1")
+
+        self.assertEqual(sample("db_query_seconds_count", statement="count_rows"), before + 1)
+        self.assertEqual(sample("db_query_seconds_count", statement="unnamed"), unnamed + 1)
+        self.assertEqual(sample("db_pool_acquire_seconds_count", pool="test", outcome="ok"), acquired + 1)
+
+    async def test_slow_queries_are_logged_redacted(self):
+        """A query over the threshold is logged and counted without its parameter values."""
+        pool = InstrumentedPool(sleepy_pool(0.02), "test", slow_query_ms=10)
+        before = sample("db_slow_queries_total", statement="read_secret")
+
+        with self.assertLogs(level="WARNING") as logs:
+            async with pool.acquire() as conn:
+                await conn.fetchval("SELECT *\n  FROM secrets WHERE token = $1", "hunter2", statement="read_secret")
+
+        self.assertIn("Slow query read_secret", logs.output[0])
+        self.assertIn("SELECT * FROM secrets WHERE token = $1 with ['<str>']", logs.output[0])
+        self.assertNotIn("hunter2", logs.output[0])
+        self.assertEqual(sample("db_slow_queries_total", statement="read_secret"), before + 1)
+
+    async def test_failed_acquires_are_observed(self):
+        """Acquire waits that time out or raise are recorded under their outcome and re-raised."""
+        timeouts = sample("db_pool_acquire_seconds_count", pool="failing", outcome="timeout")
+        errors = sample("db_pool_acquire_seconds_count", pool="failing", outcome="error")
+
+        with self.assertRaises(asyncio.TimeoutError):
+            async with InstrumentedPool(FakePool(fail=asyncio.TimeoutError()), "failing").acquire():
+                pass
+        with self.assertRaises(OSError):
+            await InstrumentedPool(FakePool(fail=OSError("gone")), "failing").acquire()
+
+        self.assertEqual(sample("db_pool_acquire_seconds_count", pool="failing", outcome="timeout"), timeouts + 1)
+        self.assertEqual(sample("db_pool_acquire_seconds_count", pool="failing", outcome="error"), errors + 1)
+
+    async def test_awaited_acquire_and_release(self):
+        """An awaited acquire hands out an instrumented connection that release() returns to the pool unwrapped."""
+        fake = sleepy_pool(0)
+        pool = InstrumentedPool(fake, "test")
+
+        conn = await pool.acquire()
+        self.assertEqual(await conn.fetchval("SELECT $1", 1, statement="count_rows"), 1)
+        await pool.release(conn)
+
+        self.assertEqual(fake.released, 1)
+        async with pool.acquire():
+            pass
+        self.assertEqual(fake.released, 2)
+
+    async def test_connection_gauges_and_passthrough(self):
+        """In-use and idle connections are read from the pool; other connection methods pass through."""
+        pool = InstrumentedPool(sleepy_pool(0), "gauged")
+
+        self.assertEqual(sample("db_pool_connections", pool="gauged", state="in_use"), 2)
+        self.assertEqual(sample("db_pool_connections", pool="gauged", state="idle"), 1)
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                pass
+            self.assertEqual(conn.get_size(), 3)
+
+    def test_redact(self):
+        """Parameters are reduced to their type, and length for sequences."""
+        self.assertEqual([redact(37.7), redact([1, 2, 3]), redact(None)], ["<float>", "<list[3]>", "<NoneType>"])
+
+if __name__ == "__main__":
+    unittest.main()
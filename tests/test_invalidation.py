@@ -0,0 +1,68 @@
+import json
+import unittest
+import numpy as np
+from cachetools import TTLCache
+from app.database.invalidation import CacheInvalidator, MAX_NOTIFY_BYTES
+from tests.fakes import FakePool
+
+def generation_pool(generations):
+    """Pool answering the version check from a dict of (latitude, longitude) -> generation."""
+    def answer(method, query, args):
+        if method == "fetch":
+            latitudes, longitudes = args
+            return [{"generation": generations.get(key)} for key in zip(latitudes, longitudes)]
+    return FakePool(handler=answer)
+
+def notified(pool):
+    return [args[1] for method, _, args in pool.calls if method == "execute"]
+
+class TestCacheInvalidator(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.cache = TTLCache(maxsize=100, ttl=600)
+        self.invalidator = CacheInvalidator(channel="test", check_interval=60)
+        self.places = TTLCache(maxsize=100, ttl=600)
+        self.changes = []
+        self.invalidator.cache = self.cache
+        self.invalidator.linked_caches = [self.places]
+        self.invalidator.on_change = lambda: self.changes.append(True)
+
+    async def test_notification_evicts_cells(self):
+        """Notified cells are evicted from every cache by their rounded key, whatever the REAL precision they arrive in."""
+        self.cache["37.7749_-122.4194"] = "payload"
+        self.cache["1.0_2.0"] = "other"
+        self.places["37.7749_-122.4194"] = ["places"]
+        latitude, longitude = float(np.float32(37.7749)), float(np.float32(-122.4194))
+
+        self.invalidator.on_notification(None, 1, "test", json.dumps([[latitude, longitude, 3]]))
+
+        self.assertEqual(list(self.cache), ["1.0_2.0"])
+        self.assertEqual(list(self.places), [])
+        self.assertEqual(self.changes, [True])
+
+    async def test_version_check_evicts_changed_cells(self):
+        """Entries whose cell generation moved on since they were ranked are evicted, the rest kept."""
+        self.invalidator.pool = generation_pool({(1.0, 1.0): 2, (2.0, 2.0): 5})
+        for key, latitude, version in (("1.0_1.0", 1.0, 2), ("2.0_2.0", 2.0, 4), ("3.0_3.0", 3.0, None)):
+            self.cache[key] = "payload"
+            self.invalidator.track(key, latitude, latitude, version)
+        self.invalidator.track("4.0_4.0", 4.0, 4.0, 1)
+
+        self.assertEqual(await self.invalidator.check_versions(), 1)
+        self.assertEqual(sorted(self.cache), ["1.0_1.0", "3.0_3.0"])
+        self.assertEqual(sorted(self.invalidator.versions), ["1.0_1.0", "3.0_3.0"])
+        self.assertEqual(self.changes, [True])
+
+    async def test_notify_splits_large_payloads(self):
+        """Many cells are sent as several notifications, each under the Postgres payload limit."""
+        pool = generation_pool({})
+        cells = [(37.0 + i / 10000, -122.0 - i / 10000, i) for i in range(1000)]
+
+        await self.invalidator.notify(pool, cells)
+
+        self.assertGreater(len(notified(pool)), 1)
+        self.assertTrue(all(len(payload) <= MAX_NOTIFY_BYTES for payload in notified(pool)))
+        self.assertEqual(sum(len(json.loads(payload)) for payload in notified(pool)), 1000)
+
+if __name__ == "__main__":
+    unittest.main()
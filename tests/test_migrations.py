@@ -0,0 +1,45 @@
+import os
+import unittest
+from dotenv import load_dotenv
+from app.database.init_db import get_db_connection
+from app.database.migrations import MIGRATIONS, migrate, check_query_plans, plan_scans
+
+load_dotenv()
+
+class TestPlanScans(unittest.TestCase):
+
+    def test_collects_nested_scans(self):
+        """Scan nodes are found anywhere in the plan tree."""
+        plan = {"Node Type": "Nested Loop", "Plans": [
+            {"Node Type": "Function Scan"},
+            {"Node Type": "Index Scan", "Relation Name": "google_nearby_places"},
+        ]}
+
+        self.assertEqual(plan_scans(plan), [("Index Scan", "google_nearby_places")])
+
+class TestMigrations(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        if not os.getenv("DATABASE_URL"):
+            raise EnvironmentError("DATABASE_URL for testing is not set in environment variables.")
+        self.conn = await get_db_connection()
+
+    async def asyncTearDown(self):
+        await self.conn.close()
+
+    async def test_migrate_is_idempotent(self):
+        """Every migration is recorded once and a second run applies nothing."""
+        await migrate(self.conn)
+
+        self.assertEqual(await migrate(self.conn), [])
+        versions = [row["version"] for row in await self.conn.fetch("SELECT version FROM schema_migrations ORDER BY version")]
+        self.assertEqual(versions, [version for version, _, _ in MIGRATIONS])
+
+    async def test_hot_queries_use_indexes(self):
+        """The hot queries are planned with index scans once migrated."""
+        await migrate(self.conn)
+
+        self.assertEqual(await check_query_plans(self.conn), {})
+
+if __name__ == "__main__":
+    unittest.main()
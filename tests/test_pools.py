@@ -0,0 +1,78 @@
+import asyncio
+import time
+import unittest
+import asyncpg
+from app.database.pools import DatabasePools
+from tests.fakes import FakePool
+
+def lag_pool(lag=0.0, fail=False):
+    """Replica pool reporting a fixed lag, or one that cannot be reached."""
+    return FakePool(handler=lambda method, query, args: lag, fail=ConnectionRefusedError("replica down") if fail else None)
+
+class TestDatabasePools(unittest.IsolatedAsyncioTestCase):
+
+    def pools(self, replica):
+        pools = DatabasePools(write_url="primary", read_url="replica", max_lag=5, lag_check_interval=1)
+        pools.write, pools.read = "primary pool", replica
+        return pools
+
+    async def test_reads_go_to_a_healthy_replica(self):
+        """Reads use the replica once its lag is known and within bounds."""
+        pools = self.pools(lag_pool(lag=0.5))
+
+        self.assertEqual(pools.reader(), "primary pool")
+        await pools.check_lag()
+        self.assertIs(pools.reader(), pools.read)
+
+    async def test_lagging_or_failed_replica_falls_back_to_primary(self):
+        """A replica over the lag limit, or one that cannot be reached, is skipped."""
+        pools = self.pools(lag_pool(lag=30))
+        await pools.check_lag()
+        self.assertEqual(pools.reader(), "primary pool")
+
+        pools.read = lag_pool(fail=True)
+        self.assertIsNone(await pools.check_lag())
+        self.assertEqual(pools.reader(), "primary pool")
+
+    async def test_monitor_survives_unexpected_errors(self):
+        """An error check_lag does not expect sends reads to the primary and the monitor keeps checking."""
+        def broken(method, query, args):
+            raise asyncpg.InterfaceError("cannot call Connection.fetchval(): connection has been released")
+
+        pools = self.pools(lag_pool(lag=0.5))
+        pools.lag_check_interval = 0.01
+        await pools.check_lag()
+        pools.read.handler = broken
+        pools.start()
+        await asyncio.sleep(0.05)
+
+        self.assertIsNone(pools.replica_lag)
+        self.assertFalse(pools.task.done())
+        pools.read.handler = lambda method, query, args: 0.5
+        await asyncio.sleep(0.05)
+        self.assertEqual(pools.replica_lag, 0.5)
+        pools.task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await pools.task
+
+    async def test_own_writes_are_read_from_the_primary(self):
+        """Right after a write, reads stay on the primary until the replica has had time to replay it."""
+        pools = self.pools(lag_pool(lag=0.5))
+        await pools.check_lag()
+        pools.wrote()
+        self.assertEqual(pools.reader(), "primary pool")
+
+        pools.last_write = time.monotonic() - 2
+        self.assertIs(pools.reader(), pools.read)
+
+    async def test_without_a_replica_everything_reads_the_primary(self):
+        """With no DATABASE_READ_URL there is no read pool and no lag monitor."""
+        pools = DatabasePools(write_url="primary", read_url="")
+        pools.write = "primary pool"
+        pools.start()
+
+        self.assertEqual(pools.reader(), "primary pool")
+        self.assertIsNone(pools.task)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from app.geo import haversine_m
+from app.google_places.client import GooglePlacesClient
+from app.google_places.fake import FakePlacesProvider
+from app.google_places.providers import CassetteStore, RecordingProvider, ReplayProvider
+from app.google_places.rate_limit import TokenBucket, QuotaBudget
+
+class FakeLive:
+    billable = True
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.calls = 0
+
+    async def request(self, params, timeout):
+        self.calls += 1
+        return self.responses[params.get("pagetoken") or params["type"]]
+
+    async def close(self):
+        pass
+
+class TestCassettes(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = CassetteStore(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_keys_ignore_the_api_key(self):
+        """Requests are addressed by their parameters, never by the API key."""
+        params = {"location": "1.0,2.0", "radius": 500, "type": "cafe"}
+
+        self.assertEqual(CassetteStore.request_key({**params, "key": "a"}), CassetteStore.request_key({**params, "key": "b"}))
+        self.assertNotEqual(CassetteStore.request_key(params), CassetteStore.request_key({**params, "type": "bar"}))
+
+    async def test_record_then_replay(self):
+        """Recorded pages replay identically, including pagination, without spending budget."""
+        live = FakeLive({
+            "cafe": (200, {"status": "OK", "results": [{"place_id": "a"}], "next_page_token": "t1"}),
+            "t1": (200, {"status": "OK", "results": [{"place_id": "b"}]}),
+        })
+        recorder = GooglePlacesClient("secret", rate_limiter=TokenBucket(rate=1000, burst=1000), quota_budget=QuotaBudget(0, 0),
+                                      attempts=1, provider=RecordingProvider(live, self.store))
+        recorder.page_token_delay = 0
+        recorded = [page async for page in recorder.nearby_search_pages(1.0, 2.0, 500, "cafe")]
+
+        budget = QuotaBudget(daily_limit=1, monthly_limit=0)
+        replayer = GooglePlacesClient("other", rate_limiter=TokenBucket(rate=1000, burst=1000), quota_budget=budget,
+                                      attempts=1, provider=ReplayProvider(self.store, latency_ms=1, jitter_ms=1))
+        replayer.page_token_delay = 0
+        replayed = [page async for page in replayer.nearby_search_pages(1.0, 2.0, 500, "cafe")]
+
+        self.assertEqual(replayed, recorded)
+        self.assertEqual(live.calls, 2)
+        self.assertEqual(budget.daily_calls, 0)
+        files = [name for _, _, names in os.walk(self.directory.name) for name in names]
+        self.assertEqual(len(files), 2)
+        self.assertTrue(all(name.endswith(".json.gz") for name in files))
+
+    async def test_concurrent_writes_of_one_request(self):
+        """Writers racing on the same request each use their own temporary file and leave one complete cassette."""
+        params = {"location": "1.0,2.0", "radius": 500, "type": "cafe"}
+
+        await asyncio.gather(*(asyncio.to_thread(self.store.write, params, 200, {"status": "OK", "results": [{"place_id": str(i)}] * 50})
+                               for i in range(8)))
+
+        status, body = self.store.read(params)
+        self.assertEqual(status, 200)
+        self.assertEqual(len(body["results"]), 50)
+        files = [name for _, _, names in os.walk(self.directory.name) for name in names]
+        self.assertEqual(files, [f"{CassetteStore.request_key(params)}.json.gz"])
+
+    async def test_only_successful_responses_are_recorded(self):
+        """Google errors sent with HTTP 200 are passed on but never archived."""
+        live = FakeLive({
+            "cafe": (200, {"status": "OVER_QUERY_LIMIT"}),
+            "bar": (200, {"status": "ZERO_RESULTS", "results": []}),
+        })
+        recorder = RecordingProvider(live, self.store)
+
+        self.assertEqual(await recorder.request({"type": "cafe"}, 1), (200, {"status": "OVER_QUERY_LIMIT"}))
+        await recorder.request({"type": "bar"}, 1)
+
+        self.assertIsNone(self.store.read({"type": "cafe"}))
+        self.assertEqual(self.store.read({"type": "bar"}), (200, {"status": "ZERO_RESULTS", "results": []}))
+
+    async def test_replay_miss_and_timeout(self):
+        """Unrecorded requests get a 404; injected latency past the timeout behaves like a timeout."""
+        provider = ReplayProvider(self.store, latency_ms=0, jitter_ms=0)
+        self.assertEqual(await provider.request({"type": "bar"}, timeout=1), (404, "not recorded"))
+
+        slow = ReplayProvider(self.store, latency_ms=50, jitter_ms=0)
+        with self.assertRaises(asyncio.TimeoutError):
+            await slow.request({"type": "bar"}, timeout=0.01)
+
+class TestFakeProvider(unittest.IsolatedAsyncioTestCase):
+
+    PARAMS = {"location": "37.7749,-122.4194", "radius": 3000, "type": "cafe", "key": "unused"}
+
+    async def test_deterministic_and_google_shaped(self):
+        """The same seed yields the same places; results match the type and radius, 20 per page."""
+        first = await FakePlacesProvider(seed=3, density=200).request(self.PARAMS, timeout=1)
+        second = await FakePlacesProvider(seed=3, density=200).request(self.PARAMS, timeout=1)
+        other = await FakePlacesProvider(seed=4, density=200).request(self.PARAMS, timeout=1)
+
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        status, body = first
+        self.assertEqual((status, body["status"], len(body["results"])), (200, "OK", 20))
+        for place in body["results"]:
+            location = place["geometry"]["location"]
+            self.assertIn("cafe", place["types"])
+            self.assertLessEqual(haversine_m(37.7749, -122.4194, location["lat"], location["lng"]), 3000)
+
+    async def test_pagination_through_the_client(self):
+        """Page tokens lead through at most 60 distinct results."""
+        client = GooglePlacesClient("fake", rate_limiter=TokenBucket(rate=1000, burst=1000), quota_budget=QuotaBudget(0, 0),
+                                    attempts=1, provider=FakePlacesProvider(seed=3, density=200))
+        client.page_token_delay = 0
+        pages = [page async for page in client.nearby_search_pages(37.7749, -122.4194, 3000, "cafe")]
+        place_ids = [place["place_id"] for page in pages for place in page]
+
+        self.assertEqual(len(pages), 3)
+        self.assertEqual(len(place_ids), 60)
+        self.assertEqual(len(set(place_ids)), 60)
+
+    async def test_injected_errors(self):
+        """The configured error rate turns responses into 503s."""
+        provider = FakePlacesProvider(seed=3, error_rate=1)
+
+        self.assertEqual(await provider.request(self.PARAMS, timeout=1), (503, "injected error"))
+
+if __name__ == "__main__":
+    unittest.main()
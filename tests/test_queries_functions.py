@@ -3,6 +3,8 @@ import os
 import asyncio
 from app.database.init_db import init_db, get_db_connection
 from app.services import AppService
+from app.fetch_planner import Tile
+from app.ranking import RankingEngine
 from unittest.mock import patch
 from dotenv import load_dotenv
 
@@ -40,6 +42,7 @@ class TestQueriesFunctions(unittest.IsolatedAsyncioTestCase):
         async with self.app_service.db_pool.acquire() as conn:
             await conn.execute("DELETE FROM user_coordinates;")
             await conn.execute("DELETE FROM google_nearby_places;")
+            await conn.execute("DELETE FROM cell_top_places;")
 
     async def test_generate_entry(self):
         """Verify that generate_entry correctly inserts a unique coordinate entry."""
@@ -55,6 +58,9 @@ class TestQueriesFunctions(unittest.IsolatedAsyncioTestCase):
         self.assertAlmostEqual(result["latitude"], MOCK_LATITUDE, places=4)
         self.assertAlmostEqual(result["longitude"], MOCK_LONGITUDE, places=4)
 
+    async def test_check_database_connection(self):
+        """The health check reports a reachable database as connected."""
+        self.assertTrue(await self.app_service.check_database_connection())
 
     async def test_rank_nearby_places(self):
         """Insert mock data and verify the ranking function returns expected places."""
@@ -70,6 +76,165 @@ class TestQueriesFunctions(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(len(ranked_places), 3, "Ranking did not retrieve expected number of places")
         self.assertEqual(ranked_places[0]['name'], "Place C", "Highest-rated place is not ranked first.")
 
+    async def test_rank_nearby_places_page_cursor(self):
+        """Walk the ranking with keyset cursors and verify pages neither overlap nor skip places."""
+        mock_data = [
+            (MOCK_LATITUDE, MOCK_LONGITUDE, str(i), f"Place {i}", "OPERATIONAL", 3.0 + (i % 5) * 0.5, 10 * i, f"Location {i}", "['restaurant']", 2, "icon", "color", "mask", "photo_ref", 400, 400, i % 2 == 0)
+            for i in range(7)
+        ]
+        await self.insert_mock_places(mock_data)
+
+        full = await self.app_service.rank_nearby_places_page(MOCK_LATITUDE, MOCK_LONGITUDE, k=7)
+        paged, cursor = [], None
+        while True:
+            page = await self.app_service.rank_nearby_places_page(MOCK_LATITUDE, MOCK_LONGITUDE, k=3, cursor=cursor)
+            paged.extend(place["place_id"] for place in page["places"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+
+        self.assertIsNone(full["next_cursor"])
+        self.assertEqual(paged, [place["place_id"] for place in full["places"]])
+        self.assertTrue(full["places"][0]["open_now"], "Open places are not ranked first.")
+
+    async def test_rank_nearby_places_type_filter(self):
+        """Stored types are normalized to ids and the ranking can be filtered by type name."""
+        places = [
+            {"place_id": "t1", "name": "Cafe", "rating": 4.0, "types": ["cafe", "food"]},
+            {"place_id": "t2", "name": "Bar", "rating": 4.5, "types": ["bar", "food"]},
+        ]
+        await self.app_service.store_places_in_db_and_cache(MOCK_LATITUDE, MOCK_LONGITUDE, places)
+
+        cafes = await self.app_service.rank_nearby_places_page(MOCK_LATITUDE, MOCK_LONGITUDE, types=["cafe"])
+        food = await self.app_service.rank_nearby_places_page(MOCK_LATITUDE, MOCK_LONGITUDE, types=["food"])
+
+        self.assertEqual([place["place_id"] for place in cafes["places"]], ["t1"])
+        self.assertEqual([place["place_id"] for place in food["places"]], ["t2", "t1"])
+
+    async def test_upsert_writes_only_changed_places(self):
+        """Unchanged places are skipped, changed ones rewritten with a new version, new ones inserted."""
+        places = [
+            {"place_id": "u1", "name": "Stable", "rating": 4.0, "photos": [{"photo_reference": "a", "height": 1, "width": 1}]},
+            {"place_id": "u2", "name": "Changing", "rating": 3.0, "opening_hours": {"open_now": False}},
+        ]
+        first = await self.app_service.store_places_in_db_and_cache(MOCK_LATITUDE, MOCK_LONGITUDE, places)
+
+        places[0]["photos"][0]["photo_reference"] = "reissued"
+        places[1]["opening_hours"]["open_now"] = True
+        places.append({"place_id": "u3", "name": "New", "rating": 5.0})
+        second = await self.app_service.store_places_in_db_and_cache(MOCK_LATITUDE, MOCK_LONGITUDE, places)
+
+        self.assertEqual(first, {"inserted": 2, "updated": 0, "skipped": 0})
+        self.assertEqual(second, {"inserted": 1, "updated": 1, "skipped": 1})
+        async with self.app_service.db_pool.acquire() as conn:
+            rows = {row["place_id"]: row for row in await conn.fetch(
+                "SELECT place_id, version, open_now FROM google_nearby_places WHERE place_id LIKE 'u%'")}
+        self.assertEqual((rows["u1"]["version"], rows["u2"]["version"], rows["u3"]["version"]), (1, 2, 1))
+        self.assertTrue(rows["u2"]["open_now"])
+
+    async def test_shared_place_serves_every_tile(self):
+        """A place returned by two tile searches is stored once and ranked for both areas."""
+        shared = {"place_id": "s1", "name": "Shared", "rating": 4.0}
+        first_tile = Tile.containing(MOCK_LATITUDE, MOCK_LONGITUDE, 13)
+        second_tile = Tile.containing(MOCK_LATITUDE + 0.05, MOCK_LONGITUDE, 13)
+        await self.app_service.store_places_in_db_and_cache(*first_tile.center(), [shared], tile=first_tile)
+        await self.app_service.store_places_in_db_and_cache(
+            *second_tile.center(), [shared, {"place_id": "s2", "name": "Other", "rating": 3.0}], tile=second_tile)
+
+        ranked = await self.app_service.rank_nearby_places_page(MOCK_LATITUDE + 0.05, MOCK_LONGITUDE)
+
+        self.assertEqual([place["place_id"] for place in ranked["places"]], ["s1", "s2"])
+        async with self.app_service.db_pool.acquire() as conn:
+            self.assertEqual(await conn.fetchval("SELECT COUNT(*) FROM google_nearby_places WHERE place_id = 's1'"), 1)
+
+    async def test_check_coordinates_in_db_many(self):
+        """The batched existence check agrees with one check per coordinate, in input order."""
+        coordinates = [(MOCK_LATITUDE, MOCK_LONGITUDE), (MOCK_LATITUDE + 1, MOCK_LONGITUDE), (MOCK_LATITUDE, MOCK_LONGITUDE + 1)]
+        await self.app_service.generate_entry(*coordinates[0])
+        await self.app_service.generate_entry(*coordinates[2])
+
+        found = await self.app_service.check_coordinates_in_db_many(coordinates)
+
+        self.assertEqual(found, [True, False, True])
+        self.assertEqual(found, [await self.app_service.check_coordinates_in_db(*c) for c in coordinates])
+        self.assertEqual(await self.app_service.check_coordinates_in_db_many([]), [])
+
+    async def test_rank_nearby_places_many(self):
+        """The LATERAL ranking returns the same first page as ranking each coordinate on its own."""
+        other_latitude = MOCK_LATITUDE + 0.5
+        await self.insert_mock_places([
+            (MOCK_LATITUDE, MOCK_LONGITUDE, "1", "Place A", "OPERATIONAL", 4.5, 100, "Location A", "", 2, "icon_a", "color_a", "mask_a", "photo_ref_a", 400, 400, True),
+            (MOCK_LATITUDE, MOCK_LONGITUDE, "2", "Place B", "OPERATIONAL", 4.0, 150, "Location B", "", 1, "icon_b", "color_b", "mask_b", "photo_ref_b", 300, 300, False),
+            (MOCK_LATITUDE, MOCK_LONGITUDE, "3", "Place C", "OPERATIONAL", 5.0, 50, "Location C", "", 3, "icon_c", "color_c", "mask_c", "photo_ref_c", 500, 500, True),
+            (other_latitude, MOCK_LONGITUDE, "4", "Place D", "OPERATIONAL", 3.5, 10, "Location D", "", 1, "icon_d", "color_d", "mask_d", "photo_ref_d", 200, 200, None),
+        ])
+        coordinates = [(MOCK_LATITUDE, MOCK_LONGITUDE), (other_latitude, MOCK_LONGITUDE), (MOCK_LATITUDE + 1, MOCK_LONGITUDE)]
+
+        ranked = await self.app_service.rank_nearby_places_many(coordinates, k=2)
+
+        self.assertEqual([[place["place_id"] for place in places] for places in ranked], [["3", "1"], ["4"], []])
+        for (latitude, longitude), places in zip(coordinates, ranked):
+            single = await self.app_service.rank_nearby_places_page(latitude, longitude, k=2)
+            self.assertEqual(places, single["places"])
+
+    async def test_cell_top_places_follow_stores(self):
+        """A precomputed cell ranking matches the live one, goes stale on a store to its tile and is refreshed."""
+        cells = self.app_service.cell_top_places
+        tile = Tile.containing(MOCK_LATITUDE, MOCK_LONGITUDE, self.app_service.fetch_planner.zoom)
+        await self.app_service.store_places_in_db_and_cache(*tile.center(), [{"place_id": "t1", "name": "First", "rating": 4.0}], tile=tile)
+        async with self.app_service.db_pool.acquire() as conn:
+            await cells.register(conn, MOCK_LATITUDE, MOCK_LONGITUDE, self.app_service.candidate_tile_keys(MOCK_LATITUDE, MOCK_LONGITUDE))
+        cells.pool, cells.rank_many = self.app_service.db_pool, self.app_service.rank_nearby_places_many
+        self.assertEqual(await cells.refresh(), 1)
+        live = await self.app_service.rank_nearby_places_page(MOCK_LATITUDE, MOCK_LONGITUDE)
+
+        async with self.app_service.db_pool.acquire() as conn:
+            self.assertEqual(await cells.lookup(conn, MOCK_LATITUDE, MOCK_LONGITUDE), live["places"])
+
+        await self.app_service.store_places_in_db_and_cache(
+            *tile.center(), [{"place_id": "t2", "name": "Second", "rating": 5.0}], append=True, tile=tile)
+        async with self.app_service.db_pool.acquire() as conn:
+            self.assertIsNone(await cells.lookup(conn, MOCK_LATITUDE, MOCK_LONGITUDE))
+        await cells.refresh()
+        async with self.app_service.db_pool.acquire() as conn:
+            ranked = await cells.lookup(conn, MOCK_LATITUDE, MOCK_LONGITUDE)
+        self.assertEqual([place["place_id"] for place in ranked], ["t2", "t1"])
+
+    async def test_store_notifies_other_processes(self):
+        """Storing places for a tracked cell evicts its cached payload through LISTEN/NOTIFY."""
+        invalidator = self.app_service.cache_invalidator
+        invalidator.start(self.app_service.db_pool, self.app_service.payload_cache)
+        self.addAsyncCleanup(invalidator.stop)
+        tile = Tile.containing(MOCK_LATITUDE, MOCK_LONGITUDE, self.app_service.fetch_planner.zoom)
+        async with self.app_service.db_pool.acquire() as conn:
+            await self.app_service.cell_top_places.register(
+                conn, MOCK_LATITUDE, MOCK_LONGITUDE, self.app_service.candidate_tile_keys(MOCK_LATITUDE, MOCK_LONGITUDE))
+        await asyncio.sleep(0.2)
+        key = f"{MOCK_LATITUDE}_{MOCK_LONGITUDE}"
+        self.app_service.payload_cache[key] = "cached payload"
+
+        await self.app_service.store_places_in_db_and_cache(*tile.center(), [{"place_id": "n1", "name": "New"}], tile=tile)
+        await asyncio.sleep(0.2)
+
+        self.assertNotIn(key, self.app_service.payload_cache)
+
+    async def test_cached_cells_are_invalidated_under_any_engine(self):
+        """With the score engine and no refresher, a ranked payload's cell is still registered and evicted by stores."""
+        invalidator = self.app_service.cache_invalidator
+        invalidator.start(self.app_service.db_pool, self.app_service.payload_cache)
+        self.addAsyncCleanup(invalidator.stop)
+        self.app_service.ranking_engine = RankingEngine()
+        tile = Tile.containing(MOCK_LATITUDE, MOCK_LONGITUDE, self.app_service.fetch_planner.zoom)
+        await asyncio.sleep(0.2)
+        key = f"{MOCK_LATITUDE}_{MOCK_LONGITUDE}"
+
+        await self.app_service.get_ranked_payload(MOCK_LATITUDE, MOCK_LONGITUDE)
+        self.assertIn(key, self.app_service.payload_cache)
+        await self.app_service.store_places_in_db_and_cache(*tile.center(), [{"place_id": "s1", "name": "Scored"}], tile=tile)
+        await asyncio.sleep(0.2)
+
+        self.assertNotIn(key, self.app_service.payload_cache)
+
     async def insert_mock_places(self, data):
         """Helper function to insert mock data for testing ranking."""
         async with self.app_service.db_pool.acquire() as conn:
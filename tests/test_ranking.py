@@ -0,0 +1,73 @@
+import unittest
+import numpy as np
+from app.ranking import RankingEngine, ScoringConfig, candidates_from_records, parse_weights
+
+ORIGIN = (37.7749, -122.4194)
+
+def record(rating, reviews, open_now=True, price_level=2, latitude=ORIGIN[0], longitude=ORIGIN[1]):
+    return {"rating": rating, "user_ratings_total": reviews, "open_now": open_now,
+            "price_level": price_level, "latitude": latitude, "longitude": longitude}
+
+class TestRankingEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.config = ScoringConfig(prior_mean=4.0, prior_weight=50, review_saturation=5000,
+                                    distance_scale_m=1500, price_preference=2)
+
+    def test_bayesian_rating_prefers_well_reviewed_places(self):
+        """A 4.8 with 4,000 reviews beats a 5.0 with 3."""
+        engine = RankingEngine(self.config, {"bayesian_rating": 1.0})
+        candidates = candidates_from_records([record(5.0, 3), record(4.8, 4000)])
+
+        best, _ = engine.top_k(candidates, *ORIGIN, 1)
+
+        self.assertEqual(best.tolist(), [1])
+
+    def test_distance_decay_prefers_closer_places(self):
+        """Identical places are ordered by distance from the query point."""
+        engine = RankingEngine(self.config, {"distance_decay": 1.0})
+        candidates = candidates_from_records([
+            record(4.5, 100, latitude=ORIGIN[0] + 0.02),
+            record(4.5, 100, latitude=ORIGIN[0] + 0.001),
+            record(4.5, 100, latitude=ORIGIN[0] + 0.01),
+        ])
+
+        best, scores = engine.top_k(candidates, *ORIGIN, 3)
+
+        self.assertEqual(best.tolist(), [1, 2, 0])
+        self.assertTrue(np.all(np.diff(scores) <= 0))
+
+    def test_missing_values_do_not_produce_nan(self):
+        """Unrated, unpriced places with unknown hours still get a finite score."""
+        engine = RankingEngine(self.config, {"bayesian_rating": 1.0, "open_now": 1.0, "price": 1.0, "review_prior": 1.0})
+        candidates = candidates_from_records([record(None, None, open_now=None, price_level=None)])
+
+        self.assertTrue(np.isfinite(engine.score(candidates, *ORIGIN)).all())
+
+    def test_top_k_matches_full_sort(self):
+        """argpartition selection returns the same winners as sorting every score."""
+        rng = np.random.default_rng(1)
+        count = 5000
+        candidates = {
+            "latitude": ORIGIN[0] + rng.normal(0, 0.02, count),
+            "longitude": ORIGIN[1] + rng.normal(0, 0.02, count),
+            "rating": rng.uniform(1, 5, count),
+            "user_ratings_total": rng.integers(0, 3000, count).astype(np.float64),
+            "open_now": rng.integers(0, 2, count).astype(np.float64),
+            "price_level": rng.integers(0, 5, count).astype(np.float64),
+        }
+        engine = RankingEngine(self.config)
+
+        best, _ = engine.top_k(candidates, *ORIGIN, 25)
+        expected = np.argsort(-engine.score(candidates, *ORIGIN), kind="stable")[:25]
+
+        self.assertEqual(best.tolist(), expected.tolist())
+
+    def test_parse_weights(self):
+        """Weights are read from `name=weight` lists and unknown components are rejected."""
+        self.assertEqual(parse_weights("bayesian_rating=1, distance_decay=0.5"), {"bayesian_rating": 1.0, "distance_decay": 0.5})
+        with self.assertRaises(ValueError):
+            parse_weights("popularity=1")
+
+if __name__ == "__main__":
+    unittest.main()
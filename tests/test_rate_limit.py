@@ -0,0 +1,113 @@
+import unittest
+from datetime import datetime, timezone
+from prometheus_client import REGISTRY
+from app.google_places.client import GooglePlacesClient
+from app.google_places.rate_limit import TokenBucket, QuotaBudget
+from tests.fakes import FakePool
+
+class FakeClock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+class TestTokenBucket(unittest.IsolatedAsyncioTestCase):
+
+    def test_burst_then_rate(self):
+        """The bucket allows a burst, then refills at the configured rate."""
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2, burst=3, clock=clock)
+
+        self.assertEqual([bucket.try_acquire() for _ in range(4)], [True, True, True, False])
+        clock.now += 0.5
+        self.assertTrue(bucket.try_acquire())
+        self.assertFalse(bucket.try_acquire())
+        self.assertAlmostEqual(bucket.wait_time(), 0.5)
+
+    async def test_acquire_gives_up_past_timeout(self):
+        """Callers are throttled instead of queueing longer than they are willing to wait."""
+        bucket = TokenBucket(rate=1, burst=1)
+
+        self.assertTrue(await bucket.acquire(timeout=0))
+        self.assertFalse(await bucket.acquire(timeout=0.1))
+
+class TestQuotaBudget(unittest.TestCase):
+
+    def test_daily_budget_resets_at_midnight_utc(self):
+        """A spent daily budget refuses calls until the next UTC day."""
+        clock = FakeClock(datetime(2026, 3, 10, 23, 0, tzinfo=timezone.utc).timestamp())
+        budget = QuotaBudget(daily_limit=2, monthly_limit=0, clock=clock)
+        budget.spend()
+        budget.spend()
+
+        self.assertEqual(budget.exhausted(), "daily")
+        self.assertEqual(budget.remaining(), {"daily": 0, "monthly": None})
+
+        clock.now += 2 * 3600
+        self.assertIsNone(budget.exhausted())
+        self.assertEqual(budget.remaining()["daily"], 2)
+
+    def test_monthly_budget_outlives_the_day(self):
+        """The monthly budget keeps counting across days."""
+        clock = FakeClock(datetime(2026, 3, 10, 12, 0, tzinfo=timezone.utc).timestamp())
+        budget = QuotaBudget(daily_limit=0, monthly_limit=3, clock=clock)
+        for _ in range(3):
+            budget.spend()
+            clock.now += 86400
+
+        self.assertEqual(budget.exhausted(), "monthly")
+        clock.now = datetime(2026, 4, 1, tzinfo=timezone.utc).timestamp()
+        self.assertIsNone(budget.exhausted())
+
+class TestBudgetMetric(unittest.TestCase):
+
+    def test_gauge_is_current_before_any_call_and_after_rollover(self):
+        """The remaining budget is exported from the start and resets with the period, without a call."""
+        clock = FakeClock(datetime(2026, 3, 10, 23, 0, tzinfo=timezone.utc).timestamp())
+        client = GooglePlacesClient("key", quota_budget=QuotaBudget(daily_limit=5, monthly_limit=0, clock=clock))
+        client.export_budget_metric()
+        daily = lambda: REGISTRY.get_sample_value("google_api_budget_remaining", {"period": "daily"})
+
+        self.assertEqual(daily(), 5)
+        client.quota_budget.spend()
+        self.assertEqual(daily(), 4)
+        clock.now += 2 * 3600
+        self.assertEqual(daily(), 5)
+
+class SharedUsage:
+    """google_quota_usage shared by every process; unlike Postgres it keeps spends that were rolled back."""
+
+    def __init__(self):
+        self.calls = {}
+
+    def __call__(self, method, query, args):
+        for key in args[0]:
+            self.calls[key] = self.calls.get(key, 0) + 1
+        return [{"period": key, "calls": self.calls[key]} for key in args[0]]
+
+class TestSharedQuotaBudget(unittest.IsolatedAsyncioTestCase):
+
+    async def test_budget_is_shared_between_processes(self):
+        """Two processes spending through the same table stop together at the fleet budget."""
+        clock = FakeClock(datetime(2026, 3, 10, 12, 0, tzinfo=timezone.utc).timestamp())
+        pool = FakePool(handler=SharedUsage())
+        first = QuotaBudget(daily_limit=3, monthly_limit=0, clock=clock, pool=pool)
+        second = QuotaBudget(daily_limit=3, monthly_limit=0, clock=clock, pool=pool)
+
+        self.assertIsNone(await first.reserve())
+        self.assertIsNone(await second.reserve())
+        self.assertIsNone(await first.reserve())
+        self.assertEqual(await second.reserve(), "daily")
+        self.assertEqual(first.remaining()["daily"], 0)
+        self.assertEqual(pool.calls[0][2], (["2026-03-10"],))
+
+    async def test_unreachable_database_counts_in_process(self):
+        """Without the shared table the budget still holds for this process."""
+        budget = QuotaBudget(daily_limit=1, monthly_limit=0, pool=FakePool(fail=ConnectionRefusedError("down")))
+
+        self.assertIsNone(await budget.reserve())
+        self.assertEqual(await budget.reserve(), "daily")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,303 @@
+import asyncio
+import unittest
+from app.google_places.client import GooglePlacesClient, PlacesError, PlacesRequestError, PlacesThrottled, CircuitOpen
+from app.google_places.rate_limit import TokenBucket, QuotaBudget
+from app.google_places.resilience import CircuitBreaker, LatencyTracker, backoff_delay
+
+class FakeClock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+class ScriptedClient(GooglePlacesClient):
+    """Client whose HTTP attempts replay a script of responses or exceptions."""
+
+    def __init__(self, script, breaker=None, attempts=3):
+        super().__init__("key", rate_limiter=TokenBucket(rate=1000, burst=1000), quota_budget=QuotaBudget(0, 0),
+                         breaker=breaker or CircuitBreaker(failure_threshold=5, reset_timeout=30),
+                         attempts=attempts, backoff_base=0, backoff_cap=0)
+        self.script = list(script)
+        self.calls = 0
+
+    async def request(self, params):
+        self.calls += 1
+        step = self.script.pop(0)
+        if isinstance(step, BaseException):
+            raise step
+        return step
+
+class SlowFirstClient(GooglePlacesClient):
+    """Client whose first request stalls and later ones answer quickly."""
+
+    def __init__(self, hedge_max_fraction=1.0):
+        super().__init__("key", rate_limiter=TokenBucket(rate=1000, burst=1000), quota_budget=QuotaBudget(0, 0),
+                         breaker=CircuitBreaker(failure_threshold=5, reset_timeout=30), attempts=1)
+        self.hedge_percentile = 90
+        self.hedge_max_fraction = hedge_max_fraction
+        for _ in range(self.latency.min_samples):
+            self.latency.record(0.01)
+        self.calls = 0
+
+    async def request(self, params):
+        self.calls += 1
+        await asyncio.sleep(0.2 if self.calls == 1 else 0)
+        return 200, {"status": "OK", "results": [{"place_id": f"call-{self.calls}"}]}
+
+class TypedClient(GooglePlacesClient):
+    """Client answering each place type (or page token) from a canned table, counting concurrent requests."""
+
+    def __init__(self, responses, concurrency=4):
+        super().__init__("key", rate_limiter=TokenBucket(rate=1000, burst=1000), quota_budget=QuotaBudget(0, 0),
+                         breaker=CircuitBreaker(failure_threshold=5, reset_timeout=30), attempts=1)
+        self.responses = responses
+        self.concurrency = concurrency
+        self.page_token_delay = 0
+        self.in_flight = self.max_in_flight = 0
+
+    async def request(self, params):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        return self.responses[params.get("pagetoken") or params["type"]]
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_opens_then_probes_after_reset(self):
+        """Consecutive failures open the breaker; after the reset timeout one probe decides its state."""
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+
+        clock.now += 10
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+        clock.now += 10
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow())
+
+    def test_backoff_is_capped_and_jittered(self):
+        """Backoff delays stay within the exponential envelope and the cap."""
+        for attempt in range(8):
+            delay = backoff_delay(attempt, 0.2, 2)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(2, 0.2 * 2 ** attempt))
+
+class TestGooglePlacesClient(unittest.IsolatedAsyncioTestCase):
+
+    async def test_transient_failures_are_retried(self):
+        """Timeouts and 5xx responses are retried until a good response arrives."""
+        client = ScriptedClient([asyncio.TimeoutError(), (503, "unavailable"), (200, {"status": "OK", "results": [{"place_id": "a"}]})])
+
+        self.assertEqual(await client.nearby_search(1.0, 2.0, 500, "restaurant"), [{"place_id": "a"}])
+        self.assertEqual(client.calls, 3)
+        self.assertEqual(client.breaker.state, CircuitBreaker.CLOSED)
+
+    async def test_client_errors_are_not_retried(self):
+        """Quota and request errors fail after one attempt and do not count against the breaker."""
+        for response in ((200, {"status": "OVER_QUERY_LIMIT"}), (403, "forbidden")):
+            client = ScriptedClient([response])
+            with self.assertRaises(PlacesRequestError):
+                await client.nearby_search(1.0, 2.0, 500, "restaurant")
+            self.assertEqual(client.calls, 1)
+            self.assertEqual(client.breaker.failures, 0)
+
+    async def test_zero_results_is_success(self):
+        """ZERO_RESULTS is an empty answer, not an error."""
+        client = ScriptedClient([(200, {"status": "ZERO_RESULTS", "results": []})])
+
+        self.assertEqual(await client.nearby_search(1.0, 2.0, 500, "restaurant"), [])
+
+    async def test_open_breaker_fails_fast(self):
+        """Once the breaker opens, calls fail without reaching Google."""
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+        client = ScriptedClient([asyncio.TimeoutError()] * 2, breaker=breaker)
+
+        with self.assertRaises(CircuitOpen):
+            await client.nearby_search(1.0, 2.0, 500, "restaurant")
+        self.assertEqual(client.calls, 2)
+
+        with self.assertRaises(CircuitOpen):
+            await client.nearby_search(1.0, 2.0, 500, "restaurant")
+        self.assertEqual(client.calls, 2)
+
+    async def test_throttled_or_cancelled_probe_is_released(self):
+        """A half-open probe that is throttled or cancelled before Google answers lets the next call probe."""
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=clock)
+        breaker.record_failure()
+        clock.now += 10
+        client = ScriptedClient([(200, {"status": "OK", "results": []})], breaker=breaker)
+        client.rate_limiter = TokenBucket(rate=1, burst=1)
+        client.rate_limiter.tokens = 0
+        client.rate_limit_wait = 0
+
+        with self.assertRaises(PlacesThrottled):
+            await client.search({"type": "cafe"})
+        self.assertFalse(breaker.probe_in_flight)
+
+        client.rate_limit_wait = 5
+        probe = asyncio.create_task(client.search({"type": "cafe"}))
+        await asyncio.sleep(0.01)
+        self.assertTrue(breaker.probe_in_flight)
+        probe.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await probe
+        self.assertFalse(breaker.probe_in_flight)
+
+        client.rate_limiter.tokens = 1
+        self.assertEqual(await client.search({"type": "cafe"}), {"status": "OK", "results": []})
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    async def test_exhausted_retries_raise(self):
+        """Persistent transient failures end in a PlacesError after the configured attempts."""
+        client = ScriptedClient([(500, "error")] * 2, attempts=2)
+
+        with self.assertRaises(PlacesError):
+            await client.nearby_search(1.0, 2.0, 500, "restaurant")
+        self.assertEqual(client.calls, 2)
+
+class TestPagination(unittest.IsolatedAsyncioTestCase):
+
+    async def collect(self, client):
+        return [page async for page in client.nearby_search_pages(1.0, 2.0, 500, "restaurant")]
+
+    async def test_follows_next_page_token(self):
+        """Pages are yielded in order until there is no token, retrying a token that is not valid yet."""
+        client = ScriptedClient([
+            (200, {"status": "OK", "results": [{"place_id": "a"}], "next_page_token": "t1"}),
+            (200, {"status": "INVALID_REQUEST"}),
+            (200, {"status": "OK", "results": [{"place_id": "b"}], "next_page_token": "t2"}),
+            (200, {"status": "OK", "results": [{"place_id": "c"}]}),
+        ])
+        client.page_token_delay = 0
+
+        self.assertEqual(await self.collect(client), [[{"place_id": "a"}], [{"place_id": "b"}], [{"place_id": "c"}]])
+
+    async def test_later_page_failure_keeps_earlier_pages(self):
+        """A failing second page ends paging without losing the first; max_pages bounds the search."""
+        client = ScriptedClient([(200, {"status": "OK", "results": [{"place_id": "a"}], "next_page_token": "t1"}),
+                                 (403, "forbidden")])
+        client.page_token_delay = 0
+        self.assertEqual(await self.collect(client), [[{"place_id": "a"}]])
+
+        client = ScriptedClient([(200, {"status": "OK", "results": [{"place_id": "a"}], "next_page_token": "t1"})])
+        client.max_pages = 1
+        self.assertEqual(await self.collect(client), [[{"place_id": "a"}]])
+        self.assertEqual(client.calls, 1)
+
+class TestMultiType(unittest.IsolatedAsyncioTestCase):
+
+    async def test_types_are_merged_and_deduplicated(self):
+        """Type searches run concurrently and each round yields only unseen places."""
+        client = TypedClient({
+            "restaurant": (200, {"status": "OK", "results": [{"place_id": "a"}, {"place_id": "b"}], "next_page_token": "r2"}),
+            "cafe": (200, {"status": "OK", "results": [{"place_id": "b"}, {"place_id": "c"}]}),
+            "bar": (200, {"status": "ZERO_RESULTS", "results": []}),
+            "r2": (200, {"status": "OK", "results": [{"place_id": "c"}, {"place_id": "d"}]}),
+        })
+
+        rounds = [(places, dict(counts)) async for places, counts in client.multi_type_pages(1.0, 2.0, 500, ["restaurant", "cafe", "bar"])]
+        self.assertEqual([[place["place_id"] for place in places] for places, _ in rounds], [["a", "b", "c"], ["d"]])
+        self.assertEqual(rounds[-1][1], {"restaurant": 4, "cafe": 2, "bar": 0})
+        self.assertEqual(client.max_in_flight, 3)
+
+    async def test_concurrency_limit_and_partial_failure(self):
+        """The concurrency limit holds, and one failing type does not fail the search but is reported as None."""
+        client = TypedClient({
+            "restaurant": (200, {"status": "OK", "results": [{"place_id": "a"}]}),
+            "cafe": (400, "bad request"),
+            "bar": (200, {"status": "OK", "results": [{"place_id": "b"}]}),
+        }, concurrency=1)
+
+        rounds = [(places, dict(counts)) async for places, counts in client.multi_type_pages(1.0, 2.0, 500, ["restaurant", "cafe", "bar"])]
+        self.assertEqual([places for places, _ in rounds], [[{"place_id": "a"}, {"place_id": "b"}]])
+        self.assertEqual(rounds[-1][1], {"restaurant": 1, "cafe": None, "bar": 1})
+        self.assertEqual(client.max_in_flight, 1)
+
+    async def test_hedges_take_their_own_concurrency_slot(self):
+        """Hedged requests count against the concurrency limit, and are skipped while every slot is taken."""
+        client = TypedClient({
+            "restaurant": (200, {"status": "OK", "results": [{"place_id": "a"}]}),
+            "cafe": (200, {"status": "OK", "results": [{"place_id": "b"}]}),
+            "bar": (200, {"status": "OK", "results": [{"place_id": "c"}]}),
+        }, concurrency=2)
+        client.hedge_percentile, client.hedge_max_fraction = 50, 1.0
+        for _ in range(client.latency.min_samples):
+            client.latency.record(0.001)
+
+        rounds = [places async for places, _ in client.multi_type_pages(1.0, 2.0, 500, ["restaurant", "cafe", "bar"])]
+        self.assertEqual(sorted(place["place_id"] for place in rounds[0]), ["a", "b", "c"])
+        self.assertEqual(client.hedges_sent, 1)
+        self.assertEqual(client.max_in_flight, 2)
+        # Both slots are free again, including the one the cancelled loser held
+        await asyncio.wait_for(asyncio.gather(client.semaphore().acquire(), client.semaphore().acquire()), 0.1)
+
+    async def test_all_types_failing_raises(self):
+        """When every type fails the search fails, so callers keep their stored results."""
+        client = TypedClient({"restaurant": (403, "denied"), "cafe": (403, "denied")})
+
+        with self.assertRaises(PlacesError):
+            async for _ in client.multi_type_pages(1.0, 2.0, 500, ["restaurant", "cafe"]):
+                pass
+
+class TestHedging(unittest.IsolatedAsyncioTestCase):
+
+    def test_latency_percentile(self):
+        """Percentiles are only reported once enough samples are seen."""
+        tracker = LatencyTracker(size=100, min_samples=10)
+        for value in range(9):
+            tracker.record(value)
+        self.assertIsNone(tracker.percentile(95))
+        tracker.record(9)
+        self.assertEqual(tracker.percentile(50), 5)
+        self.assertEqual(tracker.percentile(95), 9)
+
+    async def test_slow_request_is_hedged(self):
+        """A request slower than the hedge percentile is duplicated and the faster answer wins."""
+        client = SlowFirstClient()
+
+        places = await asyncio.wait_for(client.nearby_search(1.0, 2.0, 500, "restaurant"), timeout=0.15)
+        self.assertEqual(places, [{"place_id": "call-2"}])
+        self.assertEqual(client.hedges_sent, 1)
+        self.assertEqual(client.quota_budget.daily_calls, 2)
+
+    async def test_hedges_are_capped(self):
+        """With the hedge fraction spent the request waits for the primary."""
+        client = SlowFirstClient(hedge_max_fraction=0)
+
+        places = await client.nearby_search(1.0, 2.0, 500, "restaurant")
+        self.assertEqual(places, [{"place_id": "call-1"}])
+        self.assertEqual(client.hedges_sent, 0)
+
+    async def test_hedge_never_waits_for_a_token(self):
+        """Without a free rate-limit token the hedge is skipped instead of delaying the request."""
+        client = SlowFirstClient()
+        client.rate_limiter = TokenBucket(rate=1, burst=1)
+
+        places = await client.nearby_search(1.0, 2.0, 500, "restaurant")
+        self.assertEqual(places, [{"place_id": "call-1"}])
+        self.assertEqual(client.hedges_sent, 0)
+
+    async def test_cancelled_loser_is_sampled(self):
+        """The cancelled primary leaves a latency sample too, not just the hedge that beat it."""
+        client = SlowFirstClient()
+
+        await client.nearby_search(1.0, 2.0, 500, "restaurant")
+        await asyncio.sleep(0)
+        self.assertEqual(len(client.latency.samples), client.latency.min_samples + 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import unittest
+import numpy as np
+from app.ranking import haversine_m
+from app.spatial_index import SpatialIndex
+
+def random_rows(count, seed=3):
+    rng = np.random.default_rng(seed)
+    latitudes = 37.77 + rng.normal(0, 0.1, count)
+    longitudes = -122.42 + rng.normal(0, 0.1, count)
+    return [(f"p{i}", f"Place {i}", float(latitudes[i]), float(longitudes[i]), 4.0, 10, True, 2)
+            for i in range(count)], latitudes, longitudes
+
+class TestSpatialIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.rows, self.latitudes, self.longitudes = random_rows(20000)
+        self.index = SpatialIndex(cell_deg=0.01, rebuild_threshold=1000)
+        self.index.add_many(self.rows)
+
+    def test_radius_matches_brute_force(self):
+        """Radius queries return exactly the places a full scan finds, nearest first."""
+        for latitude, longitude, radius_m in [(37.77, -122.42, 500), (37.80, -122.50, 2000), (37.60, -122.30, 50)]:
+            indexes, distances = self.index.radius(latitude, longitude, radius_m)
+            expected = np.nonzero(haversine_m(latitude, longitude, self.latitudes, self.longitudes) <= radius_m)[0]
+
+            self.assertEqual(sorted(indexes.tolist()), expected.tolist())
+            self.assertTrue(np.all(np.diff(distances) >= 0))
+
+    def test_nearest_matches_brute_force(self):
+        """k-NN returns the k smallest distances, including far from any place."""
+        for latitude, longitude in [(37.77, -122.42), (36.0, -120.0)]:
+            _, distances = self.index.nearest(latitude, longitude, 15)
+            expected = np.sort(haversine_m(latitude, longitude, self.latitudes, self.longitudes))[:15]
+
+            np.testing.assert_allclose(distances, expected)
+
+    def test_incremental_adds_are_visible_before_rebuild(self):
+        """Places added after the last rebuild are found, and duplicates are ignored."""
+        added = self.index.add_many([("new", "New", 37.77, -122.42, None, None, None, None), self.rows[0]])
+        indexes, distances = self.index.nearest(37.77, -122.42, 1)
+        place = self.index.place(indexes[0], distances[0])
+
+        self.assertEqual(added, 1)
+        self.assertLess(self.index.indexed, len(self.index))
+        self.assertEqual(place["place_id"], "new")
+        self.assertIsNone(place["rating"])
+        self.assertIsNone(place["price_level"])
+        other = self.index.place(0)
+        self.assertEqual((other["user_ratings_total"], other["price_level"]), (10, 2))
+        self.assertIsInstance(other["user_ratings_total"], int)
+
+    def test_antimeridian(self):
+        """A radius crossing 180 degrees finds places on both sides."""
+        index = SpatialIndex(cell_deg=0.01, rebuild_threshold=1)
+        index.add_many([("east", "E", 0.0, 179.999, 4.0, 1, True, 1), ("west", "W", 0.0, -179.999, 4.0, 1, True, 1)])
+
+        indexes, _ = index.radius(0.0, 179.9995, 1000)
+
+        self.assertEqual(sorted(index.place_ids[i] for i in indexes), ["east", "west"])
+
+    def test_box_around_the_pole_spans_the_world_once(self):
+        """Near a pole the search box covers every longitude, and each place is still found once."""
+        index = SpatialIndex(cell_deg=1.0, rebuild_threshold=1)
+        index.add_many([(f"p{lon}", "P", 89.9, float(lon), 4.0, 1, True, 1) for lon in range(-160, 180, 40)])
+
+        indexes, _ = index.radius(89.9, 20.0, 50000)
+
+        self.assertEqual(sorted(indexes.tolist()), list(range(9)))
+
+    def test_type_filter(self):
+        """Type filters keep places of any requested type, and unknown types match nothing."""
+        index = SpatialIndex(cell_deg=0.01, rebuild_threshold=1)
+        index.add_many([("cafe", "C", 0.0, 0.0, 4.0, 1, True, 1, ["cafe", "food"]),
+                        ("bar", "B", 0.0, 0.001, 4.0, 1, True, 1, ["bar", "food"]),
+                        ("untyped", "U", 0.0, 0.0005, 4.0, 1, True, 1)])
+
+        found = lambda indexes: sorted(index.place_ids[i] for i in indexes)
+        self.assertEqual(found(index.radius(0.0, 0.0, 1000, types=["cafe"])[0]), ["cafe"])
+        self.assertEqual(found(index.radius(0.0, 0.0, 1000, types=["cafe", "bar"])[0]), ["bar", "cafe"])
+        self.assertEqual(found(index.nearest(0.0, 0.001, 1, types=["cafe"])[0]), ["cafe"])
+        self.assertEqual(len(index.nearest(0.0, 0.0, 3, types=["museum"])[0]), 0)
+
+    def test_replaced_places_are_updated_in_place(self):
+        """Re-adding a changed place overwrites its attributes, types and grid cell; other re-adds are ignored."""
+        index = SpatialIndex(cell_deg=0.01, rebuild_threshold=1)
+        index.add_many([("a", "A", 0.0, 0.0, 3.0, 10, False, 1, ["cafe"]), ("b", "B", 0.0, 0.001, 4.0, 5, True, 2)])
+
+        index.add_many([("a", "A2", 0.05, 0.05, 4.5, 12, True, 2, ["bar"]), ("b", "B2", 0.0, 0.001, 1.0, 1, False, 1)],
+                       replace={"a"})
+
+        self.assertEqual(len(index), 2)
+        place = index.place(index.positions["a"])
+        self.assertEqual((place["name"], place["rating"], place["open_now"], place["latitude"]), ("A2", 4.5, True, 0.05))
+        self.assertEqual(index.place(index.positions["b"])["rating"], 4.0)
+        self.assertEqual([index.place_ids[i] for i in index.radius(0.05, 0.05, 100)[0]], ["a"])
+        self.assertEqual(len(index.radius(0.0, 0.0, 100)[0]), 0)
+        self.assertEqual([index.place_ids[i] for i in index.radius(0.05, 0.05, 100, types=["bar"])[0]], ["a"])
+        self.assertEqual(len(index.radius(0.05, 0.05, 100, types=["cafe"])[0]), 0)
+
+    def test_type_filter_beyond_one_mask_word(self):
+        """Types first seen after the 64th still get a bit, including for places stored before they appeared."""
+        index = SpatialIndex(cell_deg=0.01, rebuild_threshold=1, capacity=2)
+        index.add_many([("first", "F", 0.0, 0.0, 4.0, 1, True, 1, ["type-0"])])
+        index.add_many([(f"place-{i}", "P", 0.0, 0.0001 * i, 4.0, 1, True, 1, [f"type-{i}", "shared"]) for i in range(1, 100)])
+
+        found = lambda indexes: sorted(index.place_ids[i] for i in indexes)
+        self.assertEqual(found(index.radius(0.0, 0.0, 1000, types=["type-0"])[0]), ["first"])
+        self.assertEqual(found(index.radius(0.0, 0.0, 1000, types=["type-70"])[0]), ["place-70"])
+        self.assertEqual(found(index.radius(0.0, 0.0, 2000, types=["type-0", "type-99"])[0]), ["first", "place-99"])
+        self.assertEqual(len(index.radius(0.0, 0.0, 2000, types=["shared"])[0]), 99)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import asyncio
+import unittest
+from app.database.write_behind import VisitBuffer
+from tests.fakes import FakePool
+
+class RecordingPool(FakePool):
+    """Keeps the rows of every batch insert, answering with asyncpg's status string."""
+
+    def __init__(self, fail=False):
+        super().__init__(handler=self.insert)
+        self.batches = []
+        self.rows = set()
+        self.failing = fail
+
+    def insert(self, method, query, args):
+        if self.failing:
+            raise ConnectionError("database unavailable")
+        latitudes, longitudes, visitor_ids = args
+        batch = list(zip(latitudes, longitudes))
+        self.batches.append(batch)
+        new = set(batch) - self.rows
+        self.rows |= new
+        return f"INSERT 0 {len(new)}"
+
+class TestVisitBuffer(unittest.IsolatedAsyncioTestCase):
+
+    async def test_flushes_on_size_and_on_stop(self):
+        """A full batch is written at once; stop() writes the remainder."""
+        pool = RecordingPool()
+        buffer = VisitBuffer(batch_size=3, flush_interval=60, max_pending=100)
+        buffer.start(pool)
+        for i in range(3):
+            buffer.add(1.0, float(i))
+        buffer.add(1.0, 0.0)
+        await asyncio.sleep(0.01)
+        buffer.add(1.0, 3.0)
+
+        self.assertEqual(len(pool.batches), 1)
+        self.assertEqual(len(pool.batches[0]), 3)
+
+        await buffer.stop()
+        self.assertEqual(len(pool.rows), 4)
+        self.assertFalse(buffer.running)
+
+    async def test_flushes_on_interval(self):
+        """Pending visits are written after the flush interval even below the batch size."""
+        pool = RecordingPool()
+        buffer = VisitBuffer(batch_size=100, flush_interval=0.02, max_pending=100)
+        buffer.start(pool)
+        buffer.add(1.0, 2.0)
+        await asyncio.sleep(0.05)
+
+        self.assertEqual(pool.batches, [[(1.0, 2.0)]])
+        await buffer.stop()
+
+    async def test_full_batch_before_start(self):
+        """Filling a batch before start() does not fail, and the batch is written once the buffer starts."""
+        pool = RecordingPool()
+        buffer = VisitBuffer(batch_size=2, flush_interval=60, max_pending=100)
+
+        self.assertTrue(all(buffer.add(1.0, float(i)) for i in range(2)))
+        buffer.start(pool)
+        await asyncio.sleep(0.01)
+
+        self.assertEqual(pool.batches, [[(1.0, 0.0), (1.0, 1.0)]])
+        await buffer.stop()
+
+    async def test_memory_is_bounded(self):
+        """Beyond max_pending new coordinates are dropped; repeated ones are absorbed."""
+        buffer = VisitBuffer(batch_size=100, flush_interval=60, max_pending=2)
+
+        self.assertEqual([buffer.add(0.0, float(i)) for i in range(3)], [True, True, False])
+        self.assertTrue(buffer.add(0.0, 1.0))
+        self.assertEqual(len(buffer.pending), 2)
+
+    async def test_failed_flush_keeps_the_batch(self):
+        """A failed write leaves the visits pending for the next flush."""
+        pool = RecordingPool(fail=True)
+        buffer = VisitBuffer(batch_size=100, flush_interval=60, max_pending=100)
+        buffer.pool = pool
+        buffer.add(1.0, 2.0)
+
+        self.assertEqual(await buffer.flush(), 0)
+        pool.failing = False
+        self.assertEqual(await buffer.flush(), 1)
+        self.assertEqual(buffer.pending, {})
+
+if __name__ == "__main__":
+    unittest.main()